@@ -0,0 +1,211 @@
+"""A versioned JSON API for timelines and profiles, under /api/v1/.
+
+- `GET /api/v1/timeline`: the logged-in user's home timeline
+- `GET /api/v1/timeline/new?since=<id>`: only the warbles in it newer than
+  warble `id`, for clients polling for new ones
+- `GET /api/v1/users/<id>`: a user's profile
+- `GET /api/v1/users/<id>/messages`: a user's warbles, newest first
+
+Lists of warbles are paged with the same `before` and `after` cursors as the
+HTML pages (see pagination.py), and come back as:
+
+    {"messages": [{"id": "...", "text": "...", "timestamp": "...",
+                   "user_id": 12}, ...],
+     "users": {"12": {"username": "...", "image_url": "..."}},
+     "older": "...", "newer": null}
+
+Each author is sent once, in `users`, however many of their warbles are on
+the page. Warble ids (and the cursors made from them) are strings, since
+snowflake ids don't fit in a JavaScript number. Timestamps are ISO 8601, in
+UTC.
+
+The views select plain column tuples instead of ORM objects and encode them
+with `orjson` when it is installed (falling back to the standard library's
+`json`), as building and serializing objects dominates the cost of a page.
+"""
+
+import json
+
+from flask import Blueprint, current_app, g, request
+from sqlalchemy import func
+
+import caching
+import timeline
+from models import db, Message, User
+from pagination import paginate, requested_cursors
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MESSAGE_COLUMNS = (Message.id, Message.text, Message.timestamp,
+                   Message.user_id, User.username, User.image_url)
+
+PROFILE_COLUMNS = (User.id, User.username, User.image_url,
+                   User.header_image_url, User.bio, User.location,
+                   User.messages_count, User.following_count,
+                   User.followers_count, User.likes_count,
+                   User.profile_version)
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def encode(payload):
+    """Serialize `payload` as compact JSON bytes."""
+
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+
+def respond(payload, status=200):
+    return current_app.response_class(encode(payload), status=status,
+                                      mimetype='application/json')
+
+
+def error(message, status):
+    return respond({'error': message}, status)
+
+
+def timestamp(value):
+    return value.isoformat() + 'Z'
+
+
+def cursor(value):
+    return str(value) if value is not None else None
+
+
+def message_rows():
+    """A query for warbles as MESSAGE_COLUMNS rows."""
+
+    return (db.session.query(*MESSAGE_COLUMNS)
+            .join(User, User.id == Message.user_id))
+
+
+def message_payload(rows):
+    """The `messages` and `users` of a payload for MESSAGE_COLUMNS rows."""
+
+    messages = []
+    users = {}
+
+    for msg_id, text, posted, user_id, username, image_url in rows:
+        messages.append({'id': str(msg_id),
+                         'text': text,
+                         'timestamp': timestamp(posted),
+                         'user_id': user_id})
+        users[str(user_id)] = {'username': username, 'image_url': image_url}
+
+    return {'messages': messages, 'users': users}
+
+
+def message_page(page):
+    """The payload for a page of MESSAGE_COLUMNS rows."""
+
+    return {**message_payload(page),
+            'older': cursor(page.older),
+            'newer': cursor(page.newer)}
+
+
+@bp.route('/timeline')
+@caching.policy('timeline')
+def home_timeline():
+    """The logged-in user's home timeline."""
+
+    if not g.user:
+        return error("Access unauthorized.", 401)
+
+    pulled = timeline.pulled_author_ids(g.user.id)
+    not_modified = caching.not_modified(timeline.marker(g.user.id, pulled))
+    if not_modified:
+        return not_modified
+
+    before, after = requested_cursors()
+    page = timeline.home_timeline(g.user.id, before, after, pulled=pulled,
+                                  query=message_rows())
+    return respond(message_page(page))
+
+
+@bp.route('/timeline/new')
+@caching.policy('revalidate')
+def new_in_timeline():
+    """Warbles in the logged-in user's home timeline newer than `since`.
+
+    Clients poll with the id of the newest warble they have. Whether there
+    is anything newer is decided from the timeline's latest entry alone:
+    if nothing has changed since the last poll the answer is a 304 (or an
+    empty list, without an If-None-Match), and the timeline itself is only
+    read when there are new warbles. They come a page at a time, newest
+    first; `newer` is set if there are more still to fetch.
+    """
+
+    if not g.user:
+        return error("Access unauthorized.", 401)
+
+    since = request.args.get('since', type=int)
+    if since is None:
+        return error("A since cursor is required.", 400)
+
+    pulled = timeline.pulled_author_ids(g.user.id)
+    latest = timeline.latest_id(g.user.id, pulled)
+
+    not_modified = caching.not_modified(latest)
+    if not_modified:
+        return not_modified
+
+    if latest is None or latest <= since:
+        return respond({'messages': [], 'users': {},
+                        'older': None, 'newer': None})
+
+    page = timeline.home_timeline(g.user.id, after=since, pulled=pulled,
+                                  query=message_rows())
+    return respond(message_page(page))
+
+
+@bp.route('/users/<int:user_id>')
+@caching.policy('revalidate')
+def user_profile(user_id):
+    """A user's profile and counts."""
+
+    row = (db.session.query(*PROFILE_COLUMNS)
+           .filter(User.id == user_id)
+           .first())
+    if row is None:
+        return error("Not found.", 404)
+
+    not_modified = caching.not_modified(*row)
+    if not_modified:
+        return not_modified
+
+    profile = dict(zip((column.key for column in PROFILE_COLUMNS), row))
+    del profile['profile_version']
+    return respond(profile)
+
+
+@bp.route('/users/<int:user_id>/messages')
+@caching.policy('revalidate')
+def user_messages(user_id):
+    """A page of a user's warbles, newest first."""
+
+    author = (db.session.query(User.messages_count, User.profile_version)
+              .filter(User.id == user_id)
+              .first())
+    if author is None:
+        return error("Not found.", 404)
+
+    newest_id = (db.session.query(func.max(Message.id))
+                 .filter(Message.user_id == user_id)
+                 .scalar())
+    not_modified = caching.not_modified(*author, newest_id)
+    if not_modified:
+        return not_modified
+
+    page = paginate(message_rows().filter(Message.user_id == user_id),
+                    Message.id)
+    return respond(message_page(page))
+
+
+def init_app(app):
+    """Serve the API from `app`."""
+
+    app.register_blueprint(bp)
@@ -1,14 +1,39 @@
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+import click
+from flask import (Flask, Response, render_template, request, flash, redirect,
+                   session, g, url_for, stream_with_context, jsonify, abort,
+                   get_flashed_messages)
 from flask_debugtoolbar import DebugToolbarExtension
+from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
 
+import api
+import assets
+import caching
+import counters
+import current_user
+import fragment_cache
+import likes
+import loading
+import migrations
+import passwords
+import replicas
+import search
+import sql_stats
+import stream
+import timeline
 from forms import UserAddForm, UserEditForm, LoginForm, MessageForm
-from models import db, connect_db, User, Message, Like
+from models import db, connect_db, User, Message, Like, Follows
+from pagination import (paginate, paginate_by_id, paginate_by_time,
+                        requested_cursors)
+from viewer_state import resolve_viewer_state
 
 CURR_USER_KEY = "curr_user"
 
+# Endpoints that never look at g.user, so don't need the session user at all
+ANONYMOUS_ENDPOINTS = {'static', 'logout'}
+
 app = Flask(__name__)
 
 # Get DB_URI from environ variable (useful for production/testing) or,
@@ -16,14 +41,70 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = (
     os.environ.get('DATABASE_URL', 'postgres:///warbler'))
 
+# Read replicas for GET requests, as comma-separated database URLs; after a
+# visitor writes, their reads stay on the primary for REPLICA_PIN_SECONDS
+app.config['SQLALCHEMY_REPLICA_URIS'] = [
+    url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+    if url]
+app.config['REPLICA_PIN_SECONDS'] = 10
+
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+
+# Materialized home timelines: authors with at least this many followers are
+# read at request time instead of being pushed into every follower's timeline
+app.config['TIMELINE_FANOUT_LIMIT'] = int(
+    os.environ.get('TIMELINE_FANOUT_LIMIT', 10000))
+app.config['TIMELINE_MAX_ENTRIES'] = 800
+
+# Seconds a browser may show its copy of the homepage before revalidating it
+app.config['TIMELINE_CACHE_SECONDS'] = 10
+
+# Seconds a logged-in user's profile row is cached per process for g.user
+app.config['CURRENT_USER_CACHE_TTL'] = 5
+
+# Rendered warble cards kept per process (or shared through Redis, if set)
+app.config['FRAGMENT_CACHE_SIZE'] = 10000
+app.config['FRAGMENT_CACHE_TTL'] = 60 * 60
+app.config['FRAGMENT_CACHE_REDIS_URL'] = os.environ.get('FRAGMENT_CACHE_REDIS_URL')
+
+# Live timeline streams: seconds between keep-alives, and the Redis server
+# that carries new warbles between processes (if not set, one process only)
+app.config['STREAM_HEARTBEAT_SECONDS'] = 15
+app.config['STREAM_REDIS_URL'] = os.environ.get('STREAM_REDIS_URL')
+
+# bcrypt work factor, and the process pool that hashes passwords
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['BCRYPT_WORKERS'] = int(os.environ.get('BCRYPT_WORKERS', 2))
+app.config['BCRYPT_MAX_QUEUE'] = 32
 toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+replicas.init_app(app)
+sql_stats.init_app(app)
+caching.init_app(app)
+assets.init_app(app)
+fragment_cache.init_app(app)
+api.init_app(app)
+stream.init_app(app)
+
+
+def stream_template(template_name, **context):
+    """Render a template as a stream, sending each chunk as it's ready.
+
+    The session cookie is saved before the body is sent, so flashed messages
+    are popped now, while that still removes them from the session.
+    """
+
+    context['flashes'] = get_flashed_messages(with_categories=True)
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    chunks = template.stream(context)
+    chunks.enable_buffering(5)
+    return Response(stream_with_context(chunks))
 
 
 ##############################################################################
@@ -32,14 +113,17 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+    The user is loaded lazily, on first use, by `current_user.CurrentUser`.
+    """
 
-    else:
+    if request.endpoint in ANONYMOUS_ENDPOINTS or CURR_USER_KEY not in session:
         g.user = None
 
+    else:
+        g.user = current_user.CurrentUser(session[CURR_USER_KEY])
+
 
 def do_login(user):
     """Log in user."""
@@ -102,6 +186,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # save the password hash if authenticate() upgraded it
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -126,34 +212,65 @@ def logout():
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Without a search, pages through every user by id ('after'/'before'
+    params). Can take a 'q' param in querystring to search by username, bio
+    or location, and a 'page' param to page through the results.
     """
 
-    search = request.args.get('q')
+    q = request.args.get('q')
+    page = prev_url = next_url = None
 
-    if not search:
-        users = User.query.all()
+    if not q:
+        page = paginate_by_id(loading.with_profile(User.query, 'user card'),
+                              User.id)
+        users = page.items
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        results = search.search_users(q, request.args.get('page', 1, type=int))
+        users = results.users
+
+        if results.page > 1:
+            prev_url = url_for('list_users', q=q, page=results.page - 1)
+        if results.has_next:
+            next_url = url_for('list_users', q=q, page=results.page + 1)
 
-    return render_template('users/index.html', users=users)
+    viewer = resolve_viewer_state(g.user, user_ids=[user.id for user in users])
+    return stream_template('users/index.html',
+                           users=users,
+                           page=page,
+                           viewer=viewer,
+                           prev_url=prev_url,
+                           next_url=next_url)
 
 
 @app.route('/users/<int:user_id>')
+@caching.policy('revalidate')
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    user = (loading.with_profile(User.query, 'profile header')
+            .get_or_404(user_id))
+    viewer = resolve_viewer_state(g.user, user_ids=[user.id])
+
+    newest_id = (db.session.query(func.max(Message.id))
+                 .filter(Message.user_id == user_id)
+                 .scalar())
+    not_modified = caching.not_modified(
+        user.profile_version, user.messages_count, user.following_count,
+        user.followers_count, user.likes_count, newest_id,
+        viewer.is_following(user))
+    if not_modified:
+        return not_modified
 
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    messages = Message.query.filter(Message.user_id == user_id)
+    page = paginate(loading.with_profile(messages, 'profile message'),
+                    Message.id)
+    return render_template('users/show.html',
+                           user=user,
+                           messages=page.items,
+                           page=page,
+                           viewer=viewer)
 
 
 @app.route('/users/<int:user_id>/following')
@@ -164,8 +281,20 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = (loading.with_profile(User.query, 'profile header')
+            .get_or_404(user_id))
+    following = (loading.with_profile(User.query, 'user card')
+                 .join(Follows, Follows.user_being_followed_id == User.id)
+                 .filter(Follows.user_following_id == user_id))
+    page = paginate_by_id(following, Follows.user_being_followed_id)
+    viewer = resolve_viewer_state(
+        g.user,
+        user_ids=[user.id] + [followed.id for followed in page])
+    return render_template('users/following.html',
+                           user=user,
+                           following=page.items,
+                           page=page,
+                           viewer=viewer)
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -176,8 +305,20 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = (loading.with_profile(User.query, 'profile header')
+            .get_or_404(user_id))
+    followers = (loading.with_profile(User.query, 'user card')
+                 .join(Follows, Follows.user_following_id == User.id)
+                 .filter(Follows.user_being_followed_id == user_id))
+    page = paginate_by_id(followers, Follows.user_following_id)
+    viewer = resolve_viewer_state(
+        g.user,
+        user_ids=[user.id] + [follower.id for follower in page])
+    return render_template('users/followers.html',
+                           user=user,
+                           followers=page.items,
+                           page=page,
+                           viewer=viewer)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -190,6 +331,10 @@ def add_follow(follow_id):
 
     followed_user = User.query.get_or_404(follow_id)
     g.user.following.append(followed_user)
+    db.session.flush()
+    counters.adjust(g.user.id, following_count=1)
+    counters.adjust(followed_user.id, followers_count=1)
+    timeline.add_follow(g.user.id, followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -205,45 +350,77 @@ def stop_following(follow_id):
 
     followed_user = User.query.get(follow_id)
     g.user.following.remove(followed_user)
+    counters.adjust(g.user.id, following_count=-1)
+    counters.adjust(follow_id, followers_count=-1)
+    timeline.remove_follow(g.user.id, follow_id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 @app.route('/users/<int:user_id>/likes')
 def show_likes(user_id):
-    """Shows list of likes for this user"""
+    """Shows list of likes for this user, most recently liked first"""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-        
-    liked_ids = [liked.id for liked in g.user.likes]
-    return render_template("users/likes.html", messages=g.user.likes, user=g.user)
+
+    user = (loading.with_profile(User.query, 'profile header')
+            .get_or_404(user_id))
+    liked = Like.query.filter(Like.user_id == user_id)
+    page = paginate_by_time(loading.with_profile(liked, 'liked message'),
+                            Like.timestamp, Like.message_id)
+    viewer = resolve_viewer_state(g.user, user_ids=[user.id])
+    return render_template("users/likes.html",
+                           messages=[like.message for like in page],
+                           page=page,
+                           user=user,
+                           viewer=viewer)
 
 
 @app.route('/users/add_like/<int:message_id>', methods=["POST"])
 def messages_add_like(message_id):
-    """Add a like to a message"""
+    """Add a like to a message, or remove it if it's already liked"""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    message = Message.query.get_or_404(message_id)
-    user_liked_ids = [liked.id for liked in g.user.likes]
-
-    if message.id not in user_liked_ids:
-        like = Like(user_id=g.user.id, message_id=message_id)
-        db.session.add(like)
-        db.session.commit()
-    else:
-        like = Like.query.filter(db.and_(Like.user_id==g.user.id, Like.message_id == message.id)).first()
-        db.session.delete(like)
-        db.session.commit()
+    toggle_like_or_404(message_id)
 
     return redirect('/')
 
 
+@app.route('/messages/<int:message_id>/like', methods=["POST"])
+def messages_toggle_like(message_id):
+    """Like or unlike a message; responds with JSON like:
+
+    {"liked": true, "likes": 3}
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    liked, like_count = toggle_like_or_404(message_id)
+
+    return jsonify(liked=liked, likes=like_count)
+
+
+def toggle_like_or_404(message_id):
+    """Toggle the current user's like of a message and commit.
+
+    Returns (liked, like count); aborts with a 404 if there's no message.
+    """
+
+    try:
+        liked, like_count = likes.toggle_like(g.user.id, message_id)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        abort(404)
+
+    return liked, like_count
+
 
 @app.route('/users/profile', methods=["GET", "POST"])
 def profile():
@@ -256,13 +433,17 @@ def profile():
     form = UserEditForm(obj=g.user)
 
     if form.validate_on_submit():
-        if User.authenticate(username=g.user.username, password=form.password.data):
+        if passwords.check_password(g.user.password, form.password.data):
             g.user.username = form.username.data
             g.user.email = form.email.data
             g.user.image_url = form.image_url.data
             g.user.header_image_url = form.header_image_url.data
             g.user.bio = form.bio.data
+            # retires cached pages and fragments showing the old profile
+            g.user.profile_version = User.profile_version + 1
+            timeline.touch_readers(g.user.id)
             db.session.commit()
+            current_user.invalidate(g.user.id)
             flash("Successfully updated your profile", "success")
             return redirect(f"/users/{g.user.id}")
         else:
@@ -282,8 +463,14 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    counters.remove_user(g.user.id)
+    timeline.touch_readers(g.user.id)
+    timeline.resume_fan_out(
+        db.select([Follows.user_being_followed_id])
+        .where(Follows.user_following_id == g.user.id))
+    db.session.delete(g.user._get_current_object())
     db.session.commit()
+    current_user.invalidate(g.user.id)
 
     return redirect("/signup")
 
@@ -307,7 +494,11 @@ def messages_add():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        db.session.flush()
+        timeline.fan_out_message(msg)
+        counters.adjust(g.user.id, messages_count=1)
         db.session.commit()
+        stream.publish_message(msg, g.user)
 
         return redirect(f"/users/{g.user.id}")
 
@@ -315,6 +506,7 @@ def messages_add():
 
 
 @app.route('/messages/<int:message_id>', methods=["GET"])
+@caching.policy('revalidate')
 def messages_show(message_id):
     """Show a message."""
 
@@ -322,8 +514,17 @@ def messages_show(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get_or_404(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = (loading.with_profile(Message.query, 'timeline card')
+           .get_or_404(message_id))
+    viewer = resolve_viewer_state(g.user, user_ids=[msg.user_id])
+
+    # warbles never change, but their author's name and picture can
+    not_modified = caching.not_modified(
+        msg.id, msg.user.profile_version, viewer.is_following(msg.user))
+    if not_modified:
+        return not_modified
+
+    return render_template('messages/show.html', message=msg, viewer=viewer)
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -335,6 +536,11 @@ def messages_destroy(message_id):
         return redirect("/")
 
     msg = Message.query.get(message_id)
+    fragment_cache.invalidate('warble card', msg.id, msg.user.profile_version)
+    fragment_cache.invalidate('profile warble', msg.id,
+                              msg.user.profile_version)
+    timeline.remove_message(msg.id)
+    counters.remove_message(msg.id)
     db.session.delete(msg)
     db.session.commit()
 
@@ -346,43 +552,109 @@ def messages_destroy(message_id):
 
 
 @app.route('/')
+@caching.policy('timeline')
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: most recent messages of followed_users, 100 per page
     """
 
     if g.user:
-        followed_ids = [followed.id for followed in g.user.following]
-        followed_ids.append(g.user.id)
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(followed_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-        liked_ids = [liked.id for liked in g.user.likes]
-
-        return render_template('home.html', messages=messages, likes=liked_ids)
+        pulled = timeline.pulled_author_ids(g.user.id)
+        not_modified = caching.not_modified(
+            g.user.messages_count, g.user.following_count,
+            g.user.followers_count, g.user.likes_count,
+            timeline.marker(g.user.id, pulled))
+        if not_modified:
+            return not_modified
+
+        before, after = requested_cursors()
+        page = timeline.home_timeline(g.user.id, before, after, pulled=pulled)
+        viewer = resolve_viewer_state(g.user,
+                                      message_ids=[msg.id for msg in page])
+
+        return render_template('home.html',
+                               messages=page.items,
+                               page=page,
+                               viewer=viewer)
 
     else:
         return render_template('home-anon.html')
 
 
+@app.errorhandler(passwords.PasswordQueueFull)
+def password_queue_full(error):
+    """Too many logins/signups at once: ask the client to retry shortly."""
+
+    return "Too many requests, please try again shortly.", 503, {"Retry-After": "5"}
+
+
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+# Command line maintenance tasks (run with `flask <command>`)
+
+
+@app.cli.command('db-upgrade')
+@click.argument('target', required=False)
+def db_upgrade(target):
+    """Apply pending schema migrations, up to TARGET if given."""
+
+    for migration in migrations.upgrade(target):
+        print(f"Applied {migration.version}: {migration.description}")
+
+
+@app.cli.command('db-downgrade')
+@click.argument('target')
+def db_downgrade(target):
+    """Revert the schema migrations after TARGET (0000 reverts them all)."""
+
+    for migration in migrations.downgrade(target):
+        print(f"Reverted {migration.version}: {migration.description}")
+
+
+@app.cli.command('db-status')
+def db_status():
+    """List the schema migrations and whether each has been applied."""
+
+    for migration, applied in migrations.status():
+        mark = 'x' if applied else ' '
+        print(f"[{mark}] {migration.version}: {migration.description}")
+
+
+@app.cli.command('counters-repair')
+def counters_repair():
+    """Recompute every user's follower/following/message/like counts."""
+
+    print(f"Recounted {counters.recount_all()} users.")
+
+
+@app.cli.command('search-index')
+def search_index():
+    """Create the database indexes used by user search."""
+
+    if search.get_backend().create_indexes():
+        print("Search indexes created.")
+    else:
+        print("This database can't have a search index (SQLite needs FTS5 "
+              "with the trigram tokenizer); searches scan the users table.")
+
+
+@app.cli.command('assets-build')
+def assets_build():
+    """Build fingerprinted, compressed copies of the static files."""
+
+    assets.build(app.static_folder, assets.assets_dir(app))
+
+
+@app.cli.command('timeline-backfill')
+def timeline_backfill():
+    """Rebuild every user's materialized home timeline."""
+
+    print(f"Rebuilt {timeline.rebuild_all()} timelines.")
+
+
+@app.cli.command('timeline-trim')
+def timeline_trim():
+    """Trim home timelines down to TIMELINE_MAX_ENTRIES (run periodically)."""
+
+    print(f"Trimmed {timeline.trim_all()} timelines.")
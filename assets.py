@@ -0,0 +1,307 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask assets-build` copies every file in `static/` to `ASSETS_DIR` (default
+`static/dist/`) under a name holding a hash of its content, such as
+`stylesheets/style.3f9a0c1b2d4e.css`, and writes `manifest.json` mapping
+the original names to the new ones. Because the URL changes whenever the
+content does, the files are served from `/assets/` with the `immutable`
+cache policy.
+
+Alongside each file the build writes:
+
+- gzip and, with the `brotli` package installed, brotli copies of text
+  files (`.gz`, `.br`), which are served to clients that accept them;
+- with `Pillow` installed, a WebP copy of each JPEG and PNG image, plus
+  copies of both scaled down to each of `IMAGE_WIDTHS` narrower than the
+  original.
+
+`url(...)` references to `/static/` files inside stylesheets are rewritten
+to the fingerprinted URLs, and a `background-image` of an image with a WebP
+copy is followed by an `image-set()` offering that copy to browsers that
+take it. Templates use `asset_url('stylesheets/style.css')` in place of
+`url_for('static', filename=...)`; until the assets are built it falls back
+to the plain static URL. Images go through the `picture` macro in
+`templates/picture.html`, which adds `srcset`s of the built copies.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+from flask import current_app, request, send_file, url_for
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+import caching
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+MANIFEST = 'manifest.json'
+
+# files worth compressing; images are compressed already
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.json', '.txt', '.html'}
+
+# scaled-down widths for images, in pixels
+IMAGE_WIDTHS = (480, 960, 1920)
+RESIZABLE = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG'}
+
+CSS_URL = re.compile(r"""url\(\s*(['"]?)/static/([^'")]+)\1\s*\)""")
+CSS_BACKGROUND = re.compile(
+    r"""background-image:\s*url\(\s*(['"]?)/static/([^'")]+)\1\s*\);""")
+
+# Content-Encoding: file suffix, in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def assets_dir(app=None):
+    app = app or current_app
+    return app.config.get('ASSETS_DIR') or os.path.join(app.static_folder,
+                                                        'dist')
+
+
+def fingerprint(name, content):
+    """`name` with a hash of `content` before its extension."""
+
+    root, ext = os.path.splitext(name)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:12]}{ext}"
+
+
+def write(out_dir, name, content):
+    path = os.path.join(out_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as out_file:
+        out_file.write(content)
+
+
+def compress(out_dir, name, content):
+    """Write gzip and brotli copies of a text file."""
+
+    write(out_dir, name + '.gz', gzip.compress(content, 9, mtime=0))
+    if brotli is not None:
+        write(out_dir, name + '.br', brotli.compress(content))
+
+
+def image_variants(out_dir, built, path):
+    """Write WebP and scaled-down copies of an image.
+
+    Returns the image's width and a dict mapping a (width, format) pair to a
+    built file name; width is None for full size.
+    """
+
+    root, ext = os.path.splitext(built)
+    variants = {}
+
+    with Image.open(path) as image:
+        sizes = [(None, image)] + [
+            (width, image.resize(
+                (width, round(image.height * width / image.width)),
+                Image.LANCZOS))
+            for width in IMAGE_WIDTHS if width < image.width]
+
+        for width, sized in sizes:
+            suffix = f"-{width}" if width else ""
+            if width:
+                variants[(width, ext[1:])] = f"{root}{suffix}{ext}"
+                sized.save(os.path.join(out_dir, variants[(width, ext[1:])]),
+                           RESIZABLE[ext.lower()], optimize=True)
+
+            variants[(width, 'webp')] = f"{root}{suffix}.webp"
+            sized.save(os.path.join(out_dir, variants[(width, 'webp')]),
+                       'WEBP', quality=80)
+
+    return image.width, variants
+
+
+def image_set(match, variants):
+    """A stylesheet's `background-image` declaration, plus an `image-set()`
+    preferring the image's WebP copy if it has one.
+    """
+
+    name = match.group(2)
+    webp = variants.get(name, {}).get(':webp')
+    if webp is None:
+        return match.group(0)
+
+    return (f'{match.group(0)}\n'
+            f'  background-image: image-set('
+            f'url("/assets/{webp}") type("image/webp"), '
+            f'url("/static/{name}") type("{mimetypes.guess_type(name)[0]}"));')
+
+
+def build(static_dir, out_dir, report=print):
+    """Build the fingerprinted assets for `static_dir` into `out_dir`.
+
+    Returns the manifest that was written.
+    """
+
+    if os.path.abspath(static_dir).startswith(os.path.abspath(out_dir)):
+        raise ValueError(f"Can't build assets into {out_dir}, which holds "
+                         "the static files themselves")
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+
+    names = sorted(
+        os.path.relpath(os.path.join(root, file_name), static_dir)
+        for root, dirs, files in os.walk(static_dir)
+        if not os.path.abspath(root).startswith(os.path.abspath(out_dir))
+        for file_name in files)
+
+    files = {}
+    variants = {}
+    widths = {}
+
+    # stylesheets go last, so the files they refer to have their names
+    for name in sorted(names, key=lambda name: name.endswith('.css')):
+        path = os.path.join(static_dir, name)
+        with open(path, 'rb') as static_file:
+            content = static_file.read()
+
+        ext = os.path.splitext(name)[1].lower()
+        if ext == '.css':
+            content = CSS_BACKGROUND.sub(
+                lambda match: image_set(match, variants), content.decode())
+            content = CSS_URL.sub(
+                lambda match: "url({0}/assets/{1}{0})".format(
+                    match.group(1),
+                    files.get(match.group(2), match.group(2))),
+                content).encode()
+
+        built = files[name] = fingerprint(name, content)
+        write(out_dir, built, content)
+
+        if ext in COMPRESSIBLE:
+            compress(out_dir, built, content)
+        if ext in RESIZABLE and Image is not None:
+            widths[name], sized = image_variants(out_dir, built, path)
+            variants[name] = {f"{width or ''}:{image_format}": variant
+                              for (width, image_format), variant
+                              in sized.items()}
+
+        report(f"{name} -> {built}")
+
+    manifest = {'files': files, 'variants': variants, 'widths': widths}
+    with open(os.path.join(out_dir, MANIFEST), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+    return manifest
+
+
+def get_manifest():
+    """The built manifest, loaded once per process; None if not built."""
+
+    assets = current_app.extensions.setdefault('assets', {})
+
+    if 'manifest' not in assets:
+        try:
+            with open(os.path.join(assets_dir(), MANIFEST)) as manifest_file:
+                assets['manifest'] = json.load(manifest_file)
+        except FileNotFoundError:
+            assets['manifest'] = None
+
+    return assets['manifest']
+
+
+def asset_url(filename, width=None, format=None):
+    """The URL of the static file `filename`, fingerprinted once built.
+
+    `width` and `format` ('webp', say) ask for a variant of an image; if it
+    wasn't built, the original's URL is returned.
+    """
+
+    manifest = get_manifest()
+    if manifest is None or filename not in manifest['files']:
+        return url_for('static', filename=filename)
+
+    built = manifest['files'][filename]
+    if width or format:
+        image_format = format or os.path.splitext(filename)[1][1:]
+        built = (manifest['variants'].get(filename, {})
+                 .get(f"{width or ''}:{image_format}", built))
+
+    return url_for('serve_asset', filename=built)
+
+
+def asset_srcset(filename, format=None):
+    """A `srcset` listing the built copies of an image by width, or ''.
+
+    `format` ('webp', say) lists the copies in that format instead.
+    """
+
+    manifest = get_manifest()
+    if manifest is None or filename not in manifest.get('widths', {}):
+        return ""
+
+    variants = manifest['variants'].get(filename, {})
+    original_format = os.path.splitext(filename)[1][1:]
+    image_format = format or original_format
+
+    widths = []
+    for key, variant in variants.items():
+        width, variant_format = key.split(':')
+        if variant_format == image_format:
+            widths.append((int(width or manifest['widths'][filename]),
+                           variant))
+    if image_format == original_format:
+        widths.append((manifest['widths'][filename],
+                       manifest['files'][filename]))
+
+    return ", ".join(f"{url_for('serve_asset', filename=variant)} {width}w"
+                     for width, variant in sorted(widths))
+
+
+def static_filename(url):
+    """The name of the static file at `url`, or None if it isn't one.
+
+    For images stored as URLs, such as users' header images.
+    """
+
+    prefix = url_for('static', filename='')
+    if url and url.startswith(prefix):
+        return url[len(prefix):]
+    return None
+
+
+@caching.policy('immutable')
+def serve_asset(filename):
+    """Send a built asset, precompressed if the client accepts it."""
+
+    path = safe_join(assets_dir(), filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+    for name, suffix in ENCODINGS:
+        if request.accept_encodings[name] and os.path.isfile(path + suffix):
+            path += suffix
+            encoding = name
+            break
+
+    response = send_file(path, mimetype=mimetype, conditional=True)
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+
+    return response
+
+
+def init_app(app):
+    """Serve built assets at /assets/ and give templates `asset_url`."""
+
+    app.add_url_rule('/assets/<path:filename>', 'serve_asset', serve_asset)
+    app.jinja_env.globals.update(asset_url=asset_url,
+                                 asset_srcset=asset_srcset,
+                                 static_filename=static_filename)
@@ -0,0 +1,89 @@
+"""Compare two benchmark results files written by run.py.
+
+    python benchmarks/compare.py OLD.json NEW.json [--threshold 10]
+
+Prints each route's p50/p95/p99, throughput and queries per request at each
+scale the two runs share, with the change from OLD to NEW. A route regresses
+if its p95 got more than `--threshold` percent slower or it makes more
+queries per request; the script exits with status 1 if any route did.
+"""
+
+import json
+import sys
+from argparse import ArgumentParser
+
+COLUMNS = ['p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'queries_mean']
+
+
+def load(path):
+    with open(path) as results_file:
+        results = json.load(results_file)
+
+    return results, {scale['users']: scale for scale in results['scales']}
+
+
+def change(old, new):
+    if old is None or new is None:
+        return ''
+    if not old:
+        return '' if old == new else ' (new)'
+    return f" ({(new - old) / old * 100:+.0f}%)"
+
+
+def regressions(old, new, threshold):
+    """The ways the route results `new` got worse than `old`."""
+
+    found = []
+    if new['p95_ms'] > old['p95_ms'] * (1 + threshold / 100):
+        found.append(f"p95 {old['p95_ms']}ms -> {new['p95_ms']}ms")
+    if (old['queries_mean'] is not None and new['queries_mean'] is not None
+            and new['queries_mean'] > old['queries_mean']):
+        found.append(f"queries {old['queries_mean']} -> {new['queries_mean']}")
+    if new['errors'] > old['errors']:
+        found.append(f"errors {old['errors']} -> {new['errors']}")
+
+    return found
+
+
+def main():
+    parser = ArgumentParser(description="Compare two benchmark runs.")
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help="percent p95 slowdown counted as a regression")
+    args = parser.parse_args()
+
+    old_results, old_scales = load(args.old)
+    new_results, new_scales = load(args.new)
+
+    print(f"old: {old_results['commit'][:10]}  new: {new_results['commit'][:10]}"
+          f"  ({new_results['mode']} mode, {new_results['concurrency']} users)")
+    if (old_results['mode'], old_results['concurrency']) != (
+            new_results['mode'], new_results['concurrency']):
+        print("warning: the runs used different modes or concurrency")
+
+    failed = []
+    for users in sorted(old_scales.keys() & new_scales.keys()):
+        print(f"\n{users} users")
+        old_routes = old_scales[users]['routes']
+        new_routes = new_scales[users]['routes']
+
+        for route in sorted(old_routes.keys() & new_routes.keys()):
+            old, new = old_routes[route], new_routes[route]
+            cells = [f"{column.rsplit('_', 1)[0]} {new[column]}"
+                     f"{change(old[column], new[column])}"
+                     for column in COLUMNS]
+            print(f"  {route:<20} " + ', '.join(cells))
+
+            for regression in regressions(old, new, args.threshold):
+                failed.append(f"{users} users, {route}: {regression}")
+
+    if failed:
+        print("\nRegressions:")
+        for regression in failed:
+            print(f"  {regression}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+"""Route-level benchmarks for Warbler.
+
+For each scale, generates and loads a dataset into a scratch database, then
+has concurrent virtual users (each logged in as a random user) hit each
+route in turn. For every route it records p50/p95/p99 latency, throughput
+and the SQL queries per request (from the X-SQL-Queries header, with
+streamed pages buffered so it counts their rendering too), and writes
+everything to a JSON file named after the current commit:
+
+    python benchmarks/run.py --database-url postgresql:///warbler-bench \\
+        --scales 1000,10000 --concurrency 8 --requests 400 --mode server
+    python benchmarks/compare.py benchmarks/results/OLD.json \\
+        benchmarks/results/NEW.json
+
+`--mode client` drives the app in-process through `app.test_client()`;
+`--mode server` serves it with Werkzeug's threaded WSGI server and sends
+real HTTP requests, so the numbers include HTTP parsing and sockets.
+
+THIS DROPS AND RELOADS EVERY TABLE IN THE BENCHMARK DATABASE.
+"""
+
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from argparse import ArgumentParser
+from datetime import datetime
+from http.client import HTTPConnection
+from random import Random
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATOR = os.path.join(ROOT, 'generator', 'create_csvs.py')
+
+# dataset shape, per user at each scale
+MESSAGES_PER_USER = 10
+FOLLOWS_PER_USER = 20
+LIKES_PER_USER = 10
+
+# requests each virtual user makes before timing starts
+WARMUP_REQUESTS = 3
+
+# route name: (method, URL for a given user id and message id)
+ROUTES = {
+    'homepage': ('GET', lambda user_id, message_id: '/'),
+    'users_show': ('GET', lambda user_id, message_id: f'/users/{user_id}'),
+    'list_users': ('GET', lambda user_id, message_id: '/users'),
+    'show_following': (
+        'GET', lambda user_id, message_id: f'/users/{user_id}/following'),
+    'users_followers': (
+        'GET', lambda user_id, message_id: f'/users/{user_id}/followers'),
+    'messages_add_like': (
+        'POST', lambda user_id, message_id: f'/users/add_like/{message_id}'),
+}
+
+
+def git(*args):
+    return subprocess.run(['git', *args], cwd=ROOT, capture_output=True,
+                          text=True).stdout.strip()
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+
+    if not sorted_values:
+        return None
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(samples, seconds):
+    """Turn (latency, status, queries) samples into a route's results."""
+
+    latencies = sorted(latency * 1000 for (latency, _, _) in samples)
+    queries = [count for (_, _, count) in samples if count is not None]
+
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for (_, status, _) in samples if status >= 400),
+        'mean_ms': round(sum(latencies) / len(latencies), 2),
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'max_ms': round(latencies[-1], 2),
+        'throughput_rps': round(len(samples) / seconds, 1),
+        'queries_mean': (round(sum(queries) / len(queries), 2)
+                         if queries else None),
+        'queries_max': max(queries) if queries else None,
+    }
+
+
+class TestClientUser:
+    """A virtual user calling the app in-process."""
+
+    def __init__(self, app, cookie):
+        self.client = app.test_client()
+        self.client.set_cookie('localhost', app.session_cookie_name, cookie)
+
+    def request(self, method, url):
+        response = self.client.open(url, method=method)
+        response.get_data()
+        queries = response.headers.get('X-SQL-Queries')
+        return response.status_code, int(queries) if queries else None
+
+
+class HTTPUser:
+    """A virtual user sending HTTP requests to a running server."""
+
+    def __init__(self, app, cookie, port):
+        self.connection = HTTPConnection('127.0.0.1', port)
+        self.cookie = f"{app.session_cookie_name}={cookie}"
+
+    def request(self, method, url):
+        self.connection.request(method, url, headers={'Cookie': self.cookie})
+        response = self.connection.getresponse()
+        response.read()
+        queries = response.getheader('X-SQL-Queries')
+        return response.status, int(queries) if queries else None
+
+
+def run_route(make_user, user_ids, message_ids, route, concurrency,
+              requests, seed):
+    """Have `concurrency` virtual users make `requests` requests between
+    them to `route`, returning its results.
+    """
+
+    method, url_for = ROUTES[route]
+    per_user = max(requests // concurrency, 1)
+    samples = []
+    lock = threading.Lock()
+    start_line = threading.Barrier(concurrency + 1)
+
+    def virtual_user(number):
+        rng = Random(seed * 1000 + number)
+        user = make_user(rng.choice(user_ids))
+        mine = []
+
+        def call():
+            url = url_for(rng.choice(user_ids), rng.choice(message_ids))
+            started = perf_counter()
+            status, queries = user.request(method, url)
+            return perf_counter() - started, status, queries
+
+        for _ in range(WARMUP_REQUESTS):
+            call()
+        start_line.wait()
+
+        for _ in range(per_user):
+            mine.append(call())
+
+        with lock:
+            samples.extend(mine)
+
+    threads = [threading.Thread(target=virtual_user, args=(number,))
+               for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    start_line.wait()
+    started = perf_counter()
+    for thread in threads:
+        thread.join()
+
+    return summarize(samples, perf_counter() - started)
+
+
+def seed(db, users, shards):
+    """Generate and load a dataset of `users` users; returns its shape."""
+
+    shape = {
+        'users': users,
+        'messages': users * MESSAGES_PER_USER,
+        'follows': users * min(FOLLOWS_PER_USER, users - 1),
+        'likes': users * LIKES_PER_USER,
+    }
+
+    import counters
+    import loader
+    import migrations
+    import timeline
+
+    started = perf_counter()
+    with tempfile.TemporaryDirectory() as data_dir:
+        subprocess.run(
+            [sys.executable, GENERATOR, '--seed', '0', '--out', data_dir,
+             '--shards', str(shards)]
+            + [arg for table, count in shape.items()
+               for arg in (f'--{table}', str(count))],
+            check=True)
+
+        db.session.remove()
+        db.drop_all()
+        migrations.upgrade()
+        loader.load(db.engine, data_dir, report=lambda line: None)
+
+    counters.recount_all()
+    timeline.rebuild_all()
+    shape['seed_seconds'] = round(perf_counter() - started, 1)
+
+    return shape
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark Warbler's routes.")
+    parser.add_argument('--database-url',
+                        default=os.environ.get('BENCH_DATABASE_URL',
+                                               'postgresql:///warbler-bench'),
+                        help="scratch database; it is dropped and reloaded")
+    parser.add_argument('--scales', default='1000,10000',
+                        help="comma-separated numbers of users")
+    parser.add_argument('--routes', default=','.join(ROUTES))
+    parser.add_argument('--mode', choices=['client', 'server'],
+                        default='client')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help="virtual users making requests at once")
+    parser.add_argument('--requests', type=int, default=200,
+                        help="timed requests per route at each scale")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="processes generating each dataset")
+    parser.add_argument('--out', help="results file (default: "
+                        "benchmarks/results/<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    # the app reads its database from the environment when imported
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('BCRYPT_WORKERS', '0')
+    sys.path.insert(0, ROOT)
+
+    from sqlalchemy import func
+    from werkzeug.serving import make_server
+
+    from app import app, CURR_USER_KEY
+    from models import db, Message, User
+
+    # Flask-SQLAlchemy 2.3 has no SQLALCHEMY_ENGINE_OPTIONS; these are the
+    # keys it reads (later versions still honour them, with a warning)
+    app.config['SQLALCHEMY_POOL_SIZE'] = args.concurrency
+    app.config['SQLALCHEMY_MAX_OVERFLOW'] = args.concurrency
+    # count the queries streamed pages (e.g. /users) run while rendering
+    app.config['SQL_STATS_BUFFER_STREAMS'] = True
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    logging.getLogger('warbler.sql').setLevel(logging.ERROR)
+
+    serializer = app.session_interface.get_signing_serializer(app)
+
+    server = None
+    if args.mode == 'server':
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def make_user(user_id):
+        cookie = serializer.dumps({CURR_USER_KEY: user_id})
+        if server is None:
+            return TestClientUser(app, cookie)
+        return HTTPUser(app, cookie, server.server_port)
+
+    commit = git('rev-parse', 'HEAD')
+    results = {
+        'commit': commit,
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'created': datetime.utcnow().isoformat(timespec='seconds'),
+        'mode': args.mode,
+        'concurrency': args.concurrency,
+        'requests': args.requests,
+        'scales': [],
+    }
+
+    try:
+        with app.app_context():
+            results['database'] = db.engine.dialect.name
+
+            for scale_number, users in enumerate(
+                    int(scale) for scale in args.scales.split(',')):
+                print(f"Seeding {users} users...", flush=True)
+                scale = seed(db, users, args.shards)
+
+                user_ids = [user_id for (user_id,) in db.session.query(User.id)
+                            .order_by(func.random()).limit(1000)]
+                message_ids = [message_id for (message_id,) in db.session
+                               .query(Message.id)
+                               .order_by(func.random()).limit(1000)]
+                db.session.remove()
+
+                scale['routes'] = {}
+                for route in args.routes.split(','):
+                    scale['routes'][route] = stats = run_route(
+                        make_user, user_ids, message_ids, route,
+                        args.concurrency, args.requests, scale_number)
+                    print(f"  {route}: p50 {stats['p50_ms']}ms, "
+                          f"p95 {stats['p95_ms']}ms, "
+                          f"p99 {stats['p99_ms']}ms, "
+                          f"{stats['throughput_rps']} req/s, "
+                          f"{stats['queries_mean']} queries", flush=True)
+
+                results['scales'].append(scale)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    out = args.out or os.path.join(
+        ROOT, 'benchmarks', 'results',
+        f"{commit[:10]}-{datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+
+    print(f"Wrote {out}")
+
+
+if __name__ == '__main__':
+    main()
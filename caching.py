@@ -0,0 +1,130 @@
+"""HTTP caching: a Cache-Control policy per route, and conditional GETs.
+
+Views pick a policy with the `policy` decorator; the rest get `no-store`:
+
+- `no-store`: nothing may keep a copy (forms, redirects, anything private
+  that can't be validated cheaply).
+- `immutable`: fingerprinted files whose URL changes with their content,
+  cached by anyone for a year and never revalidated.
+- `static`: other static files, kept by anyone but revalidated on each use
+  against the Last-Modified date that Flask's static view sends.
+- `revalidate`: pages kept by the browser only and revalidated on each use.
+  Their views call `not_modified` with the things the page is built from,
+  and answer 304 Not Modified without rendering when none have changed.
+- `timeline`: the logged-in homepage, kept by the browser for
+  `TIMELINE_CACHE_SECONDS` and then revalidated like `revalidate`.
+
+Whatever the policy, a response gets `no-store` if it isn't a successful
+GET or HEAD, or if it changed the session (a flashed message was shown, say),
+since the session cookie must never be cached.
+
+Pages kept by the browser vary on Cookie, so two people sharing a browser
+never see each other's pages. Freshness doesn't depend on the cookie
+changing, though: the parts given to `not_modified` must cover everything a
+page shows, including the viewer's own follows and likes, so a revalidated
+copy is never stale.
+"""
+
+import hashlib
+
+from flask import current_app, g, request, session
+from werkzeug.http import is_resource_modified
+
+DEFAULT_TIMELINE_SECONDS = 10
+IMMUTABLE_SECONDS = 365 * 24 * 60 * 60
+
+POLICIES = {
+    'no-store': lambda: "no-store",
+    'immutable': lambda: f"public, max-age={IMMUTABLE_SECONDS}, immutable",
+    'static': lambda: "public, no-cache",
+    'revalidate': lambda: "private, no-cache",
+    'timeline': lambda: "private, max-age={}".format(
+        current_app.config.get('TIMELINE_CACHE_SECONDS',
+                               DEFAULT_TIMELINE_SECONDS)),
+}
+
+# endpoints outside this app's views, with their policies
+ENDPOINT_POLICIES = {'static': 'static'}
+
+
+def policy(name):
+    """Decorate a view to send its responses with the policy `name`."""
+
+    if name not in POLICIES:
+        raise ValueError(f"Unknown cache policy: {name}")
+
+    def decorate(view):
+        view.cache_policy = name
+        return view
+
+    return decorate
+
+
+def policy_for(endpoint):
+    """The name of the cache policy for `endpoint`."""
+
+    view = current_app.view_functions.get(endpoint)
+    return (getattr(view, 'cache_policy', None)
+            or ENDPOINT_POLICIES.get(endpoint, 'no-store'))
+
+
+def make_etag(*parts):
+    """An ETag for a page built from `parts` (ids, counts, versions...)."""
+
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+
+
+def not_modified(*parts):
+    """Tag this request's response with an ETag made from `parts`.
+
+    `parts` must cover everything the page shows that can change; the URL
+    and the logged-in user's id and profile version (for the navbar) are
+    added here. Returns a 304 response to send if the client's copy has the
+    same ETag, otherwise None (go on and render the page).
+    """
+
+    viewer = g.get('user')
+    if viewer:
+        parts += (viewer.id, viewer.profile_version)
+
+    etag = make_etag(request.full_path, *parts)
+    g.cache_etag = etag
+
+    # a pending flash must be rendered, and takes the page out of the cache
+    if '_flashes' in session:
+        return None
+
+    if is_resource_modified(request.environ, etag=f'W/"{etag}"'):
+        return None
+
+    return current_app.response_class(status=304)
+
+
+def apply_policy(response):
+    """Set Cache-Control (and the ETag from `not_modified`) on a response."""
+
+    etag = g.pop('cache_etag', None)
+    cacheable = (request.method in ('GET', 'HEAD')
+                 and response.status_code in (200, 304)
+                 and not session.modified)
+
+    if not cacheable:
+        response.headers['Cache-Control'] = "no-store"
+        return response
+
+    name = policy_for(request.endpoint)
+    response.headers['Cache-Control'] = POLICIES[name]()
+
+    if name in ('revalidate', 'timeline'):
+        # a browser shared by two people mustn't show one the other's pages
+        response.vary.add('Cookie')
+        if etag is not None:
+            response.set_etag(etag, weak=True)
+
+    return response
+
+
+def init_app(app):
+    """Set the caching headers of every response from `app`."""
+
+    app.after_request(apply_policy)
@@ -0,0 +1,129 @@
+"""Denormalized follower/following/message/like counts on User.
+
+Profile headers read the `*_count` columns instead of loading every related
+row. The views keep them in step by calling these helpers inside the same
+transaction as the change they count; `recount` rebuilds them from scratch.
+"""
+
+from sqlalchemy import func, select
+
+import current_user
+from models import db, Follows, Like, Message, User
+
+COUNTERS = ('messages_count', 'following_count', 'followers_count',
+            'likes_count')
+
+
+def adjust(user_id, **deltas):
+    """Add each of `deltas` (e.g. `followers_count=1`) to `user_id`'s counts.
+
+    Issued as a single UPDATE so concurrent requests can't lose increments.
+    """
+
+    values = {getattr(User, name): getattr(User, name) + delta
+              for name, delta in deltas.items()}
+
+    User.query.filter(User.id == user_id).update(values,
+                                                 synchronize_session=False)
+    current_user.invalidate(user_id)
+
+
+def remove_message(message_id):
+    """Adjust counts for a message that is about to be deleted."""
+
+    msg = Message.query.get(message_id)
+    adjust(msg.user_id, messages_count=-1)
+
+    likers = select([Like.user_id]).where(Like.message_id == message_id)
+    (User
+     .query
+     .filter(User.id.in_(likers))
+     .update({User.likes_count: User.likes_count - 1},
+             synchronize_session=False))
+
+
+def remove_user(user_id):
+    """Adjust other users' counts for a user that is about to be deleted."""
+
+    followed = (select([Follows.user_being_followed_id])
+                .where(Follows.user_following_id == user_id))
+    (User
+     .query
+     .filter(User.id.in_(followed))
+     .update({User.followers_count: User.followers_count - 1},
+             synchronize_session=False))
+
+    followers = (select([Follows.user_following_id])
+                 .where(Follows.user_being_followed_id == user_id))
+    (User
+     .query
+     .filter(User.id.in_(followers))
+     .update({User.following_count: User.following_count - 1},
+             synchronize_session=False))
+
+    liked_messages = Like.__table__.join(Message.__table__)
+    likers = (select([Like.user_id])
+              .select_from(liked_messages)
+              .where(Message.user_id == user_id))
+    likes_lost = (select([func.count()])
+                  .select_from(liked_messages)
+                  .where(Message.user_id == user_id)
+                  .where(Like.user_id == User.id)
+                  .as_scalar())
+    (User
+     .query
+     .filter(User.id.in_(likers))
+     .update({User.likes_count: User.likes_count - likes_lost},
+             synchronize_session=False))
+
+
+def recount(user_ids=None):
+    """Recompute every counter from the underlying tables in one UPDATE.
+
+    `user_ids` may be a list of ids or a select of them; if None, every user
+    is recounted.
+    """
+
+    def count(table, column):
+        return (select([func.count()])
+                .select_from(table)
+                .where(column == User.id)
+                .as_scalar())
+
+    values = {
+        User.messages_count: count(Message.__table__, Message.user_id),
+        User.following_count: count(Follows.__table__,
+                                    Follows.user_following_id),
+        User.followers_count: count(Follows.__table__,
+                                    Follows.user_being_followed_id),
+        User.likes_count: count(Like.__table__, Like.user_id),
+    }
+
+    query = User.query
+    if user_ids is not None:
+        query = query.filter(User.id.in_(user_ids))
+
+    return query.update(values, synchronize_session=False)
+
+
+def recount_all(batch_size=10000):
+    """Recount every user in batches of ids, committing after each batch.
+
+    Returns the number of users recounted.
+    """
+
+    total = 0
+    last_id = 0
+
+    while True:
+        ids = [user_id for (user_id,) in (db.session
+                                          .query(User.id)
+                                          .filter(User.id > last_id)
+                                          .order_by(User.id)
+                                          .limit(batch_size))]
+        if not ids:
+            return total
+
+        total += recount(ids)
+        db.session.commit()
+        last_id = ids[-1]
@@ -0,0 +1,121 @@
+"""Lazy loading of the logged-in user for `g.user`.
+
+`add_user_to_g` puts a `CurrentUser` on `g` without touching the database.
+The first time a view or template reads from it, the user's profile row is
+fetched (or taken from a short-lived per-process cache). The full ORM `User`
+is only loaded when something needs more than the profile columns, such as
+a relationship, a method or an assignment.
+
+The counters and `profile_version` are never read from the cache: cached
+pages build their ETags from them (see caching.py), and an ETag made from a
+stale count would let a browser keep a stale page. Reading any of them
+fetches the whole profile row again, so everything a page shows is as fresh
+as its ETag; pages that only need the name and picture (the navbar, say)
+still use the cached row.
+"""
+
+from threading import Lock
+from time import monotonic
+
+from flask import current_app
+
+from models import db, User
+
+PROFILE_COLUMNS = ('id', 'username', 'email', 'image_url', 'header_image_url',
+                   'bio', 'location', 'messages_count', 'following_count',
+                   'followers_count', 'likes_count', 'profile_version')
+
+# columns always read from the database, never the cache
+LIVE_COLUMNS = ('messages_count', 'following_count', 'followers_count',
+                'likes_count', 'profile_version')
+
+DEFAULT_TTL = 5
+MAX_CACHED = 10000
+
+_cache = {}
+_cache_lock = Lock()
+
+
+def invalidate(user_id):
+    """Drop `user_id`'s cached profile row from this process's cache."""
+
+    with _cache_lock:
+        _cache.pop(user_id, None)
+
+
+def get_profile(user_id, fresh=False):
+    """Get `user_id`'s profile columns as a dict, or None if they're gone.
+
+    Rows are cached for `CURRENT_USER_CACHE_TTL` seconds (0 turns the cache
+    off). Other processes won't see an invalidation, so keep this short.
+    With `fresh`, the row is read from the database (and cached again).
+    """
+
+    ttl = current_app.config.get('CURRENT_USER_CACHE_TTL', DEFAULT_TTL)
+    now = monotonic()
+
+    if not fresh:
+        with _cache_lock:
+            cached = _cache.get(user_id)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    columns = [getattr(User, name) for name in PROFILE_COLUMNS]
+    row = db.session.query(*columns).filter(User.id == user_id).first()
+    profile = dict(zip(PROFILE_COLUMNS, row)) if row else None
+
+    if ttl > 0:
+        with _cache_lock:
+            if len(_cache) >= MAX_CACHED:
+                _cache.clear()
+            _cache[user_id] = (now + ttl, profile)
+
+    return profile
+
+
+class CurrentUser:
+    """Stands in for the logged-in User until something needs the real row.
+
+    It is falsy if the user in the session no longer exists, so check it
+    with `if g.user`, never `g.user is None`.
+    """
+
+    def __init__(self, user_id):
+        self.__dict__['_user_id'] = user_id
+        self.__dict__['_profile'] = None
+        self.__dict__['_fresh'] = False
+        self.__dict__['_user'] = None
+
+    def __repr__(self):
+        return f"<CurrentUser #{self._user_id}>"
+
+    def __bool__(self):
+        return self._get_profile() is not None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        if self._user is None:
+            profile = self._get_profile(fresh=name in LIVE_COLUMNS)
+            if profile is not None and name in profile:
+                return profile[name]
+
+        return getattr(self._get_current_object(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get_current_object(), name, value)
+
+    def _get_profile(self, fresh=False):
+        if self._profile is None or (fresh and not self._fresh):
+            self.__dict__['_profile'] = (
+                get_profile(self._user_id, fresh=fresh) or {})
+            self.__dict__['_fresh'] = self._fresh or fresh
+        return self._profile or None
+
+    def _get_current_object(self):
+        """Get the ORM User, loading it on first use."""
+
+        if self._user is None:
+            self.__dict__['_user'] = User.query.get(self._user_id)
+        return self._user
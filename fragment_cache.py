@@ -0,0 +1,200 @@
+"""Caching rendered pieces of templates.
+
+Templates wrap markup that is expensive to render, and the same for every
+viewer, in a `fragment` call block:
+
+    {% call fragment('warble card', msg.id, msg.user.profile_version) %}
+      ...
+    {% endcall %}
+
+The block is rendered once and its output stored under its name and key
+parts; until it is evicted, later renders send the stored markup instead.
+The key parts must change whenever anything the fragment shows does. A
+warble never changes, but its author's name and picture can, so warble
+cards are keyed on the message id and the author's `profile_version`.
+Anything that depends on who is looking (like buttons, say) must stay
+outside the block.
+
+Fragments are kept in a per-process LRU of `FRAGMENT_CACHE_SIZE` entries
+for `FRAGMENT_CACHE_TTL` seconds (a size of 0 turns caching off). With
+`FRAGMENT_CACHE_REDIS_URL` set, they are kept in Redis instead and shared
+by every process (this needs the `redis` package).
+
+Each response reports the fragment cache hits and misses it had in an
+`X-Fragment-Cache` header; `get_cache().hits` and `.misses` count them for
+the whole process.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from flask import current_app, g
+from markupsafe import Markup
+
+DEFAULT_SIZE = 10000
+DEFAULT_TTL = 60 * 60
+
+KEY_PREFIX = 'fragment:'
+
+
+class MemoryBackend:
+    """An in-process LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, size=DEFAULT_SIZE, ttl=DEFAULT_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            expires, value = entry
+            if expires <= monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.size <= 0:
+            return
+
+        with self.lock:
+            self.entries[key] = (monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class RedisBackend:
+    """Fragments shared by every process through a Redis client."""
+
+    def __init__(self, client, ttl=DEFAULT_TTL):
+        self.client = client
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(key)
+        return value.decode() if value is not None else None
+
+    def set(self, key, value):
+        self.client.set(key, value.encode(), ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=f"{KEY_PREFIX}*"))
+        if keys:
+            self.client.delete(*keys)
+
+
+class FragmentCache:
+    """Rendered fragments in a backend, with hit and miss counts."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if 'fragment_stats' in g:
+            g.fragment_stats[0 if hit else 1] += 1
+
+    def render(self, name, parts, render):
+        """Get a fragment's markup, calling `render()` to make it on a miss."""
+
+        key = make_key(name, parts)
+        markup = self.backend.get(key)
+        self.count(hit=markup is not None)
+
+        if markup is None:
+            markup = str(render())
+            self.backend.set(key, markup)
+
+        return Markup(markup)
+
+    def invalidate(self, name, *parts):
+        self.backend.delete(make_key(name, parts))
+
+    def clear(self):
+        self.backend.clear()
+
+
+def make_key(name, parts):
+    return KEY_PREFIX + ':'.join([name, *(str(part) for part in parts)])
+
+
+def get_cache():
+    """Get the current app's fragment cache, creating it on first use."""
+
+    cache = current_app.extensions.get('fragment_cache')
+
+    if cache is None:
+        config = current_app.config
+        ttl = config.get('FRAGMENT_CACHE_TTL', DEFAULT_TTL)
+        redis_url = config.get('FRAGMENT_CACHE_REDIS_URL')
+
+        if redis_url:
+            import redis
+            backend = RedisBackend(redis.Redis.from_url(redis_url), ttl)
+        else:
+            backend = MemoryBackend(config.get('FRAGMENT_CACHE_SIZE',
+                                               DEFAULT_SIZE), ttl)
+
+        cache = current_app.extensions['fragment_cache'] = FragmentCache(backend)
+
+    return cache
+
+
+def fragment(name, *parts, caller):
+    """The `{% call fragment(name, *parts) %}` block for templates."""
+
+    return get_cache().render(name, parts, caller)
+
+
+def invalidate(name, *parts):
+    """Drop the fragment stored under `name` and `parts`."""
+
+    get_cache().invalidate(name, *parts)
+
+
+def _start_request():
+    g.fragment_stats = [0, 0]
+
+
+def _report(response):
+    stats = g.pop('fragment_stats', None)
+    if stats is not None and any(stats):
+        response.headers['X-Fragment-Cache'] = (
+            f"hits={stats[0]}, misses={stats[1]}")
+    return response
+
+
+def init_app(app):
+    """Give `app`'s templates the `fragment` block and report its use."""
+
+    app.jinja_env.globals['fragment'] = fragment
+    app.before_request(_start_request)
+    app.after_request(_report)
@@ -2,29 +2,64 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows:
+
+    python generator/create_csvs.py
+    python generator/create_csvs.py --users 1000000 --messages 20000000 \\
+        --follows 50000000 --likes 30000000 --shards 8 --out data
+
+Everything is drawn from a seeded NumPy generator without using the network,
+so the same arguments always give the same files. Follows and likes follow
+power laws: a few users have most of the followers, and a few warbles get
+most of the likes. With --shards N, N processes each write their own slice
+of every table (users-<n>.csv, messages-<n>.csv, ...), which `python seed.py
+<out>` loads side by side.
 """
 
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import os
+import sys
+from argparse import ArgumentParser
+from datetime import date, datetime
+from multiprocessing import Pool
+
+import numpy as np
 from faker import Faker
-from helpers import get_random_datetime
+from faker.providers.lorem.en_US import Provider as LoremProvider
+
+from helpers import get_random_datetimes, power_law_weights
+
+# message ids are snowflakes, like the app's own; see snowflake.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import snowflake  # noqa: E402
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
-MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
+USERS_CSV_HEADERS = ['id', 'email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
+MESSAGES_CSV_HEADERS = ['id', 'text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id', 'timestamp']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+NUM_FOLLOWS = 5000
+NUM_LIKES = 3000
+
+# newest warble date by default; fixed, so the same arguments give the same
+# files on any day
+UNTIL = date(2021, 1, 1)
+
+# how steeply popularity falls off with rank (probability ~ rank ** -exponent)
+FOLLOWED_EXPONENT = 1.0
+POSTING_EXPONENT = 0.8
+LIKED_EXPONENT = 1.0
+
+# rows generated and written at a time
+CHUNK_SIZE = 100000
 
-fake = Faker()
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-# Generate random profile image URLs to use for users
+WORDS = np.array(LoremProvider.word_list)
 
 image_urls = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
@@ -32,46 +67,216 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
-
 header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
+    f"https://splashbase.s3.amazonaws.com/unsplash/regular/{name}_1280.jpg"
+    for name in ["tumblr_mnh0n9pHJW1st5lhmo1", "tumblr_mnh0uemhCk1st5lhmo1",
+                 "tumblr_mnh121HEWa1st5lhmo1", "tumblr_mnh17lfd9R1st5lhmo1",
+                 "tumblr_mnh1d7s3UD1st5lhmo1", "tumblr_mnh1jdFvHR1st5lhmo1",
+                 "tumblr_mnh1uhYnog1st5lhmo1", "tumblr_mnh25vNOvI1st5lhmo1",
+                 "tumblr_mnh29fxz111st5lhmo1", "tumblr_mnh2m1hnS81st5lhmo1"]
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+
+def sentences(rng, count, min_words, max_words):
+    """Yield `count` sentences of lorem ipsum words."""
+
+    lengths = rng.integers(min_words, max_words + 1, count)
+    words = WORDS[rng.integers(0, len(WORDS), lengths.sum())]
+    ends = np.cumsum(lengths)
+
+    for end, length in zip(ends, lengths):
+        text = ' '.join(words[end - length:end])
+        yield text[0].upper() + text[1:] + '.'
+
+
+def unique_pairs(rng, count, draw, distinct=True):
+    """Draw `count` distinct (left, right) id pairs.
+
+    `draw(size)` returns two arrays of candidate ids. Duplicates are thrown
+    away and more are drawn, a few times at most, so very dense requests can
+    come back short. With `distinct`, pairs with left == right (following
+    yourself) are left out too.
+    """
+
+    keys = np.empty(0, dtype=np.int64)
+
+    for _ in range(10):
+        needed = count - len(keys)
+        if needed <= 0:
+            break
+
+        left, right = draw(needed + needed // 10 + 10)
+        ok = left != right if distinct else np.ones(len(left), dtype=bool)
+        keys = np.unique(np.concatenate([keys, (left[ok] << 32) | right[ok]]))
+
+    keys = rng.permutation(keys)[:count]
+    return keys >> 32, keys & 0xffffffff
+
+
+def slices(total, shards):
+    """Split range(total) into `shards` contiguous (start, stop) slices."""
+
+    bounds = np.linspace(0, total, shards + 1).astype(np.int64)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def csv_path(out, table, shard, shards):
+    if shards == 1:
+        return os.path.join(out, f"{table}.csv")
+    return os.path.join(out, f"{table}-{shard:03d}.csv")
+
+
+def write_csv(path, headers, rows):
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(headers)
+        writer.writerows(rows)
+
+
+# Tables shared by every shard; set by `start_worker`
+shared = {}
+
+
+def start_worker(tables):
+    shared.update(tables)
+
+
+def write_shard(args, shard, user_slice, message_slice):
+    """Write one shard's users, messages, follows and likes."""
+
+    rng = np.random.default_rng([args.seed, shard])
+    num_users = args.users
+
+    # users, with unique names made from a word and their id
+    lo, hi = user_slice
+    ids = np.arange(lo, hi) + 1
+    words = WORDS[rng.integers(0, len(WORDS), len(ids))]
+    cities = shared['cities']
+    domains = shared['domains']
+
+    def users():
+        bios = sentences(rng, len(ids), 3, 12)
+        for user_id, word, bio in zip(ids, words, bios):
+            username = f"{word}{user_id}"
+            yield (user_id,
+                   f"{username}@{domains[user_id % len(domains)]}",
+                   username,
+                   image_urls[rng.integers(len(image_urls))],
+                   PASSWORD,
+                   bio,
+                   header_image_urls[rng.integers(len(header_image_urls))],
+                   cities[rng.integers(len(cities))])
+
+    write_csv(csv_path(args.out, 'users', shard, args.shards),
+              USERS_CSV_HEADERS, users())
+
+    # messages, whose ids, times and authors were drawn up front
+    def messages():
+        for start in range(message_slice[0], message_slice[1], CHUNK_SIZE):
+            stop = min(start + CHUNK_SIZE, message_slice[1])
+            texts = sentences(rng, stop - start, 4, 25)
+            timestamps = np.datetime_as_string(shared['timestamps'][start:stop])
+            yield from zip(shared['message_ids'][start:stop],
+                           (text[:MAX_WARBLER_LENGTH] for text in texts),
+                           (timestamp.replace('T', ' ') for timestamp in timestamps),
+                           shared['authors'][start:stop])
+
+    write_csv(csv_path(args.out, 'messages', shard, args.shards),
+              MESSAGES_CSV_HEADERS, messages())
+
+    # follows and likes come from this shard's users, so pairs from
+    # different shards can't clash
+    share = (hi - lo) / num_users
+
+    followers, followed = unique_pairs(
+        rng, round(args.follows * share),
+        lambda size: (rng.integers(lo, hi, size) + 1,
+                      rng.choice(num_users, size,
+                                 p=shared['followed_weights']) + 1))
+    write_csv(csv_path(args.out, 'follows', shard, args.shards),
+              FOLLOWS_CSV_HEADERS, zip(followed, followers))
+
+    message_ids = shared['message_ids']
+    likers, liked = unique_pairs(
+        rng, round(args.likes * share),
+        lambda size: (rng.integers(lo, hi, size) + 1,
+                      rng.choice(len(message_ids), size,
+                                 p=shared['liked_weights'])),
+        distinct=False)
+
+    # each like comes some time between its warble and the newest warble
+    warbled_at = shared['timestamps'][liked]
+    liked_at = warbled_at + (shared['timestamps'][-1] - warbled_at) * rng.random(len(liked))
+    write_csv(csv_path(args.out, 'likes', shard, args.shards),
+              LIKES_CSV_HEADERS,
+              zip(likers, message_ids[liked],
+                  (timestamp.replace('T', ' ')
+                   for timestamp in np.datetime_as_string(liked_at))))
+
+    return shard
+
+
+def message_ids_for(timestamps):
+    """Snowflake ids for sorted timestamps, numbering ties in a millisecond.
+
+    Ties are numbered through the worker bits as well as the sequence bits,
+    so even more than 4096 warbles in one millisecond get distinct ids.
+    """
+
+    epoch = np.datetime64(snowflake.EPOCH, 'us')
+    millis = (timestamps - epoch) // np.timedelta64(1, 'ms')
+    sequence = np.arange(len(millis)) - np.searchsorted(millis, millis)
+
+    return snowflake.compose(millis.astype(np.int64), 0, sequence)
+
+
+def main():
+    parser = ArgumentParser(description="Generate CSVs of random data for Warbler.")
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLOWS)
+    parser.add_argument('--likes', type=int, default=NUM_LIKES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--until', type=date.fromisoformat, default=UNTIL,
+                        help="newest warble date (YYYY-MM-DD); warbles span two years up to it")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="processes writing files side by side")
+    parser.add_argument('--out', default='generator')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    fake = Faker()
+    fake.seed_instance(args.seed)
+
+    timestamps = np.sort(get_random_datetimes(
+        rng, args.messages,
+        now=datetime.combine(args.until, datetime.min.time())))
+
+    tables = {
+        'cities': [fake.city() for _ in range(1000)],
+        'domains': sorted({fake.free_email_domain() for _ in range(100)}),
+        'timestamps': timestamps,
+        'message_ids': message_ids_for(timestamps),
+        'authors': rng.choice(args.users, args.messages,
+                              p=power_law_weights(rng, args.users, POSTING_EXPONENT)) + 1,
+        'followed_weights': power_law_weights(rng, args.users, FOLLOWED_EXPONENT),
+        'liked_weights': power_law_weights(rng, args.messages, LIKED_EXPONENT),
+    }
+
+    os.makedirs(args.out, exist_ok=True)
+    jobs = [(args, shard, user_slice, message_slice)
+            for shard, (user_slice, message_slice)
+            in enumerate(zip(slices(args.users, args.shards),
+                             slices(args.messages, args.shards)))]
+
+    if args.shards == 1:
+        start_worker(tables)
+        write_shard(*jobs[0])
+    else:
+        with Pool(args.shards, initializer=start_worker, initargs=(tables,)) as pool:
+            for shard in pool.starmap(write_shard, jobs):
+                print(f"Wrote shard {shard}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,8 @@
 from datetime import datetime
 from random import uniform
 
+import numpy as np
+
 
 def get_random_datetime(year_gap=2):
     """Get a random datetime within the last few years."""
@@ -12,3 +14,32 @@ def get_random_datetime(year_gap=2):
     random_timestamp = uniform(then.timestamp(), now.timestamp())
 
     return datetime.fromtimestamp(random_timestamp)
+
+
+def get_random_datetimes(rng, size, year_gap=2, now=None):
+    """Get `size` random datetimes within the few years before `now`.
+
+    The vectorized form of `get_random_datetime`: returns a NumPy
+    datetime64[us] array drawn with the Generator `rng`.
+    """
+
+    now = now or datetime.now()
+    then = now.replace(year=now.year - year_gap)
+
+    start = np.datetime64(then, 'us')
+    span = (np.datetime64(now, 'us') - start).astype(np.int64)
+
+    return start + rng.integers(0, span, size).astype('timedelta64[us]')
+
+
+def power_law_weights(rng, size, exponent):
+    """Probabilities for `size` items that fall off as rank ** -exponent.
+
+    Items are given their rank in a random order, so the most popular one
+    isn't always the first.
+    """
+
+    weights = np.arange(1, size + 1, dtype=np.float64) ** -exponent
+    rng.shuffle(weights)
+
+    return weights / weights.sum()
@@ -0,0 +1,77 @@
+"""Liking and unliking warbles.
+
+A like is toggled by its (user_id, message_id) primary key without first
+loading anything. On PostgreSQL the toggle is one statement: a DELETE and a
+conditional INSERT ... ON CONFLICT DO NOTHING in the same WITH query. Other
+databases run the DELETE and, if nothing was deleted, an INSERT OR IGNORE.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import func
+
+import counters
+from models import db, Like
+
+TOGGLE_SQL = """
+WITH removed AS (
+    DELETE FROM likes
+    WHERE user_id = :user_id AND message_id = :message_id
+    RETURNING 1
+), added AS (
+    INSERT INTO likes (user_id, message_id, timestamp)
+    SELECT :user_id, :message_id, :timestamp
+    WHERE NOT EXISTS (SELECT 1 FROM removed)
+    ON CONFLICT DO NOTHING
+    RETURNING 1
+)
+SELECT (SELECT count(*) FROM removed), (SELECT count(*) FROM added)
+"""
+
+
+def _toggle_postgres(user_id, message_id):
+    params = {'user_id': user_id, 'message_id': message_id,
+              'timestamp': datetime.utcnow()}
+    removed, added = db.session.execute(db.text(TOGGLE_SQL), params).first()
+    return removed, added
+
+
+def _toggle_generic(user_id, message_id):
+    likes = Like.__table__
+    removed = db.session.execute(
+        likes.delete()
+        .where(likes.c.user_id == user_id)
+        .where(likes.c.message_id == message_id)).rowcount
+    if removed:
+        return removed, 0
+
+    added = db.session.execute(
+        likes.insert().prefix_with('OR IGNORE'),
+        {'user_id': user_id, 'message_id': message_id}).rowcount
+    return 0, added
+
+
+def toggle_like(user_id, message_id):
+    """Like `message_id` for `user_id`, or unlike it if already liked.
+
+    Updates the user's likes count and timeline version in the same
+    transaction (the caller commits). Returns (liked, like count for the
+    message). Raises IntegrityError if the message doesn't exist.
+    """
+
+    if db.engine.dialect.name == 'postgresql':
+        removed, added = _toggle_postgres(user_id, message_id)
+    else:
+        removed, added = _toggle_generic(user_id, message_id)
+
+    if removed or added:
+        # the like buttons on the user's home timeline change too
+        counters.adjust(user_id, likes_count=added - removed,
+                        timeline_version=1)
+
+    (like_count,) = (db.session
+                     .query(func.count())
+                     .filter(Like.message_id == message_id)
+                     .one())
+
+    return bool(added), like_count
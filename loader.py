@@ -0,0 +1,251 @@
+"""Bulk loading of CSV data (see generator/) into the database.
+
+Each table is read from `<table>.csv` in the data directory, plus any shards
+named `<table>-<n>.csv`. Rows are streamed in batches of `batch_size` and
+committed batch by batch, so memory use stays flat however big the files
+are. On PostgreSQL each batch is sent with `COPY`; other databases get an
+executemany INSERT.
+
+Secondary indexes on the loaded tables are dropped for the load and built
+once at the end, whether or not the load succeeded. Tables are loaded in
+foreign key order, and the files of tables that don't depend on each other
+(messages and follows, say) are loaded side by side on `workers` threads.
+"""
+
+import csv
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from glob import glob
+from itertools import count, islice
+from threading import Lock
+from time import perf_counter
+
+from sqlalchemy import func, select, text
+
+import snowflake
+from models import Follows, Like, Message, User
+
+DEFAULT_BATCH_SIZE = 10000
+DEFAULT_WORKERS = 4
+
+# tables in foreign key order; tables in the same stage load at the same time
+STAGES = [
+    [User.__table__],
+    [Message.__table__, Follows.__table__],
+    [Like.__table__],
+]
+
+
+def csv_files(data_dir, table):
+    """The CSV files holding rows for `table`, in name order."""
+
+    return (sorted(glob(os.path.join(data_dir, f"{table.name}.csv")))
+            + sorted(glob(os.path.join(data_dir, f"{table.name}-*.csv"))))
+
+
+def batches(rows, size):
+    """Split an iterable of rows into lists of at most `size`."""
+
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class UserIds:
+    """Ids for users in CSVs without an id column, handed out in file order.
+
+    Other CSVs refer to these users by their position in users.csv, so the
+    user files are loaded one after another by a single worker.
+    """
+
+    def __init__(self, start):
+        self.ids = count(start)
+        self.lock = Lock()
+
+    def __call__(self, row):
+        if not row.get('id'):
+            with self.lock:
+                row['id'] = next(self.ids)
+        return row
+
+
+def prepare_message(row):
+    """Parse a warble's timestamp and give it an id backdated to it."""
+
+    row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+    if not row.get('id'):
+        row['id'] = snowflake.next_id(at=row['timestamp'])
+    return row
+
+
+def prepare_like(row):
+    """Parse a like's timestamp, or date it to its warble's if it has none."""
+
+    if row.get('timestamp'):
+        row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+    else:
+        row['timestamp'] = snowflake.timestamp_of(int(row['message_id']))
+    return row
+
+
+def copy_batch(raw_conn, table, columns, rows):
+    """Send `rows` to PostgreSQL with COPY ... FROM STDIN."""
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([row[column] for column in columns]
+                                 for row in rows)
+    buffer.seek(0)
+
+    with raw_conn.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) "
+                           "FROM STDIN WITH (FORMAT csv)", buffer)
+    raw_conn.commit()
+
+
+def insert_batch(conn, table, columns, rows):
+    """Send `rows` as one executemany INSERT.
+
+    Empty fields are inserted as NULL, as COPY ... CSV loads them.
+    """
+
+    with conn.begin():
+        conn.execute(table.insert(),
+                     [{column: None if row[column] == '' else row[column]
+                       for column in columns}
+                      for row in rows])
+
+
+def load_files(engine, table, paths, prepare, batch_size):
+    """Load the CSV files at `paths` into `table`, one batch at a time.
+
+    Returns the number of rows loaded and the `perf_counter()` time it
+    finished at.
+    """
+
+    use_copy = engine.dialect.name == 'postgresql'
+    conn = engine.raw_connection() if use_copy else engine.connect()
+    loaded = 0
+
+    try:
+        for path in paths:
+            with open(path, newline='') as csv_file:
+                rows = map(prepare, csv.DictReader(csv_file))
+
+                for batch in batches(rows, batch_size):
+                    columns = [column for column in batch[0]
+                               if column in table.columns]
+                    if use_copy:
+                        copy_batch(conn, table, columns, batch)
+                    else:
+                        insert_batch(conn, table, columns, batch)
+                    loaded += len(batch)
+    finally:
+        conn.close()
+
+    return loaded, perf_counter()
+
+
+def drop_indexes(engine, tables):
+    """Drop the secondary indexes on `tables`, returning them."""
+
+    indexes = [index for table in tables for index in table.indexes]
+
+    with engine.begin() as conn:
+        for index in indexes:
+            conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+
+    return indexes
+
+
+def create_indexes(engine, indexes):
+    """Build the indexes dropped by `drop_indexes`."""
+
+    for index in indexes:
+        index.create(engine)
+
+
+def reset_sequence(engine, table):
+    """Move a serial id sequence on past ids loaded from the files."""
+
+    if engine.dialect.name == 'postgresql':
+        with engine.begin() as conn:
+            conn.execute(text(
+                "SELECT setval("
+                f"pg_get_serial_sequence('{table.name}', 'id'), "
+                f"(SELECT coalesce(max(id), 0) + 1 FROM {table.name}), "
+                "false)"))
+
+
+def load_tables(engine, data_dir, batch_size, workers, report):
+    """Load the CSV files of each stage of tables in turn; see `load`."""
+
+    with engine.connect() as conn:
+        first_user_id = conn.execute(
+            select([func.coalesce(func.max(User.id), 0) + 1])).scalar()
+
+    # lease this process's worker id before the messages need ids
+    snowflake.get_generator(engine)
+
+    preparers = {
+        'users': UserIds(first_user_id),
+        'messages': prepare_message,
+        'likes': prepare_like,
+    }
+
+    results = {}
+    with ThreadPoolExecutor(workers) as pool:
+        for stage in STAGES:
+            jobs = []
+            for table in stage:
+                paths = csv_files(data_dir, table)
+                if not paths:
+                    continue
+
+                prepare = preparers.get(table.name, lambda row: row)
+                # users get their ids in file order, so one worker reads them
+                if table is User.__table__:
+                    groups = [paths]
+                else:
+                    groups = [[path] for path in paths]
+
+                jobs.append((table, perf_counter(), [
+                    pool.submit(load_files, engine, table, group, prepare,
+                                batch_size)
+                    for group in groups]))
+
+            for table, start, futures in jobs:
+                rows, finished = zip(*(future.result() for future in futures))
+                rows = sum(rows)
+                seconds = max(finished) - start
+                results[table.name] = (rows, seconds)
+                report(f"{table.name}: {rows} rows in {seconds:.2f}s "
+                       f"({rows / seconds if seconds else 0:.0f} rows/s)")
+
+    return results
+
+
+def load(engine, data_dir, batch_size=DEFAULT_BATCH_SIZE,
+         workers=DEFAULT_WORKERS, report=print):
+    """Load every table's CSV files from `data_dir` into the database.
+
+    Calls `report` with a line of progress per table. Returns a dict of
+    table name to (rows loaded, seconds taken).
+    """
+
+    tables = [table for stage in STAGES for table in stage]
+    indexes = drop_indexes(engine, tables)
+
+    # a failed load mustn't leave the tables without their indexes
+    try:
+        return load_tables(engine, data_dir, batch_size, workers, report)
+    finally:
+        start = perf_counter()
+        create_indexes(engine, indexes)
+        reset_sequence(engine, User.__table__)
+        report(f"indexes: rebuilt {len(indexes)} in "
+               f"{perf_counter() - start:.2f}s")
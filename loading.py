@@ -0,0 +1,55 @@
+"""Named eager-loading profiles for the queries behind each page.
+
+A profile lists the columns a template actually renders, and loads any
+related rows it needs in the same round trip, so rendering a page of
+warbles doesn't lazy-load each author with its own SELECT. Views apply them
+with `with_profile(query, "timeline card")`.
+"""
+
+from sqlalchemy.orm import joinedload, load_only
+
+from models import Like, Message
+
+MESSAGE_COLUMNS = ('id', 'text', 'timestamp', 'user_id')
+AUTHOR_COLUMNS = ('id', 'username', 'image_url', 'profile_version')
+USER_CARD_COLUMNS = ('id', 'username', 'image_url', 'header_image_url', 'bio')
+PROFILE_HEADER_COLUMNS = USER_CARD_COLUMNS + (
+    'location', 'messages_count', 'following_count', 'followers_count',
+    'likes_count', 'profile_version')
+
+PROFILES = {
+    # a warble with its author's avatar and username (home.html,
+    # messages/show.html)
+    'timeline card': lambda: (
+        load_only(*MESSAGE_COLUMNS),
+        joinedload(Message.user).load_only(*AUTHOR_COLUMNS),
+    ),
+
+    # a like with the warble it likes and that warble's author (likes.html)
+    'liked message': lambda: (
+        joinedload(Like.message).load_only(*MESSAGE_COLUMNS),
+        joinedload(Like.message, Message.user).load_only(*AUTHOR_COLUMNS),
+    ),
+
+    # a warble on its author's own profile, which shows the author already
+    # (users/show.html)
+    'profile message': lambda: (
+        load_only(*MESSAGE_COLUMNS),
+    ),
+
+    # a card in a list of users (users/index.html, followers, following)
+    'user card': lambda: (
+        load_only(*USER_CARD_COLUMNS),
+    ),
+
+    # the header at the top of every profile page (users/detail.html)
+    'profile header': lambda: (
+        load_only(*PROFILE_HEADER_COLUMNS),
+    ),
+}
+
+
+def with_profile(query, name):
+    """Apply the loading profile called `name` to `query`."""
+
+    return query.options(*PROFILES[name]())
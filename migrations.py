@@ -0,0 +1,436 @@
+"""Versioned, reversible schema migrations.
+
+`db.create_all()` only creates tables that don't exist yet, so changes to
+tables that are already in a live database (new columns, new indexes) are
+made by the migrations here. Each `Migration` has a version and a list of
+operations that know how to apply and revert themselves; the versions that
+have been applied are recorded in the `schema_migrations` table.
+
+    flask db-upgrade            # apply every pending migration
+    flask db-downgrade 0001     # revert the migrations after 0001
+    flask db-status             # list migrations and whether they're applied
+
+On PostgreSQL, indexes are built with CREATE INDEX CONCURRENTLY outside of
+a transaction, so reads and writes carry on while the index builds.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import (Column, DateTime, Integer, MetaData, Table, Text,
+                        inspect, select, text)
+
+from models import db
+
+BASE = '0000'
+
+metadata = MetaData()
+
+schema_migrations = Table(
+    'schema_migrations', metadata,
+    Column('version', Text, primary_key=True),
+    Column('description', Text, nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+@contextmanager
+def autocommit(engine):
+    """A connection that runs each statement outside of a transaction."""
+
+    conn = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+class AddColumn:
+    """Add a column to a table, unless it's already there."""
+
+    def __init__(self, table, column, definition):
+        self.table = table
+        self.column = column
+        self.definition = definition
+
+    def column_names(self, conn):
+        return {column['name']
+                for column in inspect(conn).get_columns(self.table)}
+
+    def upgrade(self, engine):
+        with engine.begin() as conn:
+            if self.column not in self.column_names(conn):
+                conn.execute(text(f"ALTER TABLE {self.table} ADD COLUMN "
+                                  f"{self.column} {self.definition}"))
+
+    def downgrade(self, engine):
+        with engine.begin() as conn:
+            if self.column in self.column_names(conn):
+                conn.execute(text(f"ALTER TABLE {self.table} "
+                                  f"DROP COLUMN {self.column}"))
+
+
+class CreateIndex:
+    """Create an index, without locking out writes on PostgreSQL."""
+
+    def __init__(self, name, table, columns, unique=False):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.unique = unique
+
+    def upgrade(self, engine):
+        create = (f"CREATE {'UNIQUE ' if self.unique else ''}INDEX "
+                  "{concurrently}IF NOT EXISTS "
+                  f"{self.name} ON {self.table} ({', '.join(self.columns)})")
+
+        if engine.dialect.name != 'postgresql':
+            with engine.begin() as conn:
+                conn.execute(text(create.format(concurrently='')))
+            return
+
+        with autocommit(engine) as conn:
+            # a concurrent build that failed part way leaves an invalid index
+            # behind, which IF NOT EXISTS would otherwise accept
+            invalid = conn.execute(text(
+                "SELECT 1 FROM pg_index i "
+                "JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE c.relname = :name AND NOT i.indisvalid"),
+                name=self.name).scalar()
+            if invalid:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY {self.name}"))
+
+            conn.execute(text(create.format(concurrently='CONCURRENTLY ')))
+
+    def downgrade(self, engine):
+        if engine.dialect.name != 'postgresql':
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP INDEX IF EXISTS {self.name}"))
+            return
+
+        with autocommit(engine) as conn:
+            conn.execute(text(
+                f"DROP INDEX CONCURRENTLY IF EXISTS {self.name}"))
+
+
+class DropColumn(AddColumn):
+    """Drop a column; reverting adds it back empty, as `definition`."""
+
+    upgrade = AddColumn.downgrade
+    downgrade = AddColumn.upgrade
+
+
+class DropIndex(CreateIndex):
+    """Drop an index; reverting builds it again from `columns`."""
+
+    upgrade = CreateIndex.downgrade
+    downgrade = CreateIndex.upgrade
+
+
+class Execute:
+    """Run SQL statements on one database dialect only."""
+
+    def __init__(self, dialect, upgrade, downgrade):
+        self.dialect = dialect
+        self.upgrade_statements = upgrade
+        self.downgrade_statements = downgrade
+
+    def run(self, engine, statements):
+        if engine.dialect.name != self.dialect:
+            return
+
+        with engine.begin() as conn:
+            for statement in statements:
+                conn.execute(text(statement))
+
+    def upgrade(self, engine):
+        self.run(engine, self.upgrade_statements)
+
+    def downgrade(self, engine):
+        self.run(engine, self.downgrade_statements)
+
+
+class ChangePrimaryKey:
+    """Key a table on `columns` instead of its surrogate `old_key` column.
+
+    The old key column and any unique constraints are dropped, along with
+    rows that would duplicate the new key (the first is kept). Reverting
+    adds `old_key` back as a serial primary key but leaves the unique
+    constraints off, since the data may no longer fit them.
+
+    PostgreSQL alters the table in place; SQLite can't change a primary
+    key, so the table is rebuilt from its model (or, reverting, from the
+    model plus `old_key`) and the rows copied across.
+    """
+
+    def __init__(self, table, columns, old_key):
+        self.table = table
+        self.columns = columns
+        self.old_key = old_key
+
+    def primary_key(self, conn):
+        return inspect(conn).get_pk_constraint(self.table)['constrained_columns']
+
+    def rebuild(self, conn, table):
+        """Replace the SQLite table with `table`, keeping the rows that fit."""
+
+        for index in inspect(conn).get_indexes(self.table):
+            conn.execute(text(f"DROP INDEX {index['name']}"))
+        conn.execute(text(f"ALTER TABLE {self.table} "
+                          f"RENAME TO {self.table}_old"))
+        table.create(conn)
+
+        old_columns = {column['name'] for column
+                       in inspect(conn).get_columns(f"{self.table}_old")}
+        columns = ', '.join(column.name for column in table.columns
+                            if column.name in old_columns)
+        conn.execute(text(
+            f"INSERT OR IGNORE INTO {self.table} ({columns}) "
+            f"SELECT {columns} FROM {self.table}_old WHERE "
+            + " AND ".join(f"{column} IS NOT NULL"
+                           for column in self.columns)))
+        conn.execute(text(f"DROP TABLE {self.table}_old"))
+
+    def upgrade(self, engine):
+        model = db.metadata.tables[self.table]
+        key = ', '.join(self.columns)
+
+        with engine.begin() as conn:
+            if self.primary_key(conn) == self.columns:
+                return
+
+            if engine.dialect.name != 'postgresql':
+                self.rebuild(conn, model)
+                return
+
+            conn.execute(text(
+                f"DELETE FROM {self.table} WHERE "
+                + " OR ".join(f"{column} IS NULL" for column in self.columns)
+                + f" OR {self.old_key} NOT IN (SELECT min({self.old_key}) "
+                f"FROM {self.table} GROUP BY {key})"))
+
+            constraints = inspect(conn).get_unique_constraints(self.table)
+            constraints.append(inspect(conn).get_pk_constraint(self.table))
+            for constraint in constraints:
+                conn.execute(text(f"ALTER TABLE {self.table} "
+                                  f"DROP CONSTRAINT {constraint['name']}"))
+
+            conn.execute(text(f"ALTER TABLE {self.table} "
+                              f"DROP COLUMN {self.old_key}"))
+            conn.execute(text(f"ALTER TABLE {self.table} "
+                              f"ADD PRIMARY KEY ({key})"))
+
+    def downgrade(self, engine):
+        model = db.metadata.tables[self.table]
+
+        with engine.begin() as conn:
+            if self.primary_key(conn) == [self.old_key]:
+                return
+
+            if engine.dialect.name != 'postgresql':
+                old = Table(self.table, MetaData(),
+                            Column(self.old_key, Integer, primary_key=True),
+                            *(Column(column.name, column.type)
+                              for column in model.columns))
+                self.rebuild(conn, old)
+                return
+
+            pk = inspect(conn).get_pk_constraint(self.table)['name']
+            conn.execute(text(f"ALTER TABLE {self.table} "
+                              f"DROP CONSTRAINT {pk}"))
+            conn.execute(text(f"ALTER TABLE {self.table} ADD COLUMN "
+                              f"{self.old_key} SERIAL PRIMARY KEY"))
+
+
+class Migration:
+    """One version of the schema: operations applied in order."""
+
+    def __init__(self, version, description, operations):
+        self.version = version
+        self.description = description
+        self.operations = operations
+
+    def __repr__(self):
+        return f"<Migration {self.version}: {self.description}>"
+
+    def upgrade(self, engine):
+        for operation in self.operations:
+            operation.upgrade(engine)
+
+    def downgrade(self, engine):
+        for operation in reversed(self.operations):
+            operation.downgrade(engine)
+
+
+MIGRATIONS = [
+    # follow with `flask counters-repair` to fill the new columns in
+    Migration('0001', "Denormalized counters on users", [
+        AddColumn('users', 'messages_count', "INTEGER NOT NULL DEFAULT 0"),
+        AddColumn('users', 'following_count', "INTEGER NOT NULL DEFAULT 0"),
+        AddColumn('users', 'followers_count', "INTEGER NOT NULL DEFAULT 0"),
+        AddColumn('users', 'likes_count', "INTEGER NOT NULL DEFAULT 0"),
+    ]),
+
+    Migration('0002', "Indexes for the homepage, profile and follower pages", [
+        CreateIndex('ix_messages_user_timestamp',
+                    'messages', ['user_id', 'timestamp', 'id']),
+        CreateIndex('ix_follows_user_following_id',
+                    'follows', ['user_following_id']),
+        CreateIndex('ix_likes_message_id', 'likes', ['message_id']),
+    ]),
+
+    # existing warbles keep their small ids, which sort before every new
+    # snowflake id just as their timestamps do. Widening the columns
+    # rewrites the tables under an exclusive lock; SQLite integers are 64
+    # bits already.
+    Migration('0003', "Snowflake message ids", [
+        Execute('postgresql', upgrade=[
+            "ALTER TABLE messages ALTER COLUMN id DROP DEFAULT",
+            "ALTER TABLE messages ALTER COLUMN id TYPE BIGINT",
+            "ALTER TABLE likes ALTER COLUMN message_id TYPE BIGINT",
+            "ALTER TABLE timeline_entries ALTER COLUMN message_id TYPE BIGINT",
+        ], downgrade=[
+            "ALTER TABLE timeline_entries ALTER COLUMN message_id TYPE INTEGER",
+            "ALTER TABLE likes ALTER COLUMN message_id TYPE INTEGER",
+            # fails once there are snowflake ids, which don't fit
+            "ALTER TABLE messages ALTER COLUMN id TYPE INTEGER",
+            "CREATE SEQUENCE IF NOT EXISTS messages_id_seq "
+            "OWNED BY messages.id",
+            "SELECT setval('messages_id_seq', "
+            "(SELECT coalesce(max(id), 0) + 1 FROM messages), false)",
+            "ALTER TABLE messages ALTER COLUMN id "
+            "SET DEFAULT nextval('messages_id_seq')",
+        ]),
+        CreateIndex('ix_messages_user_id', 'messages', ['user_id', 'id']),
+        DropIndex('ix_messages_user_timestamp',
+                  'messages', ['user_id', 'timestamp', 'id']),
+        # timelines are ordered by message id now; after reverting, refill
+        # the column with `flask timeline-backfill`
+        DropIndex('ix_timeline_entries_user_timestamp',
+                  'timeline_entries', ['user_id', 'timestamp', 'message_id']),
+        DropColumn('timeline_entries', 'timestamp', "TIMESTAMP"),
+    ]),
+
+    Migration('0004', "Index for paging through who a user follows", [
+        CreateIndex('ix_follows_following_followed',
+                    'follows', ['user_following_id', 'user_being_followed_id']),
+        DropIndex('ix_follows_user_following_id',
+                  'follows', ['user_following_id']),
+    ]),
+
+    # nobody knows when existing likes happened, so they get the time of the
+    # warble they like, the earliest they could have been
+    Migration('0005', "Like timestamps for the likes page", [
+        AddColumn('likes', 'timestamp', "TIMESTAMP"),
+        Execute('postgresql', upgrade=[
+            "UPDATE likes SET timestamp = messages.timestamp FROM messages "
+            "WHERE messages.id = likes.message_id AND likes.timestamp IS NULL",
+            "ALTER TABLE likes ALTER COLUMN timestamp SET NOT NULL",
+        ], downgrade=[]),
+        Execute('sqlite', upgrade=[
+            "UPDATE likes SET timestamp = (SELECT timestamp FROM messages "
+            "WHERE messages.id = likes.message_id) WHERE timestamp IS NULL",
+        ], downgrade=[]),
+        CreateIndex('ix_likes_user_timestamp',
+                    'likes', ['user_id', 'timestamp', 'message_id']),
+    ]),
+
+    Migration('0006', "Profile versions for HTTP caching", [
+        AddColumn('users', 'profile_version', "INTEGER NOT NULL DEFAULT 0"),
+    ]),
+
+    Migration('0007', "Timeline versions for HTTP caching", [
+        AddColumn('users', 'timeline_version', "INTEGER NOT NULL DEFAULT 0"),
+    ]),
+
+    # likes used to have their own id and allowed one like per warble
+    # (unique message_id), so a second user's like was silently dropped
+    Migration('0008', "Key likes on (user_id, message_id)", [
+        ChangePrimaryKey('likes', ['user_id', 'message_id'], 'id'),
+        # the old unique constraint served counting a warble's likes
+        CreateIndex('ix_likes_message_id', 'likes', ['message_id']),
+    ]),
+]
+
+
+def applied_versions(engine=None):
+    """The set of migration versions applied to the database."""
+
+    engine = engine or db.engine
+    metadata.create_all(engine)
+
+    with engine.connect() as conn:
+        return {version for (version,)
+                in conn.execute(select([schema_migrations.c.version]))}
+
+
+def check_target(target):
+    if target != BASE and target not in {m.version for m in MIGRATIONS}:
+        raise ValueError(f"Unknown migration version: {target}")
+
+
+def upgrade(target=None):
+    """Apply pending migrations, up to and including `target` if given.
+
+    Tables that don't exist yet are created from the models first. Returns
+    the migrations that were applied.
+    """
+
+    if target is not None:
+        check_target(target)
+
+    engine = db.engine
+    db.create_all()
+    applied = applied_versions(engine)
+
+    done = []
+    for migration in MIGRATIONS:
+        if target is not None and migration.version > target:
+            break
+        if migration.version in applied:
+            continue
+
+        migration.upgrade(engine)
+        with engine.begin() as conn:
+            conn.execute(schema_migrations.insert().values(
+                version=migration.version,
+                description=migration.description,
+                applied_at=datetime.utcnow()))
+        done.append(migration)
+
+    return done
+
+
+def downgrade(target=BASE):
+    """Revert the applied migrations after `target`, newest first.
+
+    Returns the migrations that were reverted.
+    """
+
+    check_target(target)
+
+    engine = db.engine
+    applied = applied_versions(engine)
+
+    done = []
+    for migration in reversed(MIGRATIONS):
+        if migration.version <= target:
+            break
+        if migration.version not in applied:
+            continue
+
+        migration.downgrade(engine)
+        with engine.begin() as conn:
+            conn.execute(schema_migrations.delete().where(
+                schema_migrations.c.version == migration.version))
+        done.append(migration)
+
+    return done
+
+
+def status():
+    """Every migration, paired with whether it has been applied."""
+
+    applied = applied_versions()
+    return [(migration, migration.version in applied)
+            for migration in MIGRATIONS]
@@ -1,12 +1,28 @@
 """SQLAlchemy models for Warbler."""
 
+import sqlite3
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+import passwords
+import snowflake
+from replicas import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
+
+
+@event.listens_for(Engine, 'connect')
+def enforce_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """Have SQLite check foreign keys, as it doesn't unless asked to.
+
+    Without it, liking a missing warble would add an orphaned like instead
+    of raising IntegrityError, and ON DELETE CASCADE would do nothing.
+    """
+
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute('PRAGMA foreign_keys = ON')
 
 
 class Follows(db.Model):
@@ -26,29 +42,49 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # the primary key serves a user's followers; this serves who they follow,
+    # in the order the following page pages through them
+    __table_args__ = (
+        db.Index('ix_follows_following_followed',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
 
 class Like(db.Model):
     """Mapping user likes to warbles."""
 
     __tablename__ = 'likes' 
 
-    id = db.Column(
-        db.Integer,
-        primary_key=True
-    )
-
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade')
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True
     )
 
     message_id = db.Column(
-        db.Integer,
+        db.BigInteger,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        primary_key=True,
+        index=True
     )
 
-    message = db.relationship("Message", backref="likes")
+    # when the like happened; the likes page is ordered by it
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    message = db.relationship(
+        "Message",
+        backref=db.backref("likes",
+                           cascade="all, delete-orphan",
+                           passive_deletes=True),
+    )
+
+    __table_args__ = (
+        db.Index('ix_likes_user_timestamp', 'user_id', 'timestamp', 'message_id'),
+    )
 
 
 class User(db.Model):
@@ -96,7 +132,58 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message')
+    # Denormalized counts for profile headers; kept in step by `counters`
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Bumped whenever the profile is edited, so caches of anything showing
+    # the user's name or pictures can tell they're stale
+    profile_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Bumped whenever anything shown on the user's home timeline changes
+    # (see timeline.marker), so it can be revalidated without reading it
+    timeline_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    messages = db.relationship(
+        'Message',
+        cascade='all, delete-orphan',
+        passive_deletes=True,
+    )
 
     followers = db.relationship(
         "User",
@@ -123,14 +210,16 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        follow = Follows.query.filter_by(user_being_followed_id=self.id,
+                                         user_following_id=other_user.id)
+        return db.session.query(follow.exists()).scalar()
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        follow = Follows.query.filter_by(user_following_id=self.id,
+                                         user_being_followed_id=other_user.id)
+        return db.session.query(follow.exists()).scalar()
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -139,7 +228,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = passwords.hash_password(password)
 
         user = User(
             username=username,
@@ -160,13 +249,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash used an old bcrypt work factor, it is replaced with
+        a fresh one; the caller should commit.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = passwords.check_password(user.password, password)
             if is_auth:
+                if passwords.needs_rehash(user.password):
+                    user.password = passwords.hash_password(password)
                 return user
 
         return False
@@ -177,9 +271,11 @@ class Message(db.Model):
 
     __tablename__ = 'messages'
 
+    # time-ordered; see snowflake.py
     id = db.Column(
-        db.Integer,
+        db.BigInteger,
         primary_key=True,
+        autoincrement=False,
     )
 
     text = db.Column(
@@ -187,10 +283,10 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # set from the id when the message is inserted
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
     )
 
     user_id = db.Column(
@@ -201,6 +297,54 @@ class Message(db.Model):
 
     user = db.relationship('User')
 
+    __table_args__ = (
+        db.Index('ix_messages_user_id', 'user_id', 'id'),
+    )
+
+
+@event.listens_for(Message, 'before_insert')
+def assign_message_id(mapper, connection, message):
+    """Give a new message a snowflake id, and its timestamp from that id.
+
+    A message given a timestamp but no id (e.g. an imported warble) gets an
+    id backdated to that time.
+    """
+
+    if message.id is None:
+        message.id = snowflake.next_id(at=message.timestamp,
+                                       engine=connection.engine)
+    if message.timestamp is None:
+        message.timestamp = snowflake.timestamp_of(message.id)
+
+
+class TimelineEntry(db.Model):
+    """A warble materialized into one user's home timeline."""
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    # entries are read newest first by the (user_id, message_id) primary key
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_author', 'user_id', 'author_id'),
+    )
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
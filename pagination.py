@@ -0,0 +1,174 @@
+"""Keyset (cursor) pagination for lists of warbles and users.
+
+Pages are keyed on an id rather than an offset, so fetching the tenth page
+is the same indexed seek as fetching the first. Warble ids are time-ordered
+(see snowflake.py), so the id alone gives newest-first order. Cursors are
+passed in the querystring as `before` (older warbles) or `after` (newer).
+
+Lists of users are keyed on the user id too, but listed oldest first; see
+`paginate_by_id`. Rows without a time-ordered id of their own, like likes,
+are keyed on a (timestamp, id) pair instead; see `paginate_by_time`.
+"""
+
+from datetime import datetime, timedelta
+
+from flask import abort, current_app, request
+from sqlalchemy import tuple_
+
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+PER_PAGE = 100
+USERS_PER_PAGE = 24
+
+
+class Page:
+    """One page of items plus the cursors for the pages either side of it."""
+
+    def __init__(self, items, older=None, newer=None, oldest_first=False):
+        self.items = items
+        self.older = older
+        self.newer = newer
+        self.oldest_first = oldest_first
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def per_page():
+    """Number of items on each page, from `MESSAGES_PER_PAGE` if set."""
+
+    return current_app.config.get('MESSAGES_PER_PAGE', PER_PAGE)
+
+
+def requested_cursors(parse=int):
+    """Get the (before, after) cursors from the current request.
+
+    Either is None if it is missing or malformed, that is, if `parse` raises
+    ValueError for it. A cursor out of `parse`'s range (OverflowError) is a
+    400 Bad Request.
+    """
+
+    try:
+        return (request.args.get('before', type=parse),
+                request.args.get('after', type=parse))
+    except OverflowError:
+        abort(400)
+
+
+def time_cursor(timestamp, row_id):
+    """The cursor for a row at `timestamp` with id `row_id`."""
+
+    return f"{(timestamp - UNIX_EPOCH) // timedelta(microseconds=1)}_{row_id}"
+
+
+def parse_time_cursor(cursor):
+    """The (timestamp, id) in a `time_cursor`.
+
+    Raises ValueError if it is malformed, or OverflowError if its time is
+    out of range.
+    """
+
+    micros, row_id = cursor.split('_')
+    return UNIX_EPOCH + timedelta(microseconds=int(micros)), int(row_id)
+
+
+def seek(query, column, before=None, after=None, oldest_first=False):
+    """Filter and order `query` to the rows just past a cursor.
+
+    `column` is the id to sort on, or a tuple of columns compared as a row
+    against tuple cursors. With `after`, rows come back oldest first (the
+    caller reverses them); otherwise newest first. Lists shown
+    `oldest_first` start from the oldest rows when there is no cursor.
+    """
+
+    if isinstance(column, tuple):
+        columns, column = column, tuple_(*column)
+    else:
+        columns = (column,)
+
+    if after is not None or (oldest_first and before is None):
+        if after is not None:
+            query = query.filter(column > after)
+        return query.order_by(*(each.asc() for each in columns))
+
+    if before is not None:
+        query = query.filter(column < before)
+
+    return query.order_by(*(each.desc() for each in columns))
+
+
+def make_page(rows, size, before=None, after=None, key=lambda item: item.id,
+              oldest_first=False):
+    """Build a Page from up to `size + 1` rows returned by `seek`.
+
+    The extra row only tells us whether there is another page past this one.
+    Pass the same `oldest_first` as to `seek`; the page's items are in that
+    order.
+    """
+
+    has_more = len(rows) > size
+    items = list(rows[:size])
+
+    if not items:
+        return Page(items, oldest_first=oldest_first)
+
+    # the rows are in the order `seek` gave them
+    ascending = after is not None or (oldest_first and before is None)
+
+    if ascending:
+        older = key(items[0]) if after is not None else None
+        newer = key(items[-1]) if has_more else None
+    else:
+        older = key(items[-1]) if has_more else None
+        newer = key(items[0]) if before is not None else None
+
+    if ascending != oldest_first:
+        items.reverse()
+
+    return Page(items, older=older, newer=newer, oldest_first=oldest_first)
+
+
+def paginate(query, column, size=None):
+    """Get the requested page of `query`, newest first by `column`."""
+
+    size = size or per_page()
+    before, after = requested_cursors()
+    rows = seek(query, column, before, after).limit(size + 1).all()
+    return make_page(rows, size, before, after)
+
+
+def paginate_by_time(query, time_column, id_column, size=None):
+    """Get the requested page of `query`, newest first by `time_column`.
+
+    Ties in time are broken by `id_column`. The cursors are `time_cursor`
+    strings built from the two columns of the first and last rows.
+    """
+
+    size = size or per_page()
+    before, after = requested_cursors(parse_time_cursor)
+    rows = (seek(query, (time_column, id_column), before, after)
+            .limit(size + 1)
+            .all())
+
+    return make_page(rows, size, before, after,
+                     key=lambda item: time_cursor(
+                         getattr(item, time_column.key),
+                         getattr(item, id_column.key)))
+
+
+def paginate_by_id(query, column, size=None):
+    """Get the requested page of `query`, oldest first by `column`.
+
+    The cursors are the same as for `paginate`: `Page.newer` (`?after=`) is
+    the next page and `Page.older` (`?before=`) the previous one.
+    """
+
+    size = size or current_app.config.get('USERS_PER_PAGE', USERS_PER_PAGE)
+    before, after = requested_cursors()
+    rows = (seek(query, column, before, after, oldest_first=True)
+            .limit(size + 1)
+            .all())
+    return make_page(rows, size, before, after, oldest_first=True)
@@ -0,0 +1,212 @@
+"""Password hashing and checking off the request thread.
+
+bcrypt is deliberately slow, so running it in the web worker lets a burst of
+logins or signups tie up every worker. Here the work is handed to a bounded
+pool of processes instead:
+
+- `BCRYPT_LOG_ROUNDS` is the bcrypt work factor for new hashes (default 12).
+- `BCRYPT_WORKERS` is the pool size; 0 hashes in the calling thread.
+- `BCRYPT_MAX_QUEUE` caps the hashes in flight or waiting in the pool.
+- `BCRYPT_QUEUE_TIMEOUT` is how long, in seconds, a caller waits in all (for
+  room in the queue and then for its hash) before giving up with
+  `PasswordQueueFull`, which the app answers with a 503. A request thread is
+  never held longer than that, however far behind the pool gets.
+
+Each hash and check logs a JSON line to the `warbler.passwords` logger with
+its time and `metrics()`: queue depth and hash/check latency for this
+process.
+"""
+
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+
+import bcrypt
+from flask import current_app, has_app_context
+
+DEFAULT_ROUNDS = 12
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_QUEUE = 32
+DEFAULT_QUEUE_TIMEOUT = 10
+
+# bcrypt only looks at the first 72 bytes of a password
+MAX_PASSWORD_BYTES = 72
+
+logger = logging.getLogger('warbler.passwords')
+
+
+class PasswordQueueFull(Exception):
+    """Too many passwords are already waiting to be hashed.
+
+    Raised once a caller has waited `queue_timeout` seconds for its hash.
+    """
+
+
+def _encode(password):
+    return password.encode('utf-8')[:MAX_PASSWORD_BYTES]
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(_encode(password),
+                         bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(hashed, password):
+    return bcrypt.checkpw(_encode(password), hashed.encode('utf-8'))
+
+
+class PasswordHasher:
+    """Runs bcrypt on a process pool, keeping simple timing metrics."""
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=DEFAULT_WORKERS,
+                 max_queue=DEFAULT_MAX_QUEUE,
+                 queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self.rounds = rounds
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self.slots = BoundedSemaphore(max_queue)
+        self.executor = None
+
+        self.lock = Lock()
+        self.depth = 0
+        self.stats = {
+            'max_queue_depth': 0,
+            'hash': {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0},
+            'check': {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0},
+        }
+
+    def _get_executor(self):
+        # started on first use, so each forked web worker gets its own pool
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.workers)
+        return self.executor
+
+    def _release(self, kind, start):
+        elapsed = perf_counter() - start
+        self.slots.release()
+
+        with self.lock:
+            self.depth -= 1
+            timing = self.stats[kind]
+            timing['count'] += 1
+            timing['total_seconds'] += elapsed
+            timing['max_seconds'] = max(timing['max_seconds'], elapsed)
+
+        logger.info(json.dumps({'event': f'password_{kind}',
+                                'seconds': round(elapsed, 4),
+                                **self.metrics()}))
+
+    def _run(self, kind, fn, *args):
+        start = perf_counter()
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            raise PasswordQueueFull()
+
+        with self.lock:
+            self.depth += 1
+            self.stats['max_queue_depth'] = max(
+                self.stats['max_queue_depth'], self.depth)
+
+        if not self.workers:
+            try:
+                return fn(*args)
+            finally:
+                self._release(kind, start)
+
+        # the slot is held until the hash is done, even if we stop waiting
+        future = self._get_executor().submit(fn, *args)
+        future.add_done_callback(lambda future: self._release(kind, start))
+
+        remaining = self.queue_timeout - (perf_counter() - start)
+        try:
+            return future.result(timeout=max(remaining, 0))
+        except TimeoutError:
+            future.cancel()
+            raise PasswordQueueFull()
+
+    def hash(self, password):
+        return self._run('hash', _hash, password, self.rounds)
+
+    def check(self, hashed, password):
+        return self._run('check', _check, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made with a different work factor than ours?"""
+
+        # bcrypt hashes look like $2b$12$<salt and hash>
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def metrics(self):
+        """Queue depth now and at most, and hash/check counts and timings."""
+
+        with self.lock:
+            stats = {'queue_depth': self.depth,
+                     'max_queue_depth': self.stats['max_queue_depth']}
+            for kind in ('hash', 'check'):
+                timing = self.stats[kind]
+                stats[kind] = dict(
+                    timing,
+                    mean_seconds=(timing['total_seconds'] / timing['count']
+                                  if timing['count'] else 0.0))
+        return stats
+
+
+_default_hasher = None
+
+
+def get_hasher():
+    """Get the current app's PasswordHasher, creating it on first use.
+
+    Outside an app context (scripts, model tests) a hasher with the default
+    settings is used.
+    """
+
+    global _default_hasher
+
+    if not has_app_context():
+        if _default_hasher is None:
+            _default_hasher = PasswordHasher()
+        return _default_hasher
+
+    hasher = current_app.extensions.get('password_hasher')
+
+    if hasher is None:
+        config = current_app.config
+        hasher = PasswordHasher(
+            rounds=config.get('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS),
+            workers=config.get('BCRYPT_WORKERS', DEFAULT_WORKERS),
+            max_queue=config.get('BCRYPT_MAX_QUEUE', DEFAULT_MAX_QUEUE),
+            queue_timeout=config.get('BCRYPT_QUEUE_TIMEOUT',
+                                     DEFAULT_QUEUE_TIMEOUT))
+        current_app.extensions['password_hasher'] = hasher
+
+    return hasher
+
+
+def hash_password(password):
+    """Hash `password` with the configured work factor."""
+
+    return get_hasher().hash(password)
+
+
+def check_password(hashed, password):
+    """Does `password` match the bcrypt hash `hashed`?"""
+
+    return get_hasher().check(hashed, password)
+
+
+def needs_rehash(hashed):
+    """Should `hashed` be replaced with one at the current work factor?"""
+
+    return get_hasher().needs_rehash(hashed)
+
+
+def metrics():
+    """Queue depth and hash/check latency for this process."""
+
+    return get_hasher().metrics()
@@ -0,0 +1,103 @@
+"""Sending reads to read replicas, while visitors still see their own writes.
+
+With `SQLALCHEMY_REPLICA_URIS` set, the queries of GET and HEAD requests go
+to a replica, picked at random once per request. Everything else goes to
+the primary database: other request methods, CLI commands and tests outside
+a request, and every query in a request after it has written anything.
+
+Replicas lag a little behind the primary. So once a visitor's request
+writes (posting, following, liking...), their session is pinned to the
+primary for `REPLICA_PIN_SECONDS` and they see their own changes at once.
+"""
+
+import random
+from time import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, orm
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+
+DEFAULT_PIN_SECONDS = 10
+
+# session key holding when this visitor last wrote to the primary
+PIN_KEY = 'db_wrote_at'
+
+READ_METHODS = {'GET', 'HEAD'}
+
+
+def pin_seconds():
+    """How long after a write a visitor's reads stay on the primary."""
+
+    return current_app.config.get('REPLICA_PIN_SECONDS', DEFAULT_PIN_SECONDS)
+
+
+def get_replica():
+    """The replica engine for this request, or None to use the primary."""
+
+    if not has_request_context() or request.method not in READ_METHODS:
+        return None
+    if g.get('db_wrote') or session.get(PIN_KEY, 0) + pin_seconds() > time():
+        return None
+
+    if 'db_replica' not in g:
+        uris = current_app.config.get('SQLALCHEMY_REPLICA_URIS')
+        g.db_replica = get_engine(random.choice(uris)) if uris else None
+
+    return g.db_replica
+
+
+def get_engine(uri):
+    """Get the engine for the replica at `uri`, creating it on first use."""
+
+    engines = current_app.extensions.setdefault('db_replicas', {})
+
+    if uri not in engines:
+        engines[uri] = create_engine(
+            uri, echo=current_app.config.get('SQLALCHEMY_ECHO', False))
+
+    return engines[uri]
+
+
+def mark_write():
+    """Keep the rest of this request and this visitor's next few on the
+    primary database.
+    """
+
+    if has_request_context():
+        g.db_wrote = True
+
+
+class RoutingSession(SignallingSession):
+    """A session that reads from a replica when `get_replica` allows."""
+
+    def get_bind(self, mapper=None, clause=None):
+        # raw SQL might write, so it goes to the primary too
+        if self._flushing or isinstance(clause, (UpdateBase, TextClause)):
+            mark_write()
+        else:
+            replica = get_replica()
+            if replica is not None:
+                return replica
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with sessions that route reads to replicas."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def _remember_write(response):
+    if g.pop('db_wrote', False):
+        session[PIN_KEY] = time()
+    return response
+
+
+def init_app(app):
+    """Pin visitors to the primary for a while after their requests write."""
+
+    app.after_request(_remember_write)
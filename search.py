@@ -0,0 +1,185 @@
+"""User search over username, bio and location.
+
+Searches are case-insensitive substring matches run against the users table
+itself. Run `flask search-index` once to index them:
+
+- on PostgreSQL, a trigram (pg_trgm) GIN index on the searchable text;
+- on SQLite, an FTS5 trigram table (`users_search`) kept in step with users
+  by triggers. Searches for terms of three or more characters look up
+  candidates in it; shorter ones scan the users table.
+
+Until the index exists, and on databases without either, every search
+scans the users table.
+
+Results put username prefix matches first, then other username matches,
+then bio/location matches, and are capped at `MAX_RESULTS`.
+"""
+
+from flask import current_app
+from sqlalchemy import case, func, select
+from sqlalchemy.exc import OperationalError
+
+from loading import with_profile
+from models import db, User
+
+PER_PAGE = 24
+MAX_RESULTS = 480
+
+SEARCH_INDEX_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """CREATE INDEX IF NOT EXISTS ix_users_search_trgm ON users USING gin (
+        (lower(coalesce(username, '') || ' ' || coalesce(bio, '') || ' '
+               || coalesce(location, ''))) gin_trgm_ops)""",
+]
+
+
+SQLITE_SEARCH_TEXT = """lower(coalesce(new.username, '') || ' '
+    || coalesce(new.bio, '') || ' ' || coalesce(new.location, ''))"""
+
+SQLITE_SEARCH_INDEX_DDL = [
+    "DROP TABLE IF EXISTS users_search",
+    "CREATE VIRTUAL TABLE users_search "
+    "USING fts5(search_text, tokenize='trigram')",
+    "INSERT INTO users_search (rowid, search_text) "
+    "SELECT id, " + SQLITE_SEARCH_TEXT.replace('new.', '') + " FROM users",
+    "DROP TRIGGER IF EXISTS users_search_insert",
+    "CREATE TRIGGER users_search_insert AFTER INSERT ON users BEGIN "
+    "INSERT INTO users_search (rowid, search_text) "
+    f"VALUES (new.id, {SQLITE_SEARCH_TEXT}); END",
+    "DROP TRIGGER IF EXISTS users_search_update",
+    "CREATE TRIGGER users_search_update "
+    "AFTER UPDATE OF id, username, bio, location ON users BEGIN "
+    "DELETE FROM users_search WHERE rowid = old.id; "
+    "INSERT INTO users_search (rowid, search_text) "
+    f"VALUES (new.id, {SQLITE_SEARCH_TEXT}); END",
+    "DROP TRIGGER IF EXISTS users_search_delete",
+    "CREATE TRIGGER users_search_delete AFTER DELETE ON users BEGIN "
+    "DELETE FROM users_search WHERE rowid = old.id; END",
+]
+
+# the trigram tokenizer can't match anything shorter
+MIN_TRIGRAM_TERM = 3
+
+
+class SearchPage:
+    """One page of search results."""
+
+    def __init__(self, users, page, has_next):
+        self.users = users
+        self.page = page
+        self.has_next = has_next
+
+
+def escape_like(term):
+    """Escape LIKE wildcards so `term` only matches itself."""
+
+    return (term
+            .replace('\\', '\\\\')
+            .replace('%', '\\%')
+            .replace('_', '\\_'))
+
+
+def searchable_text():
+    """The lowercased text a user is matched against, as a SQL expression."""
+
+    return func.lower(func.coalesce(User.username, '') + ' '
+                      + func.coalesce(User.bio, '') + ' '
+                      + func.coalesce(User.location, ''))
+
+
+def sqlite_candidates(term):
+    """A select of ids of users whose text may contain `term`, from the
+    SQLite trigram table; None if it can't answer for `term`.
+    """
+
+    if (db.engine.dialect.name != 'sqlite'
+            or len(term) < MIN_TRIGRAM_TERM):
+        return None
+
+    # the triggers go with the users table, so without them the trigram
+    # table (if any) is out of date
+    indexed = db.session.execute(db.text(
+        "SELECT 1 FROM sqlite_master "
+        "WHERE type = 'trigger' AND name = 'users_search_insert'")).scalar()
+    if not indexed:
+        return None
+
+    phrase = '"' + term.replace('"', '""') + '"'
+    return (select([db.column('rowid')])
+            .select_from(db.table('users_search'))
+            .where(db.literal_column('search_text').match(phrase)))
+
+
+class UserSearch:
+    """Matches lowercased text with LIKE, served by the search index.
+
+    Every search reads the users table (or, on SQLite, the trigram table its
+    triggers keep in step), so results are never stale, however and wherever
+    a user was changed (another process, a loader run, manual SQL).
+    """
+
+    def search(self, term, offset, limit):
+        candidates = sqlite_candidates(term.lower())
+        term = escape_like(term.lower())
+        username = func.lower(User.username)
+
+        rank = case([(username.like(f"{term}%", escape='\\'), 0),
+                     (username.like(f"%{term}%", escape='\\'), 1)],
+                    else_=2)
+
+        query = with_profile(User.query, 'user card')
+        if candidates is not None:
+            query = query.filter(User.id.in_(candidates))
+
+        return (query
+                .filter(searchable_text().like(f"%{term}%", escape='\\'))
+                .order_by(rank, username, User.id)
+                .offset(offset)
+                .limit(limit)
+                .all())
+
+    def create_indexes(self):
+        """Create (or rebuild) the search index; returns False if the
+        database can't have one.
+        """
+
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            statements = SEARCH_INDEX_DDL
+        elif dialect == 'sqlite':
+            statements = SQLITE_SEARCH_INDEX_DDL
+        else:
+            return False
+
+        try:
+            for statement in statements:
+                db.session.execute(db.text(statement))
+        except OperationalError:
+            # an SQLite built without FTS5 or its trigram tokenizer
+            db.session.rollback()
+            return False
+
+        db.session.commit()
+        return True
+
+
+def get_backend():
+    """Get the current app's search backend."""
+
+    return current_app.extensions.setdefault('user_search', UserSearch())
+
+
+def search_users(term, page=1, per_page=PER_PAGE):
+    """Get page `page` (from 1) of users matching `term`."""
+
+    page = max(page, 1)
+    offset = (page - 1) * per_page
+    if not term or offset >= MAX_RESULTS:
+        return SearchPage([], page, has_next=False)
+
+    limit = min(per_page + 1, MAX_RESULTS - offset)
+    users = get_backend().search(term, offset, limit)
+
+    return SearchPage(users[:per_page], page,
+                      has_next=len(users) > per_page)
+
@@ -1,20 +1,45 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
-from app import db
-from models import User, Message, Follows
+    python seed.py                      # drop everything and load generator/
+    python seed.py --append --workers 8 --batch-size 50000 data/
 
+See loader.py for how the files are loaded.
+"""
 
-db.drop_all()
-db.create_all()
+from argparse import ArgumentParser
+from time import perf_counter
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+from app import app, db
+import counters
+import loader
+import migrations
+import timeline
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+parser = ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('data_dir', nargs='?', default='generator',
+                    help="directory holding users.csv, messages.csv, ...")
+parser.add_argument('--batch-size', type=int,
+                    default=loader.DEFAULT_BATCH_SIZE,
+                    help="rows sent to the database per batch")
+parser.add_argument('--workers', type=int, default=loader.DEFAULT_WORKERS,
+                    help="files loaded at the same time")
+parser.add_argument('--append', action='store_true',
+                    help="add to the existing data instead of replacing it")
+args = parser.parse_args()
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
+with app.app_context():
+    if not args.append:
+        db.drop_all()
+    migrations.upgrade()
 
-db.session.commit()
+    start = perf_counter()
+    results = loader.load(db.engine, args.data_dir,
+                          batch_size=args.batch_size, workers=args.workers)
+
+    counters.recount_all()
+    timeline.rebuild_all()
+
+    seconds = perf_counter() - start
+    rows = sum(rows for (rows, _) in results.values())
+    print(f"Loaded {rows} rows in {seconds:.2f}s "
+          f"({rows / seconds:.0f} rows/s), including counters and timelines.")
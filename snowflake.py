@@ -0,0 +1,183 @@
+"""Time-ordered 64-bit ids for warbles.
+
+An id packs, from the most significant bit down:
+
+- 41 bits of milliseconds since `EPOCH` (good until 2079),
+- 10 bits of worker id, and
+- 12 bits of sequence within the millisecond.
+
+Ids from later milliseconds always sort after earlier ones, so ordering
+warbles by id is ordering them by time, and a warble's timestamp can be read
+back out of its id.
+
+Each process is one worker, and no two processes may share a worker id at
+once. Set `SNOWFLAKE_WORKER_ID` (0-1023) per process, or leave it unset to
+have each process lease a free id from PostgreSQL: it takes a session-level
+advisory lock on the id over a connection it keeps open, so the id is freed
+when the process exits, however it exits. Other databases (SQLite, in
+development) fall back to the process id, which can clash between machines.
+"""
+
+import os
+from datetime import datetime, timedelta
+from threading import Lock
+from time import sleep, time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+EPOCH = datetime(2010, 1, 1)
+
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+_EPOCH_MS = int((EPOCH - datetime(1970, 1, 1)).total_seconds() * 1000)
+
+# first key of the advisory locks worker ids are leased with ('WB')
+LEASE_LOCK_KEY = 0x5742
+
+
+def compose(millis, worker, sequence):
+    """Pack milliseconds since `EPOCH`, a worker id and a sequence number."""
+
+    return (millis << (WORKER_BITS + SEQUENCE_BITS)
+            | worker << SEQUENCE_BITS
+            | sequence)
+
+
+def millis_of(timestamp):
+    """Milliseconds from `EPOCH` to the naive UTC datetime `timestamp`."""
+
+    millis = (timestamp - EPOCH) // timedelta(milliseconds=1)
+    if millis < 0:
+        raise ValueError(f"Can't make an id for {timestamp}, before {EPOCH}")
+    return millis
+
+
+def timestamp_of(snowflake_id):
+    """The naive UTC datetime an id was made for, to the millisecond."""
+
+    return EPOCH + timedelta(
+        milliseconds=snowflake_id >> (WORKER_BITS + SEQUENCE_BITS))
+
+
+def first_id_at(timestamp):
+    """The smallest id that could have been made at or after `timestamp`."""
+
+    return compose(millis_of(timestamp), 0, 0)
+
+
+class IdGenerator:
+    """Makes unique, increasing ids for one worker."""
+
+    def __init__(self, worker, lease=None):
+        if not 0 <= worker <= MAX_WORKER:
+            raise ValueError(f"Worker id must be 0-{MAX_WORKER}, not {worker}")
+
+        self.worker = worker
+        # the connection holding the worker id's lease, if it has one
+        self.lease = lease
+        self.pid = os.getpid()
+        self.lock = Lock()
+        self.last_millis = -1
+        self.sequence = 0
+        self.backdated = 0
+
+    @staticmethod
+    def now_millis():
+        return int(time() * 1000) - _EPOCH_MS
+
+    def next_id(self, at=None):
+        """Make a new id for now, or for the naive UTC datetime `at`.
+
+        Ids for the current time never repeat and always increase, even if
+        the clock steps back. Backdated ids (for importing old warbles) share
+        one rolling sequence, so more than 4096 of them for the same
+        millisecond would clash.
+        """
+
+        with self.lock:
+            if at is not None:
+                self.backdated = (self.backdated + 1) & MAX_SEQUENCE
+                return compose(millis_of(at), self.worker, self.backdated)
+
+            # never go back in time, even if the system clock does
+            millis = max(self.now_millis(), self.last_millis)
+
+            if millis == self.last_millis:
+                self.sequence = (self.sequence + 1) & MAX_SEQUENCE
+                if self.sequence == 0:
+                    # used up this millisecond; wait for the next one
+                    while millis <= self.last_millis:
+                        sleep(0.0001)
+                        millis = self.now_millis()
+            else:
+                self.sequence = 0
+
+            self.last_millis = millis
+            return compose(millis, self.worker, self.sequence)
+
+
+def lease_worker(engine):
+    """Lease a free worker id from the PostgreSQL database behind `engine`.
+
+    Returns the id and the new connection holding its advisory lock; the
+    lease lasts until that connection closes. Raises RuntimeError if all
+    1024 ids are taken.
+    """
+
+    # a connection of its own, so it's never returned to (or shared through
+    # a fork by) the engine's pool
+    conn = create_engine(engine.url, poolclass=NullPool).connect()
+
+    # start from the process id, so processes starting together don't all
+    # contend for the lowest ids
+    start = os.getpid() & MAX_WORKER
+    for offset in range(MAX_WORKER + 1):
+        worker = (start + offset) & MAX_WORKER
+        if conn.execute(text("SELECT pg_try_advisory_lock(:key, :worker)"),
+                        key=LEASE_LOCK_KEY, worker=worker).scalar():
+            return worker, conn
+
+    conn.close()
+    raise RuntimeError("Every snowflake worker id is leased")
+
+
+_generator = None
+_generator_lock = Lock()
+
+
+def get_generator(engine=None):
+    """Get this process's IdGenerator, making a new one after a fork.
+
+    Its worker id comes from `SNOWFLAKE_WORKER_ID`, or else is leased from
+    `engine`'s database if that is PostgreSQL, or else is the process id.
+    """
+
+    global _generator
+
+    with _generator_lock:
+        if _generator is None or _generator.pid != os.getpid():
+            worker = os.environ.get('SNOWFLAKE_WORKER_ID')
+
+            if worker:
+                _generator = IdGenerator(int(worker))
+            elif engine is not None and engine.dialect.name == 'postgresql':
+                _generator = IdGenerator(*lease_worker(engine))
+            else:
+                _generator = IdGenerator(os.getpid() & MAX_WORKER)
+
+    return _generator
+
+
+def next_id(at=None, engine=None):
+    """Make a new id for now, or backdated to the datetime `at`.
+
+    `engine` is the database the id is for, to lease a worker id from on
+    the process's first id.
+    """
+
+    return get_generator(engine).next_id(at)
@@ -0,0 +1,160 @@
+"""Per-request SQL instrumentation and N+1 query detection.
+
+`init_app` listens to every statement the SQLAlchemy engines run. For each
+request it records the number of queries, the total time spent in SQL and
+how often each distinct statement ran, then:
+
+- adds `X-SQL-Queries` and `X-SQL-Time-ms` response headers, and
+- logs one JSON line to the `warbler.sql` logger, at WARNING if any one
+  statement ran `SQL_DUPLICATE_THRESHOLD` or more times (a likely N+1).
+
+Queries made while a streamed response is being sent are not counted,
+unless `SQL_STATS_BUFFER_STREAMS` is set: then streamed responses are
+rendered in full before the headers are added, so the counts include them
+(at the cost of streaming). The benchmarks set it.
+
+Tests can use `query_budget` to fail when a block of code (e.g. a request
+through the test client) runs more queries than it should.
+"""
+
+import json
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from time import perf_counter
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_DUPLICATE_THRESHOLD = 5
+
+logger = logging.getLogger('warbler.sql')
+
+_budgets = threading.local()
+
+
+class QueryStats:
+    """Queries run, time spent and repeats of each statement."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+
+    def duplicates(self, threshold=2):
+        """Statements run at least `threshold` times, most repeated first."""
+
+        return [(statement, count)
+                for statement, count in self.statements.most_common()
+                if count >= threshold]
+
+
+def _active_collectors():
+    collectors = list(getattr(_budgets, 'stack', []))
+
+    if has_app_context():
+        stats = g.get('sql_stats')
+        if stats is not None:
+            collectors.append(stats)
+
+    return collectors
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_start_time', []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = perf_counter() - conn.info['query_start_time'].pop()
+
+    for stats in _active_collectors():
+        stats.record(statement, elapsed)
+
+
+def _handle_error(context):
+    if context.connection is not None and context.cursor is not None:
+        start_times = context.connection.info.get('query_start_time')
+        if start_times:
+            start_times.pop()
+
+
+def _start_request():
+    g.sql_stats = QueryStats()
+
+
+def _report(response):
+    if g.get('sql_stats') is None:
+        return response
+
+    if response.is_streamed and current_app.config.get(
+            'SQL_STATS_BUFFER_STREAMS'):
+        response.make_sequence()
+
+    stats = g.pop('sql_stats')
+
+    response.headers['X-SQL-Queries'] = str(stats.count)
+    response.headers['X-SQL-Time-ms'] = f"{stats.seconds * 1000:.1f}"
+
+    threshold = current_app.config.get('SQL_DUPLICATE_THRESHOLD',
+                                       DEFAULT_DUPLICATE_THRESHOLD)
+    duplicates = stats.duplicates(threshold)
+
+    logger.log(logging.WARNING if duplicates else logging.INFO, json.dumps({
+        'event': 'sql_stats',
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'queries': stats.count,
+        'sql_ms': round(stats.seconds * 1000, 1),
+        'duplicates': [{'statement': statement, 'count': count}
+                       for statement, count in duplicates],
+    }))
+
+    return response
+
+
+def init_app(app):
+    """Start recording SQL statistics for `app`'s requests."""
+
+    if not event.contains(Engine, 'before_cursor_execute',
+                          _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+    app.before_request(_start_request)
+    app.after_request(_report)
+
+
+@contextmanager
+def query_budget(max_queries):
+    """Fail if the code in the `with` block runs more than `max_queries`.
+
+    Counts every statement run on this thread, including those from
+    requests made through a test client. Yields the QueryStats.
+    """
+
+    stats = QueryStats()
+    stack = _budgets.__dict__.setdefault('stack', [])
+    stack.append(stats)
+
+    try:
+        yield stats
+    finally:
+        stack.remove(stats)
+
+    if stats.count > max_queries:
+        repeated = ''.join(f"\n  {count}x {statement}"
+                           for statement, count in stats.duplicates())
+        raise AssertionError(
+            f"{stats.count} queries run, budget was {max_queries}{repeated}")
@@ -0,0 +1,29 @@
+// Like/unlike warbles without reloading the page.
+//
+// The thumbs-up forms still work as plain POSTs; when this script is loaded
+// it submits them to the JSON like endpoint instead and flips the button.
+
+$(function () {
+  $("#messages").on("submit", ".like-form", async function (evt) {
+    evt.preventDefault();
+
+    const $form = $(this);
+    const $button = $form.find("button");
+
+    $button.prop("disabled", true);
+
+    try {
+      const resp = await $.post($form.data("like-url"));
+
+      $button
+        .toggleClass("btn-primary", resp.liked)
+        .toggleClass("btn-secondary", !resp.liked)
+        .attr("title", `${resp.likes} like${resp.likes === 1 ? "" : "s"}`);
+    } catch (err) {
+      // fall back to the regular form post
+      this.submit();
+    } finally {
+      $button.prop("disabled", false);
+    }
+  });
+});
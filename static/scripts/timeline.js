@@ -0,0 +1,64 @@
+// Show new warbles at the top of the homepage as they're posted.
+//
+// Listens to the timeline stream (see stream.py) and adds a card for each
+// warble it sends. Browsers without EventSource poll the API for warbles
+// newer than the newest one shown instead. Cards added here have no like
+// button until the page is reloaded.
+
+const POLL_SECONDS = 30;
+
+$(function () {
+  const $messages = $("#messages");
+  const streamUrl = $messages.data("stream-url");
+
+  if (!streamUrl) return;
+
+  // kept as a string: snowflake ids don't fit in a JavaScript number
+  let newestId = $messages.attr("data-newest-id") || "0";
+
+  function addWarbles(data) {
+    for (const msg of data.messages.slice().reverse()) {
+      if ($messages.find(`a.message-link[href="/messages/${msg.id}"]`).length) continue;
+
+      const user = data.users[msg.user_id];
+      const posted = new Date(msg.timestamp).toLocaleDateString("en-GB", {
+        day: "2-digit", month: "long", year: "numeric"
+      });
+
+      $("<li>", { class: "list-group-item" }).append(
+        $("<a>", { href: `/messages/${msg.id}`, class: "message-link" }),
+        $("<a>", { href: `/users/${msg.user_id}` }).append(
+          $("<img>", { src: user.image_url, alt: "", class: "timeline-image" })
+        ),
+        $("<div>", { class: "message-area" }).append(
+          $("<a>", { href: `/users/${msg.user_id}`, text: `@${user.username}` }),
+          " ",
+          $("<span>", { class: "text-muted", text: posted }),
+          $("<p>", { text: msg.text })
+        )
+      ).prependTo($messages);
+
+      newestId = msg.id;
+    }
+  }
+
+  if (window.EventSource) {
+    const source = new EventSource(streamUrl);
+    source.addEventListener("warble", evt => addWarbles(JSON.parse(evt.data)));
+    return;
+  }
+
+  async function poll() {
+    try {
+      let data;
+      do {
+        data = await $.getJSON("/api/v1/timeline/new", { since: newestId });
+        addWarbles(data);
+      } while (data.newer);
+    } finally {
+      setTimeout(poll, POLL_SECONDS * 1000);
+    }
+  }
+
+  setTimeout(poll, POLL_SECONDS * 1000);
+});
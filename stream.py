@@ -0,0 +1,230 @@
+"""Live home timeline updates, sent as Server-Sent Events.
+
+A logged-in browser opens `/stream/timeline` with an `EventSource` and gets
+a `warble` event for each new warble by anyone it follows (or by the user
+themselves) as soon as `messages_add` commits it, instead of reloading the
+homepage to look for them. Each event's data is JSON in the same shape as
+a page from the API (see api.py), holding the one warble, and its `id` is
+the warble's id. A comment line is sent every `STREAM_HEARTBEAT_SECONDS` so
+proxies don't close an idle connection.
+
+Warbles are published on a channel per author, and a stream subscribes to
+the channels of the users it followed when it was opened; the browser
+reconnects (and so picks up new follows) whenever the connection drops.
+On reconnecting, it sends the id of the last event it saw, and the warbles
+it missed since are replayed from the home timeline before the live ones.
+
+Channels live in a `MemoryBroker` shared by the threads of one process. Set
+`STREAM_REDIS_URL` to publish through Redis instead, so streams see warbles
+posted through any process (this needs the `redis` package). Each open
+stream holds a worker thread, so serve the app with enough of them.
+"""
+
+from queue import Empty, Full, Queue
+from threading import Lock
+from time import monotonic
+
+from flask import current_app, g, request
+
+import api
+import timeline
+from models import db, Follows
+
+DEFAULT_HEARTBEAT = 15
+
+# milliseconds a browser waits before reconnecting a dropped stream
+RETRY_MILLISECONDS = 5000
+
+# events queued for a slow client before new ones are dropped
+MAX_PENDING = 100
+
+CHANNEL_PREFIX = 'warbles:'
+
+
+class MemorySubscription:
+    """Events published on some channels of a MemoryBroker."""
+
+    def __init__(self, broker, channels):
+        self.broker = broker
+        self.channels = channels
+        self.queue = Queue(MAX_PENDING)
+
+    def put(self, data):
+        try:
+            self.queue.put_nowait(data)
+        except Full:
+            pass
+
+    def get(self, timeout):
+        """The next event's data, or None if none comes within `timeout`."""
+
+        try:
+            return self.queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class MemoryBroker:
+    """Publish/subscribe between the threads of this process."""
+
+    def __init__(self):
+        self.subscribers = {}
+        self.lock = Lock()
+
+    def subscribe(self, channels):
+        subscription = MemorySubscription(self, channels)
+        with self.lock:
+            for name in channels:
+                self.subscribers.setdefault(name, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for name in subscription.channels:
+                subscribers = self.subscribers.get(name, set())
+                subscribers.discard(subscription)
+                if not subscribers:
+                    self.subscribers.pop(name, None)
+
+    def publish(self, name, data):
+        with self.lock:
+            subscribers = list(self.subscribers.get(name, ()))
+        for subscription in subscribers:
+            subscription.put(data)
+
+
+class RedisSubscription:
+    """Events published on some channels through Redis."""
+
+    def __init__(self, client, channels):
+        self.pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(*channels)
+
+    def get(self, timeout):
+        deadline = monotonic() + timeout
+        while True:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return None
+            message = self.pubsub.get_message(timeout=remaining)
+            if message is not None:
+                return message['data'].decode()
+
+    def close(self):
+        self.pubsub.close()
+
+
+class RedisBroker:
+    """Publish/subscribe between every process through a Redis client."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def subscribe(self, channels):
+        return RedisSubscription(self.client, channels)
+
+    def publish(self, name, data):
+        self.client.publish(name, data.encode())
+
+
+def get_broker():
+    """Get the current app's broker, creating it on first use."""
+
+    broker = current_app.extensions.get('stream_broker')
+
+    if broker is None:
+        redis_url = current_app.config.get('STREAM_REDIS_URL')
+
+        if redis_url:
+            import redis
+            broker = RedisBroker(redis.Redis.from_url(redis_url))
+        else:
+            broker = MemoryBroker()
+
+        current_app.extensions['stream_broker'] = broker
+
+    return broker
+
+
+def channel(author_id):
+    return f"{CHANNEL_PREFIX}{author_id}"
+
+
+def warble_data(row):
+    """What's published for a MESSAGE_COLUMNS row: its id, then its JSON."""
+
+    payload = api.encode(api.message_payload([row])).decode()
+    return f"{row[0]}\n{payload}"
+
+
+def publish_message(msg, author):
+    """Send the committed warble `msg` by `author` to its live streams."""
+
+    row = (msg.id, msg.text, msg.timestamp, author.id, author.username,
+           author.image_url)
+    get_broker().publish(channel(author.id), warble_data(row))
+
+
+def event(data):
+    """The SSE `warble` event for published `data`."""
+
+    msg_id, payload = data.split('\n', 1)
+    return f"id: {msg_id}\nevent: warble\ndata: {payload}\n\n"
+
+
+def missed_events(user_id, last_event_id):
+    """Events for warbles newer than `last_event_id`, oldest first."""
+
+    page = timeline.home_timeline(user_id, after=last_event_id,
+                                  query=api.message_rows())
+    return [event(warble_data(row)) for row in reversed(page.items)]
+
+
+def stream_timeline():
+    """Stream new warbles for the logged-in user's home timeline."""
+
+    if not g.user:
+        return api.error("Access unauthorized.", 401)
+
+    followed = (db.session.query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == g.user.id)
+                .all())
+    channels = [channel(g.user.id)] + [channel(author_id)
+                                       for (author_id,) in followed]
+
+    # subscribe first, so nothing posted while catching up is missed
+    subscription = get_broker().subscribe(channels)
+
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    try:
+        missed = (missed_events(g.user.id, last_event_id)
+                  if last_event_id is not None else [])
+    except Exception:
+        subscription.close()
+        raise
+
+    heartbeat = current_app.config.get('STREAM_HEARTBEAT_SECONDS',
+                                       DEFAULT_HEARTBEAT)
+
+    def generate():
+        yield f"retry: {RETRY_MILLISECONDS}\n\n"
+        yield from missed
+
+        while True:
+            data = subscription.get(heartbeat)
+            yield event(data) if data is not None else ":\n\n"
+
+    response = current_app.response_class(
+        generate(), mimetype='text/event-stream',
+        headers={'X-Accel-Buffering': 'no'})
+    response.call_on_close(subscription.close)
+    return response
+
+
+def init_app(app):
+    """Serve the timeline stream from `app`."""
+
+    app.add_url_rule('/stream/timeline', 'stream_timeline', stream_timeline)
@@ -0,0 +1,179 @@
+"""JSON API tests."""
+
+import json
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Message, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import api
+import counters
+import current_user
+import timeline
+
+db.create_all()
+
+
+class ApiTestCase(TestCase):
+    """Test the timeline and profile endpoints."""
+
+    def setUp(self):
+        """Create two users, one following the other, with some warbles"""
+
+        User.query.delete()
+        Message.query.delete()
+
+        db.session.add(User(id=1212, email="user1@test.com", username="user1", password="HASHED_PASSWORD"))
+        db.session.add(User(id=2323, email="user2@test.com", username="user2", password="HASHED_PASSWORD",
+                            bio="Second user"))
+        db.session.commit()
+
+        db.session.add(Follows(user_being_followed_id=2323, user_following_id=1212))
+        db.session.commit()
+
+        self.message_ids = []
+        with app.app_context():
+            for num in range(3):
+                msg = Message(text=f"warble {num}", user_id=2323)
+                db.session.add(msg)
+                db.session.flush()
+                timeline.fan_out_message(msg)
+                self.message_ids.append(msg.id)
+
+            counters.recount()
+            db.session.commit()
+        current_user.invalidate(1212)
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        app.config.pop('MESSAGES_PER_PAGE', None)
+
+    def login(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1212
+
+    def test_timeline(self):
+        """The timeline lists followed users' warbles, newest first"""
+
+        self.login()
+        resp = self.client.get('/api/v1/timeline')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'application/json')
+
+        data = resp.get_json()
+        self.assertEqual([msg['id'] for msg in data['messages']],
+                         [str(msg_id) for msg_id in reversed(self.message_ids)])
+        self.assertEqual(data['messages'][0]['text'], "warble 2")
+        self.assertEqual(data['messages'][0]['user_id'], 2323)
+        self.assertTrue(data['messages'][0]['timestamp'].endswith('Z'))
+        self.assertEqual(data['users'], {'2323': {'username': "user2", 'image_url': "/static/images/default-pic.png"}})
+        self.assertIsNone(data['older'])
+
+    def test_timeline_pages(self):
+        """Timeline pages link to each other with string cursors"""
+
+        app.config['MESSAGES_PER_PAGE'] = 2
+        self.login()
+
+        data = self.client.get('/api/v1/timeline').get_json()
+        self.assertEqual(data['older'], str(self.message_ids[1]))
+
+        data = self.client.get(f"/api/v1/timeline?before={data['older']}").get_json()
+        self.assertEqual([msg['id'] for msg in data['messages']], [str(self.message_ids[0])])
+        self.assertEqual(data['newer'], str(self.message_ids[0]))
+
+    def test_timeline_unauthorized(self):
+        """The timeline needs a logged-in user"""
+
+        resp = self.client.get('/api/v1/timeline')
+
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(resp.get_json(), {'error': "Access unauthorized."})
+
+    def test_profile(self):
+        """A profile has the user's details and counts, but not their email"""
+
+        resp = self.client.get('/api/v1/users/2323')
+        data = resp.get_json()
+
+        self.assertEqual(data['username'], "user2")
+        self.assertEqual(data['bio'], "Second user")
+        self.assertEqual(data['messages_count'], 3)
+        self.assertEqual(data['followers_count'], 1)
+        self.assertNotIn('email', data)
+
+        resp = self.client.get('/api/v1/users/2323', headers={'If-None-Match': resp.headers['ETag']})
+        self.assertEqual(resp.status_code, 304)
+
+        self.assertEqual(self.client.get('/api/v1/users/9999').status_code, 404)
+
+    def test_user_messages(self):
+        """A user's warbles are listed newest first"""
+
+        data = self.client.get('/api/v1/users/2323/messages').get_json()
+
+        self.assertEqual([msg['text'] for msg in data['messages']], ["warble 2", "warble 1", "warble 0"])
+        self.assertEqual(list(data['users']), ['2323'])
+
+        data = self.client.get('/api/v1/users/1212/messages').get_json()
+        self.assertEqual(data['messages'], [])
+
+        self.assertEqual(self.client.get('/api/v1/users/9999/messages').status_code, 404)
+
+    def test_encode_without_orjson(self):
+        """Payloads are the same compact JSON with the standard library"""
+
+        with patch.object(api, 'orjson', None):
+            self.assertEqual(api.encode({'id': "1", 'users': {}}), b'{"id":"1","users":{}}')
+
+        self.assertEqual(json.loads(api.encode({'id': "1", 'users': {}})), {'id': "1", 'users': {}})
+
+    def test_new_in_timeline(self):
+        """Polling returns only the warbles newer than the client's newest"""
+
+        self.login()
+        since = self.message_ids[0]
+
+        resp = self.client.get(f'/api/v1/timeline/new?since={since}')
+        data = resp.get_json()
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([msg['id'] for msg in data['messages']],
+                         [str(msg_id) for msg_id in reversed(self.message_ids[1:])])
+        self.assertIsNone(data['newer'])
+
+    def test_new_in_timeline_unchanged(self):
+        """Nothing new is answered from the latest entry, with 304 if the client asks"""
+
+        self.login()
+        url = f'/api/v1/timeline/new?since={self.message_ids[-1]}'
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.get_json()['messages'], [])
+
+        with patch.object(timeline, 'home_timeline') as home_timeline:
+            resp = self.client.get(url, headers={'If-None-Match': resp.headers['ETag']})
+
+        self.assertEqual(resp.status_code, 304)
+        home_timeline.assert_not_called()
+
+    def test_new_in_timeline_needs_since(self):
+        """Polling without a since cursor is a bad request"""
+
+        self.login()
+
+        self.assertEqual(self.client.get('/api/v1/timeline/new').status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/timeline/new?since=1').status_code, 200)
+
+        with self.client.session_transaction() as sess:
+            del sess[CURR_USER_KEY]
+        self.assertEqual(self.client.get('/api/v1/timeline/new?since=1').status_code, 401)
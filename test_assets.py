@@ -0,0 +1,125 @@
+"""Static asset pipeline tests."""
+
+import gzip
+import os
+import tempfile
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from flask import render_template_string
+
+from app import app
+import assets
+
+
+class AssetsTestCase(TestCase):
+    """Test building and serving fingerprinted assets."""
+
+    def setUp(self):
+        """Build the assets into a temporary directory"""
+
+        self.out_dir = tempfile.TemporaryDirectory()
+        app.config['ASSETS_DIR'] = self.out_dir.name
+        app.extensions.pop('assets', None)
+
+        self.manifest = assets.build(app.static_folder, self.out_dir.name,
+                                     report=lambda line: None)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Go back to unbuilt assets."""
+
+        del app.config['ASSETS_DIR']
+        app.extensions.pop('assets', None)
+        self.out_dir.cleanup()
+
+    def test_build(self):
+        """Files are fingerprinted, and stylesheets point at fingerprinted files"""
+
+        built = self.manifest['files']['stylesheets/style.css']
+        self.assertRegex(built, r'^stylesheets/style\.[0-9a-f]{12}\.css$')
+
+        with open(os.path.join(self.out_dir.name, built)) as css_file:
+            css = css_file.read()
+        self.assertIn(f"/assets/{self.manifest['files']['images/nav-bg.png']}", css)
+        self.assertNotIn("/static/", css)
+
+    def test_asset_url(self):
+        """Templates link to fingerprinted URLs once assets are built"""
+
+        with app.test_request_context():
+            self.assertEqual(assets.asset_url('stylesheets/style.css'),
+                             f"/assets/{self.manifest['files']['stylesheets/style.css']}")
+            self.assertEqual(assets.asset_url('not-built.txt'),
+                             "/static/not-built.txt")
+
+        resp = self.client.get('/')
+        self.assertIn(f"/assets/{self.manifest['files']['stylesheets/style.css']}",
+                      str(resp.data))
+
+    def test_background_image_set(self):
+        """Stylesheet background images offer their WebP copies"""
+
+        variants = self.manifest['variants']['images/signed-out-home.jpg']
+
+        with open(os.path.join(self.out_dir.name, self.manifest['files']['stylesheets/style.css'])) as css_file:
+            css = css_file.read()
+        self.assertIn(f'image-set(url("/assets/{variants[":webp"]}") type("image/webp")', css)
+
+    def test_picture(self):
+        """Static images get WebP and scaled-down srcsets; others are left alone"""
+
+        template = ("{% from 'picture.html' import picture %}"
+                    "{{ picture(url, class='card-hero') }}")
+
+        with app.test_request_context():
+            html = render_template_string(template, url="/static/images/warbler-hero.jpg")
+            outside = render_template_string(template, url="https://example.com/hero.jpg")
+
+        variants = self.manifest['variants']['images/warbler-hero.jpg']
+        width = self.manifest['widths']['images/warbler-hero.jpg']
+        self.assertIn(f'<source type="image/webp" srcset="/assets/{variants["480:webp"]} 480w', html)
+        self.assertIn(f'/assets/{variants[":webp"]} {width}w', html)
+        self.assertIn(f'/assets/{self.manifest["files"]["images/warbler-hero.jpg"]} {width}w', html)
+        self.assertIn('class="card-hero"', html)
+
+        self.assertNotIn('srcset', outside)
+        self.assertIn('<img src="https://example.com/hero.jpg"', outside)
+
+    def test_unbuilt(self):
+        """Without a build, templates link to the plain static files"""
+
+        app.config['ASSETS_DIR'] = os.path.join(self.out_dir.name, 'missing')
+        app.extensions.pop('assets', None)
+
+        with app.test_request_context():
+            self.assertEqual(assets.asset_url('stylesheets/style.css'),
+                             "/static/stylesheets/style.css")
+
+    def test_serve_compressed(self):
+        """Clients that accept gzip get the precompressed copy"""
+
+        url = f"/assets/{self.manifest['files']['stylesheets/style.css']}"
+
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.mimetype, 'text/css')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+        self.assertIn(b".navbar-brand", gzip.decompress(resp.data))
+        resp.close()
+
+        resp = self.client.get(url)
+
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertIn(b".navbar-brand", resp.data)
+        resp.close()
+
+    def test_serve_missing(self):
+        """Unknown assets and paths outside the build are 404s"""
+
+        self.assertEqual(self.client.get('/assets/nope.css').status_code, 404)
+        self.assertEqual(self.client.get('/assets/../app.py').status_code, 404)
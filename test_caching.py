@@ -0,0 +1,204 @@
+"""HTTP caching tests."""
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import counters
+import current_user
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CachingTestCase(TestCase):
+    """Test cache policies and conditional requests."""
+
+    def setUp(self):
+        """Create a user with a message, and log in as them"""
+
+        User.query.delete()
+        Message.query.delete()
+
+        db.session.add(User(id=1212, email="test@test.com", username="testuser", password="HASHED_PASSWORD"))
+        db.session.commit()
+
+        db.session.add(Message(text="first message", user_id=1212))
+        db.session.commit()
+        current_user.invalidate(1212)
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1212
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def test_profile_not_modified(self):
+        """A profile page is revalidated with its ETag"""
+
+        resp = self.client.get('/users/1212')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Cache-Control'], "private, no-cache")
+        self.assertIn('Cookie', resp.headers['Vary'])
+        etag = resp.headers['ETag']
+
+        resp = self.client.get('/users/1212', headers={'If-None-Match': etag})
+
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b"")
+        self.assertEqual(resp.headers['ETag'], etag)
+
+    def test_profile_modified(self):
+        """A new warble changes the profile page's ETag"""
+
+        etag = self.client.get('/users/1212').headers['ETag']
+
+        db.session.add(Message(text="second message", user_id=1212))
+        db.session.commit()
+
+        resp = self.client.get('/users/1212', headers={'If-None-Match': etag})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("second message", str(resp.data))
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_homepage(self):
+        """The logged-in homepage is cached privately for a short while"""
+
+        resp = self.client.get('/')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Cache-Control'], "private, max-age=10")
+
+        resp = self.client.get('/', headers={'If-None-Match': resp.headers['ETag']})
+
+        self.assertEqual(resp.status_code, 304)
+
+    def test_flash_not_cached(self):
+        """A page showing a flashed message isn't cached or answered with 304"""
+
+        etag = self.client.get('/users/1212').headers['ETag']
+
+        with self.client.session_transaction() as sess:
+            sess['_flashes'] = [("success", "Hello there")]
+
+        resp = self.client.get('/users/1212', headers={'If-None-Match': etag})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Hello there", str(resp.data))
+        self.assertEqual(resp.headers['Cache-Control'], "no-store")
+
+    def test_default_no_store(self):
+        """Pages without a policy, and writes, aren't cached"""
+
+        self.assertEqual(self.client.get('/users/profile').headers['Cache-Control'],
+                         "no-store")
+        self.assertEqual(self.client.post('/users/follow/1212').headers['Cache-Control'],
+                         "no-store")
+
+    def test_static(self):
+        """Static files are revalidated against Flask's own validators"""
+
+        resp = self.client.get('/static/stylesheets/style.css')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Cache-Control'], "public, no-cache")
+        self.assertIn('Last-Modified', resp.headers)
+        resp.close()
+
+
+class TimelineValidatorTestCase(TestCase):
+    """Test that the homepage's ETag changes with everything it shows."""
+
+    def setUp(self):
+        """Log in as a user following an author with two warbles"""
+
+        User.query.delete()
+        Message.query.delete()
+
+        User.signup(username="reader", email="reader@test.com", password="password", image_url=None).id = 1212
+        User.signup(username="author", email="author@test.com", password="password", image_url=None).id = 2323
+        db.session.commit()
+
+        db.session.add(Follows(user_being_followed_id=2323, user_following_id=1212))
+        counters.recount()
+        db.session.commit()
+        current_user.invalidate(1212)
+
+        self.post_as(2323, "first warble")
+        self.post_as(2323, "second warble")
+        self.message_ids = [msg.id for msg in Message.query.order_by(Message.id)]
+
+        self.client = self.client_for(1212)
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def client_for(self, user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+        return client
+
+    def post_as(self, user_id, text):
+        self.client_for(user_id).post("/messages/new", data={"text": text})
+
+    def assert_changed(self, url, change):
+        """After `change()`, `url` is rendered again rather than answered with 304"""
+
+        etag = self.client.get(url).headers['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+
+        change()
+
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        return resp
+
+    def test_author_renamed(self):
+        """An author editing their profile changes the homepage and API timeline"""
+
+        author = self.client_for(2323)
+
+        def rename(username):
+            return lambda: author.post('/users/profile', data={
+                'username': username, 'email': "author@test.com",
+                'image_url': "", 'header_image_url': "", 'bio': "",
+                'password': "password"})
+
+        resp = self.assert_changed('/', rename("renamed"))
+        self.assertIn("@renamed", str(resp.data))
+
+        resp = self.assert_changed('/api/v1/timeline', rename("renamed again"))
+        self.assertEqual(resp.get_json()['users']['2323']['username'], "renamed again")
+
+    def test_likes_swapped(self):
+        """Liking one warble and unliking another changes the homepage"""
+
+        first, second = self.message_ids
+        self.client.post(f'/messages/{first}/like')
+
+        def swap():
+            self.client.post(f'/messages/{first}/like')
+            self.client.post(f'/messages/{second}/like')
+
+        self.assert_changed('/', swap)
+
+    def test_deleted_warble(self):
+        """A followed author deleting a warble changes the homepage"""
+
+        author = self.client_for(2323)
+        resp = self.assert_changed(
+            '/', lambda: author.post(f'/messages/{self.message_ids[0]}/delete'))
+        self.assertNotIn("first warble", str(resp.data))
@@ -0,0 +1,116 @@
+"""Denormalized User counter tests."""
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Like
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import counters
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CountersTestCase(TestCase):
+    """Test that the views keep User counters in step."""
+
+    def setUp(self):
+        """Create test client and sample users"""
+
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        u1 = User.signup(username="user1", email="user1@test.com", password="password", image_url=None)
+        u1.id = 1212
+
+        u2 = User.signup(username="user2", email="user2@test.com", password="password", image_url=None)
+        u2.id = 2323
+
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def counts(self, user_id):
+        """Gets the (messages, following, followers, likes) counts for a user"""
+
+        db.session.expire_all()
+        user = User.query.get(user_id)
+        return (user.messages_count, user.following_count, user.followers_count, user.likes_count)
+
+    def login(self, c, user_id):
+        """Logs `user_id` in on the test client `c`"""
+
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_follow_and_unfollow(self):
+        """Following and unfollowing update both users' counts"""
+
+        with self.client as c:
+            self.login(c, 1212)
+
+            c.post('/users/follow/2323')
+            self.assertEqual(self.counts(1212), (0, 1, 0, 0))
+            self.assertEqual(self.counts(2323), (0, 0, 1, 0))
+
+            c.post('/users/stop-following/2323')
+            self.assertEqual(self.counts(1212), (0, 0, 0, 0))
+            self.assertEqual(self.counts(2323), (0, 0, 0, 0))
+
+    def test_post_like_and_delete(self):
+        """Posting, liking and deleting a message update the counts"""
+
+        with self.client as c:
+            self.login(c, 2323)
+            c.post('/messages/new', data={"text": "hello"})
+            self.assertEqual(self.counts(2323), (1, 0, 0, 0))
+
+            msg = Message.query.filter_by(text="hello").one()
+
+            self.login(c, 1212)
+            c.post(f'/users/add_like/{msg.id}')
+            self.assertEqual(self.counts(1212), (0, 0, 0, 1))
+
+            c.post(f'/messages/{msg.id}/delete')
+            self.assertEqual(self.counts(1212), (0, 0, 0, 0))
+            self.assertEqual(self.counts(2323), (0, 0, 0, 0))
+
+    def test_recount(self):
+        """Recounting repairs counts for rows added behind the views' backs"""
+
+        db.session.add(Message(id=321, text="user2 message", user_id=2323))
+        db.session.add(Follows(user_being_followed_id=2323, user_following_id=1212))
+        db.session.commit()
+        db.session.add(Like(user_id=1212, message_id=321))
+        db.session.commit()
+
+        with app.app_context():
+            self.assertEqual(counters.recount_all(), 2)
+
+        self.assertEqual(self.counts(1212), (0, 1, 0, 1))
+        self.assertEqual(self.counts(2323), (1, 0, 1, 0))
+
+    def test_delete_user(self):
+        """Deleting a user updates the counts of users connected to them"""
+
+        db.session.add(Message(id=321, text="user2 message", user_id=2323))
+        db.session.add(Follows(user_being_followed_id=2323, user_following_id=1212))
+        db.session.commit()
+        db.session.add(Like(user_id=1212, message_id=321))
+        counters.recount()
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, 2323)
+            c.post('/users/delete')
+
+        self.assertEqual(self.counts(1212), (0, 0, 0, 0))
@@ -0,0 +1,102 @@
+"""Lazy current-user tests."""
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from flask import g
+
+from app import app, CURR_USER_KEY
+import current_user
+
+db.create_all()
+
+
+class CurrentUserTestCase(TestCase):
+    """Test the lazily-loaded g.user and its profile cache."""
+
+    def setUp(self):
+        """Create a sample user"""
+
+        User.query.delete()
+        Message.query.delete()
+
+        db.session.add(User(id=1212, email="test@test.com", username="testuser", password="HASHED_PASSWORD"))
+        db.session.commit()
+
+        current_user.invalidate(1212)
+        current_user.invalidate(9999)
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def test_profile_from_cache(self):
+        """Profile columns are served from the cache until invalidated"""
+
+        with app.app_context():
+            self.assertEqual(current_user.CurrentUser(1212).username, "testuser")
+
+            User.query.filter_by(id=1212).update({"username": "renamed"})
+            db.session.commit()
+            self.assertEqual(current_user.CurrentUser(1212).username, "testuser")
+
+            current_user.invalidate(1212)
+            self.assertEqual(current_user.CurrentUser(1212).username, "renamed")
+
+    def test_missing_user_is_falsy(self):
+        """A session user that no longer exists is treated as logged out"""
+
+        with app.app_context():
+            self.assertFalse(current_user.CurrentUser(9999))
+            self.assertTrue(current_user.CurrentUser(1212))
+
+    def test_counters_are_fresh(self):
+        """Counters and the profile version are never served from the cache"""
+
+        with app.app_context():
+            self.assertEqual(current_user.CurrentUser(1212).username, "testuser")
+
+            User.query.filter_by(id=1212).update({"username": "renamed", "messages_count": 5})
+            db.session.commit()
+
+            user = current_user.CurrentUser(1212)
+            self.assertEqual(user.username, "testuser")
+            self.assertEqual(user.messages_count, 5)
+            self.assertEqual(user.username, "renamed")
+
+    def test_deleted_user_session(self):
+        """Pages still render for a session whose user has been deleted"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 9999
+
+            db.session.add(User(id=2323, email="other@test.com", username="other", password="HASHED_PASSWORD"))
+            db.session.commit()
+
+            self.assertEqual(c.get('/users').status_code, 200)
+            self.assertEqual(c.get('/users/2323').status_code, 200)
+
+    def test_loads_full_user(self):
+        """Anything beyond the profile columns loads the ORM User"""
+
+        with app.app_context():
+            user = current_user.CurrentUser(1212)
+
+            self.assertEqual(user.following, [])
+            self.assertIsInstance(user._get_current_object(), User)
+
+    def test_static_skips_user(self):
+        """Static files don't get a g.user"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1212
+
+            c.get('/static/stylesheets/style.css')
+            self.assertIsNone(g.user)
@@ -0,0 +1,107 @@
+"""Template fragment cache tests."""
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import current_user
+import fragment_cache
+
+db.create_all()
+
+
+class MemoryBackendTestCase(TestCase):
+    """Test the in-process LRU backend."""
+
+    def test_lru(self):
+        """The least recently used entry is evicted first"""
+
+        backend = fragment_cache.MemoryBackend(size=2)
+        backend.set('a', "A")
+        backend.set('b', "B")
+        backend.get('a')
+        backend.set('c', "C")
+
+        self.assertEqual(backend.get('a'), "A")
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('c'), "C")
+
+    def test_ttl(self):
+        """Entries expire after the TTL"""
+
+        backend = fragment_cache.MemoryBackend(ttl=10)
+
+        with patch.object(fragment_cache, 'monotonic', return_value=100):
+            backend.set('a', "A")
+            self.assertEqual(backend.get('a'), "A")
+
+        with patch.object(fragment_cache, 'monotonic', return_value=110):
+            self.assertIsNone(backend.get('a'))
+
+
+class FragmentViewsTestCase(TestCase):
+    """Test warble cards rendered from the cache."""
+
+    def setUp(self):
+        """Create a user with a message, and log in as them"""
+
+        with app.app_context():
+            fragment_cache.get_cache().clear()
+
+        User.query.delete()
+        Message.query.delete()
+
+        db.session.add(User(id=1212, email="test@test.com", username="testuser", password="HASHED_PASSWORD"))
+        db.session.commit()
+
+        db.session.add(Message(id=1234, text="cached message", user_id=1212))
+        db.session.commit()
+        current_user.invalidate(1212)
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1212
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def test_hits(self):
+        """A second render of a profile comes from the cache"""
+
+        resp = self.client.get('/users/1212')
+        self.assertEqual(resp.headers['X-Fragment-Cache'], "hits=0, misses=1")
+
+        resp = self.client.get('/users/1212')
+        self.assertEqual(resp.headers['X-Fragment-Cache'], "hits=1, misses=0")
+        self.assertIn("cached message", str(resp.data))
+
+    def test_profile_version(self):
+        """Cards are rendered again once their author's profile changes"""
+
+        self.client.get('/users/1212')
+
+        user = User.query.get(1212)
+        user.username = "renamed"
+        user.profile_version += 1
+        db.session.commit()
+
+        resp = self.client.get('/users/1212')
+        self.assertEqual(resp.headers['X-Fragment-Cache'], "hits=0, misses=1")
+        self.assertIn("@renamed", str(resp.data))
+
+    def test_delete_invalidates(self):
+        """Deleting a message drops its cached cards"""
+
+        self.client.get('/users/1212')
+        self.client.post('/messages/1234/delete')
+
+        key = fragment_cache.make_key('profile warble', (1234, 0))
+        with app.app_context():
+            self.assertIsNone(fragment_cache.get_cache().backend.get(key))
@@ -0,0 +1,115 @@
+"""Bulk loader tests."""
+
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from sqlalchemy import inspect
+
+from models import db, User, Message, Follows, Like
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import loader
+
+db.create_all()
+
+FILES = {
+    'users.csv': "email,username,password,bio\n"
+                 "a@test.com,usera,HASHED_PASSWORD,\n"
+                 "b@test.com,userb,HASHED_PASSWORD,Hello\n",
+    'messages-1.csv': "text,timestamp,user_id\n"
+                      "first,2019-01-01 10:00:00.000001,1\n",
+    'messages-2.csv': "text,timestamp,user_id\n"
+                      "second,2019-01-02 10:00:00,2\n"
+                      "third,2019-01-03 10:00:00,2\n",
+    'follows.csv': "user_being_followed_id,user_following_id\n"
+                   "2,1\n",
+}
+
+
+class LoaderTestCase(TestCase):
+    """Test loading CSV files in batches."""
+
+    def setUp(self):
+        """Write a small set of CSV files"""
+
+        Like.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.data_dir = tempfile.TemporaryDirectory()
+        for name, content in FILES.items():
+            with open(os.path.join(self.data_dir.name, name), 'w') as csv_file:
+                csv_file.write(content)
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        self.data_dir.cleanup()
+
+    def test_batches(self):
+        """Rows are split into batches of the given size"""
+
+        self.assertEqual(list(loader.batches(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+    def test_load(self):
+        """Every table's files are loaded, and reported"""
+
+        lines = []
+        results = loader.load(db.engine, self.data_dir.name, batch_size=1,
+                              workers=2, report=lines.append)
+
+        self.assertEqual({table: rows for table, (rows, _) in results.items()},
+                         {'users': 2, 'messages': 3, 'follows': 1})
+        self.assertEqual(len(lines), 4)
+
+        self.assertEqual(User.query.get(2).username, "userb")
+        self.assertIsNone(User.query.get(1).bio)
+
+        messages = Message.query.order_by(Message.id).all()
+        self.assertEqual([msg.text for msg in messages], ["first", "second", "third"])
+        self.assertEqual(messages[0].timestamp, datetime(2019, 1, 1, 10, 0, 0, 1))
+
+        self.assertEqual(User.query.get(1).following[0].username, "userb")
+
+    def test_new_users_after_load(self):
+        """Users added after a load get fresh ids"""
+
+        loader.load(db.engine, self.data_dir.name, report=lambda line: None)
+
+        user = User(email="c@test.com", username="userc", password="HASHED_PASSWORD")
+        db.session.add(user)
+        db.session.commit()
+
+        self.assertEqual(user.id, 3)
+
+    def test_insert_empty_fields(self):
+        """Empty fields are NULL without COPY too"""
+
+        with db.engine.connect() as conn:
+            loader.insert_batch(conn, User.__table__, ['id', 'email', 'username', 'password', 'bio'],
+                                [{'id': 1, 'email': "a@test.com", 'username': "usera",
+                                  'password': "HASHED_PASSWORD", 'bio': ""}])
+
+        self.assertIsNone(User.query.get(1).bio)
+
+    def test_failed_load_keeps_indexes(self):
+        """The dropped indexes are rebuilt when a load fails"""
+
+        with open(os.path.join(self.data_dir.name, 'messages-3.csv'), 'w') as csv_file:
+            csv_file.write("text,timestamp,user_id\nbroken,yesterday,1\n")
+
+        indexes = {index['name'] for index in inspect(db.engine).get_indexes('messages')}
+
+        with self.assertRaises(ValueError):
+            loader.load(db.engine, self.data_dir.name, report=lambda line: None)
+
+        self.assertEqual({index['name'] for index in inspect(db.engine).get_indexes('messages')},
+                         indexes)
+        self.assertTrue(indexes)
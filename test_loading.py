@@ -0,0 +1,89 @@
+"""Loading profile tests."""
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import inspect
+
+from models import db, User, Message, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import timeline
+from loading import with_profile
+from sql_stats import query_budget
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class LoadingTestCase(TestCase):
+    """Test that pages fetch authors with their warbles."""
+
+    def setUp(self):
+        """Create a reader following five authors with a warble each"""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        db.session.add(User(id=100, email="reader@test.com", username="reader", password="HASHED_PASSWORD"))
+        for i in range(1, 6):
+            db.session.add(User(id=100 + i, email=f"author{i}@test.com", username=f"author{i}", password="HASHED_PASSWORD"))
+        db.session.commit()
+
+        for i in range(1, 6):
+            db.session.add(Follows(user_following_id=100, user_being_followed_id=100 + i))
+            db.session.add(Message(text=f"warble {i}", user_id=100 + i))
+        db.session.commit()
+
+        with app.app_context():
+            timeline.rebuild(100)
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def test_timeline_card(self):
+        """Timeline cards load their author's displayed columns only"""
+
+        msg = with_profile(Message.query, 'timeline card').first()
+        author = inspect(msg).dict['user']
+
+        self.assertEqual(author.username, msg.text.replace('warble', 'author').replace(' ', ''))
+        self.assertIn('image_url', inspect(author).dict)
+        self.assertNotIn('password', inspect(author).dict)
+
+    def test_homepage_no_n_plus_one(self):
+        """The homepage doesn't look up each author separately"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 100
+
+            with query_budget(20) as stats:
+                resp = c.get('/')
+
+            self.assertEqual(resp.status_code, 200)
+            for i in range(1, 6):
+                self.assertIn(f"@author{i}", str(resp.data))
+            self.assertEqual(stats.duplicates(), [])
+
+    def test_followers_page(self):
+        """The following page lists user cards"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 100
+
+            resp = c.get('/users/100/following')
+
+            self.assertEqual(resp.status_code, 200)
+            for i in range(1, 6):
+                self.assertIn(f"@author{i}", str(resp.data))
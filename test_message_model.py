@@ -2,7 +2,7 @@
 
 import os
 from unittest import TestCase
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from models import db, User, Message, Follows
 
@@ -51,4 +51,19 @@ class MessageModelTestCase(TestCase):
         self.assertEqual(len(self.user.messages), 1)
 
         # new_msg should have a timestamp
-        self.assertIsInstance(new_msg.timestamp, datetime)
\ No newline at end of file
+        self.assertIsInstance(new_msg.timestamp, datetime)
+
+    def test_ids_ordered_by_time(self):
+        """Later messages get larger ids, and timestamps come from the ids"""
+
+        first = Message(text="first", user_id=self.user.id)
+        db.session.add(first)
+        db.session.commit()
+
+        second = Message(text="second", user_id=self.user.id)
+        db.session.add(second)
+        db.session.commit()
+
+        self.assertGreater(second.id, first.id)
+        self.assertLessEqual(first.timestamp, second.timestamp)
+        self.assertLess(datetime.utcnow() - second.timestamp, timedelta(minutes=1))
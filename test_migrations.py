@@ -0,0 +1,112 @@
+"""Schema migration tests."""
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import inspect
+
+from models import db, Like, Message, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import migrations
+
+db.create_all()
+
+
+class MigrationsTestCase(TestCase):
+    """Test applying and reverting migrations."""
+
+    def setUp(self):
+        """Start from a fully migrated database"""
+
+        # concurrent index builds wait for open transactions to finish
+        db.session.rollback()
+        migrations.upgrade()
+
+    def tearDown(self):
+        """Leave the database fully migrated."""
+
+        db.session.rollback()
+        migrations.upgrade()
+
+    def index_names(self, table):
+        return {index['name'] for index in inspect(db.engine).get_indexes(table)}
+
+    def test_upgrade(self):
+        """Every migration is recorded once applied"""
+
+        self.assertEqual(migrations.upgrade(), [])
+        self.assertEqual(migrations.applied_versions(),
+                         {m.version for m in migrations.MIGRATIONS})
+        self.assertIn('ix_messages_user_id', self.index_names('messages'))
+        self.assertIn('ix_follows_following_followed', self.index_names('follows'))
+
+    def test_downgrade(self):
+        """Reverting a migration undoes it, and upgrading applies it again"""
+
+        extra = migrations.Migration('9001', "Test index", [
+            migrations.CreateIndex('ix_follows_test', 'follows',
+                                   ['user_being_followed_id', 'user_following_id']),
+        ])
+
+        with patch.object(migrations, 'MIGRATIONS', migrations.MIGRATIONS + [extra]):
+            applied = migrations.upgrade()
+
+            self.assertEqual(applied, [extra])
+            self.assertIn('ix_follows_test', self.index_names('follows'))
+
+            reverted = migrations.downgrade(migrations.MIGRATIONS[-2].version)
+
+            self.assertEqual(reverted, [extra])
+            self.assertNotIn('ix_follows_test', self.index_names('follows'))
+            self.assertNotIn('9001', migrations.applied_versions())
+
+    def test_likes_primary_key(self):
+        """Likes keyed by their own id are rekeyed by user and warble"""
+
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        db.session.add(User(id=1212, email="user1@test.com", username="user1", password="HASHED_PASSWORD"))
+        db.session.add(User(id=2323, email="user2@test.com", username="user2", password="HASHED_PASSWORD"))
+        db.session.add(Message(id=1, text="warble", user_id=1212))
+        db.session.commit()
+
+        # the likes table as it was first created
+        with db.engine.begin() as conn:
+            conn.execute("DROP TABLE likes")
+            conn.execute("CREATE TABLE likes ("
+                         "id SERIAL PRIMARY KEY, "
+                         "user_id INTEGER REFERENCES users ON DELETE CASCADE, "
+                         "message_id BIGINT UNIQUE REFERENCES messages ON DELETE CASCADE, "
+                         "timestamp TIMESTAMP NOT NULL)")
+            conn.execute("INSERT INTO likes (user_id, message_id, timestamp) "
+                         "VALUES (1212, 1, now())")
+            conn.execute("DELETE FROM schema_migrations WHERE version = '0008'")
+
+        self.assertEqual([m.version for m in migrations.upgrade()], ['0008'])
+
+        likes = inspect(db.engine)
+        self.assertEqual(likes.get_pk_constraint('likes')['constrained_columns'],
+                         ['user_id', 'message_id'])
+        self.assertEqual(likes.get_unique_constraints('likes'), [])
+        self.assertNotIn('id', {column['name'] for column in likes.get_columns('likes')})
+        self.assertIn('ix_likes_message_id', self.index_names('likes'))
+
+        db.session.add(Like(user_id=2323, message_id=1))
+        db.session.commit()
+        self.assertEqual(Like.query.filter_by(message_id=1).count(), 2)
+
+    def test_status(self):
+        """Status lists every migration as applied"""
+
+        self.assertTrue(all(applied for (_, applied) in migrations.status()))
+
+    def test_unknown_target(self):
+        """Unknown versions are rejected"""
+
+        with self.assertRaises(ValueError):
+            migrations.downgrade('9999')
@@ -0,0 +1,145 @@
+"""Keyset pagination tests."""
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Like
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from pagination import (paginate, paginate_by_id, paginate_by_time,
+                        parse_time_cursor, requested_cursors, time_cursor)
+
+db.create_all()
+
+
+class PaginationTestCase(TestCase):
+    """Test cursors and paging through messages."""
+
+    def setUp(self):
+        """Create a user with five messages a minute apart"""
+
+        User.query.delete()
+        Message.query.delete()
+
+        user = User(id=1212, email="test@test.com", username="testuser", password="HASHED_PASSWORD")
+        db.session.add(user)
+        db.session.commit()
+
+        start = datetime(2020, 1, 1)
+        db.session.add_all([
+            Message(id=i, text=f"message {i}", user_id=1212, timestamp=start + timedelta(minutes=i))
+            for i in range(1, 6)
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def get_page(self, querystring=''):
+        """Gets a page of two messages for the given querystring"""
+
+        with app.test_request_context(f'/users/1212{querystring}'):
+            return paginate(Message.query, Message.id, size=2)
+
+    def test_requested_cursors(self):
+        """Cursors are read from the querystring, ignoring malformed ones"""
+
+        with app.test_request_context('/?before=42&after=not-a-cursor'):
+            self.assertEqual(requested_cursors(), (42, None))
+
+    def test_first_page(self):
+        """The first page is the newest messages, with only an older link"""
+
+        page = self.get_page()
+
+        self.assertEqual([msg.id for msg in page], [5, 4])
+        self.assertIsNotNone(page.older)
+        self.assertIsNone(page.newer)
+
+    def test_older_and_newer(self):
+        """Following the cursors walks back and forth through the list"""
+
+        second = self.get_page(f'?before={self.get_page().older}')
+        self.assertEqual([msg.id for msg in second], [3, 2])
+
+        last = self.get_page(f'?before={second.older}')
+        self.assertEqual([msg.id for msg in last], [1])
+        self.assertIsNone(last.older)
+
+        back = self.get_page(f'?after={last.newer}')
+        self.assertEqual([msg.id for msg in back], [3, 2])
+        self.assertIsNotNone(back.newer)
+
+    def test_time_cursors(self):
+        """Time cursors round trip, and malformed ones are ignored"""
+
+        cursor = time_cursor(datetime(2020, 1, 1, 12, 30, 0, 5), 42)
+        self.assertEqual(parse_time_cursor(cursor),
+                         (datetime(2020, 1, 1, 12, 30, 0, 5), 42))
+
+        with app.test_request_context('/?before=12_x&after=nope'):
+            self.assertEqual(requested_cursors(parse_time_cursor), (None, None))
+
+    def test_time_cursor_out_of_range(self):
+        """A time cursor too far from the epoch is a bad request"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1212
+
+            resp = c.get(f'/users/1212/likes?before={10 ** 30}_1')
+            self.assertEqual(resp.status_code, 400)
+
+    def test_paginate_by_id(self):
+        """Lists by id go oldest first, with the same cursors as newest-first lists"""
+
+        def get_page(querystring=''):
+            with app.test_request_context(f'/users{querystring}'):
+                return paginate_by_id(Message.query, Message.id, size=2)
+
+        first = get_page()
+        self.assertEqual([msg.id for msg in first], [1, 2])
+        self.assertIsNone(first.older)
+        self.assertEqual(first.newer, 2)
+
+        second = get_page(f'?after={first.newer}')
+        self.assertEqual([msg.id for msg in second], [3, 4])
+        self.assertEqual((second.older, second.newer), (3, 4))
+
+        last = get_page(f'?after={second.newer}')
+        self.assertEqual([msg.id for msg in last], [5])
+        self.assertIsNone(last.newer)
+
+        back = get_page(f'?before={last.older}')
+        self.assertEqual([msg.id for msg in back], [3, 4])
+        self.assertEqual(back.older, 3)
+
+    def test_paginate_by_time(self):
+        """Rows at the same time are paged through in id order"""
+
+        same_time = datetime(2020, 2, 1)
+        db.session.add_all([Like(user_id=1212, message_id=i, timestamp=same_time)
+                            for i in range(1, 6)])
+        db.session.commit()
+
+        def get_page(querystring=''):
+            with app.test_request_context(f'/users/1212/likes{querystring}'):
+                return paginate_by_time(Like.query, Like.timestamp,
+                                        Like.message_id, size=2)
+
+        first = get_page()
+        second = get_page(f'?before={first.older}')
+        last = get_page(f'?before={second.older}')
+
+        self.assertEqual([like.message_id for like in first], [5, 4])
+        self.assertEqual([like.message_id for like in second], [3, 2])
+        self.assertEqual([like.message_id for like in last], [1])
+        self.assertIsNone(last.older)
+
+        back = get_page(f'?after={last.newer}')
+        self.assertEqual([like.message_id for like in back], [3, 2])
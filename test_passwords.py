@@ -0,0 +1,104 @@
+"""Password hashing tests."""
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import passwords
+
+db.create_all()
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test hashing on and off the process pool."""
+
+    def test_hash_and_check(self):
+        """Hashes made in the pool check out, wrong passwords don't"""
+
+        for workers in (0, 1):
+            hasher = passwords.PasswordHasher(rounds=4, workers=workers)
+            hashed = hasher.hash("secret123")
+
+            self.assertTrue(hashed.startswith("$2b$04$"))
+            self.assertTrue(hasher.check(hashed, "secret123"))
+            self.assertFalse(hasher.check(hashed, "wrong"))
+
+    def test_needs_rehash(self):
+        """Hashes at another work factor should be replaced"""
+
+        hasher = passwords.PasswordHasher(rounds=4, workers=0)
+
+        self.assertFalse(hasher.needs_rehash(hasher.hash("secret123")))
+        self.assertTrue(hasher.needs_rehash(passwords._hash("secret123", 5)))
+
+    def test_metrics(self):
+        """Hashes and checks are counted and timed"""
+
+        hasher = passwords.PasswordHasher(rounds=4, workers=0)
+        hasher.check(hasher.hash("secret123"), "secret123")
+
+        metrics = hasher.metrics()
+        self.assertEqual(metrics['queue_depth'], 0)
+        self.assertEqual(metrics['max_queue_depth'], 1)
+        self.assertEqual(metrics['hash']['count'], 1)
+        self.assertEqual(metrics['check']['count'], 1)
+        self.assertGreater(metrics['hash']['mean_seconds'], 0)
+
+    def test_queue_full(self):
+        """Callers give up once the queue has been full for too long"""
+
+        hasher = passwords.PasswordHasher(rounds=4, workers=0, max_queue=1, queue_timeout=0.01)
+        hasher.slots.acquire()
+
+        self.assertRaises(passwords.PasswordQueueFull, hasher.hash, "secret123")
+
+    def test_pool_timeout(self):
+        """Callers stop waiting on a slow pool, and its slot is freed when the hash is done"""
+
+        hasher = passwords.PasswordHasher(rounds=12, workers=1, max_queue=1, queue_timeout=0.01)
+
+        with self.assertLogs('warbler.passwords') as logs:
+            self.assertRaises(passwords.PasswordQueueFull, hasher.hash, "secret123")
+            hasher.executor.shutdown(wait=True)
+
+        self.assertIn('"event": "password_hash"', logs.output[0])
+        self.assertTrue(hasher.slots.acquire(blocking=False))
+
+
+class RehashOnLoginTestCase(TestCase):
+    """Test that logging in upgrades old password hashes."""
+
+    def setUp(self):
+        """Create a user whose hash has an old work factor"""
+
+        User.query.delete()
+        Message.query.delete()
+
+        db.session.add(User(id=1212, email="test@test.com", username="testuser",
+                            password=passwords._hash("password", 4)))
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        app.extensions.pop('password_hasher', None)
+        app.config['BCRYPT_LOG_ROUNDS'] = 12
+
+    def test_rehash(self):
+        """Logging in stores a hash at the current work factor"""
+
+        app.extensions.pop('password_hasher', None)
+        app.config['BCRYPT_LOG_ROUNDS'] = 5
+        app.config['WTF_CSRF_ENABLED'] = False
+
+        with app.test_client() as c:
+            resp = c.post('/login', data={"username": "testuser", "password": "password"})
+            self.assertEqual(resp.status_code, 302)
+
+        db.session.expire_all()
+        self.assertTrue(User.query.get(1212).password.startswith("$2b$05$"))
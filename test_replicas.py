@@ -0,0 +1,87 @@
+"""Read replica routing tests."""
+
+import os
+import tempfile
+from time import time
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from models import db, User, Message, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import replicas
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ReplicasTestCase(TestCase):
+    """Test sending reads to a replica and pinning writers to the primary."""
+
+    def setUp(self):
+        """Use a SQLite replica holding a user the primary doesn't have"""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        db.session.add(User(id=1212, email="test@test.com", username="testuser", password="HASHED_PASSWORD"))
+        db.session.commit()
+
+        self.replica_dir = tempfile.TemporaryDirectory()
+        uri = f"sqlite:///{self.replica_dir.name}/replica.db"
+        engine = create_engine(uri)
+        db.metadata.create_all(engine)
+        engine.execute(User.__table__.insert(), [
+            dict(id=1212, email="test@test.com", username="testuser", password="HASHED_PASSWORD"),
+            dict(id=5656, email="replica@test.com", username="replicauser", password="HASHED_PASSWORD"),
+        ])
+
+        app.config['SQLALCHEMY_REPLICA_URIS'] = [uri]
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Go back to the primary only."""
+
+        db.session.rollback()
+        app.config['SQLALCHEMY_REPLICA_URIS'] = []
+        for engine in app.extensions.pop('db_replicas', {}).values():
+            engine.dispose()
+        self.replica_dir.cleanup()
+
+    def test_reads_from_replica(self):
+        """GET requests read from the replica"""
+
+        resp = self.client.get('/users/5656')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@replicauser", str(resp.data))
+
+    def test_no_replicas(self):
+        """Without replicas, reads go to the primary"""
+
+        app.config['SQLALCHEMY_REPLICA_URIS'] = []
+
+        self.assertEqual(self.client.get('/users/5656').status_code, 404)
+
+    def test_pinned_after_write(self):
+        """After a write, the visitor's reads go to the primary"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1212
+
+            resp = c.post("/messages/new", data={"text": "Hello"})
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(Message.query.count(), 1)
+            self.assertEqual(c.get('/users/5656').status_code, 404)
+
+            with c.session_transaction() as sess:
+                sess[replicas.PIN_KEY] = time() - app.config['REPLICA_PIN_SECONDS'] - 1
+
+            self.assertEqual(c.get('/users/5656').status_code, 200)
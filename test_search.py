@@ -0,0 +1,123 @@
+"""User search tests."""
+
+import os
+import tempfile
+from unittest import TestCase
+
+from flask import Flask
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import search
+
+db.create_all()
+
+
+class UserSearchTestCase(TestCase):
+    """Test the search backend and paging through results."""
+
+    def setUp(self):
+        """Create users to search for"""
+
+        User.query.delete()
+        Message.query.delete()
+
+        db.session.add_all([
+            User(id=1, email="a@test.com", username="birdwatcher", password="x", bio="I like owls"),
+            User(id=2, email="b@test.com", username="owlfan", password="x", location="Owlsville"),
+            User(id=3, email="c@test.com", username="theowl", password="x"),
+            User(id=4, email="d@test.com", username="quiet", password="x", bio="100% cats_only"),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def check_backend(self, backend):
+        """Runs the same searches against `backend`"""
+
+        def usernames(term, offset=0, limit=10):
+            return [user.username for user in backend.search(term, offset, limit)]
+
+        # prefix matches, then other username matches, then bio/location
+        self.assertEqual(usernames("OWL"), ["owlfan", "theowl", "birdwatcher"])
+        self.assertEqual(usernames("owl", offset=1, limit=1), ["theowl"])
+        self.assertEqual(usernames("ow"), ["owlfan", "theowl", "birdwatcher"])
+        self.assertEqual(usernames("0% cats_"), ["quiet"])
+        self.assertEqual(usernames("penguin"), [])
+
+    def test_backend(self):
+        """The database backend ranks and filters results"""
+
+        with app.app_context():
+            self.check_backend(search.UserSearch())
+
+    def test_sqlite_index(self):
+        """On SQLite the trigram table finds users, and its triggers keep it current"""
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            sqlite_app = Flask(__name__)
+            sqlite_app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{data_dir}/search.db"
+            sqlite_app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+            db.init_app(sqlite_app)
+            db.session.remove()
+
+            try:
+                with sqlite_app.app_context():
+                    db.create_all()
+                    db.session.add_all([
+                        User(id=1, email="a@test.com", username="birdwatcher", password="x", bio="I like owls"),
+                        User(id=2, email="b@test.com", username="owlfan", password="x", location="Owlsville"),
+                        User(id=4, email="d@test.com", username="quiet", password="x", bio="100% cats_only"),
+                    ])
+                    db.session.commit()
+
+                    self.assertTrue(search.UserSearch().create_indexes())
+                    self.assertIsNotNone(search.sqlite_candidates("owl"))
+
+                    db.session.add(User(id=3, email="c@test.com", username="theowl", password="x"))
+                    db.session.commit()
+
+                    self.check_backend(search.UserSearch())
+                    db.engine.dispose()
+            finally:
+                db.session.remove()
+
+    def test_sees_outside_changes(self):
+        """Users changed outside this process are found straight away"""
+
+        with app.app_context():
+            self.assertEqual(search.search_users("penguin").users, [])
+
+            db.session.execute("UPDATE users SET bio = 'Penguins!' WHERE id = 4")
+            db.session.commit()
+
+            self.assertEqual([user.id for user in search.search_users("penguin").users], [4])
+
+    def test_pages(self):
+        """Results are split into pages"""
+
+        with app.app_context():
+            first = search.search_users("owl", page=1, per_page=2)
+            second = search.search_users("owl", page=2, per_page=2)
+
+        self.assertEqual([user.id for user in first.users], [2, 3])
+        self.assertTrue(first.has_next)
+        self.assertEqual([user.id for user in second.users], [1])
+        self.assertFalse(second.has_next)
+
+    def test_search_view(self):
+        """Searching from /users is case-insensitive and covers bios"""
+
+        with app.test_client() as c:
+            resp = c.get('/users?q=OWLS')
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("@birdwatcher", str(resp.data))
+            self.assertIn("@owlfan", str(resp.data))
+            self.assertNotIn("@theowl", str(resp.data))
@@ -0,0 +1,63 @@
+"""Snowflake id tests."""
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+import snowflake
+
+
+class SnowflakeTestCase(TestCase):
+    """Test making and reading time-ordered ids."""
+
+    def test_increasing(self):
+        """Ids from one generator are unique and increasing"""
+
+        generator = snowflake.IdGenerator(7)
+        ids = [generator.next_id() for _ in range(10000)]
+
+        self.assertEqual(ids, sorted(set(ids)))
+
+    def test_clock_going_back(self):
+        """Ids keep increasing if the clock steps backwards"""
+
+        generator = snowflake.IdGenerator(7)
+        first = generator.next_id()
+        generator.now_millis = lambda: 0
+
+        self.assertGreater(generator.next_id(), first)
+
+    def test_timestamp(self):
+        """An id's timestamp can be read back out of it"""
+
+        at = datetime(2020, 5, 17, 12, 30, 15, 123000)
+        snowflake_id = snowflake.IdGenerator(7).next_id(at=at)
+
+        self.assertEqual(snowflake.timestamp_of(snowflake_id), at)
+        self.assertGreaterEqual(snowflake_id, snowflake.first_id_at(at))
+        self.assertLess(snowflake_id, snowflake.first_id_at(datetime(2020, 5, 17, 12, 30, 16)))
+
+    def test_bad_worker(self):
+        """Worker ids must fit in 10 bits"""
+
+        with self.assertRaises(ValueError):
+            snowflake.IdGenerator(1024)
+
+    def test_lease_worker(self):
+        """Processes lease different worker ids, freed when they close"""
+
+        engine = create_engine(os.environ.get('DATABASE_URL', "postgresql:///warbler-test"))
+
+        first, first_lease = snowflake.lease_worker(engine)
+        second, second_lease = snowflake.lease_worker(engine)
+        self.assertNotEqual(first, second)
+
+        first_lease.close()
+        again, again_lease = snowflake.lease_worker(engine)
+        self.assertEqual(again, first)
+
+        again_lease.close()
+        second_lease.close()
+        engine.dispose()
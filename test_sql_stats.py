@@ -0,0 +1,80 @@
+"""SQL instrumentation tests."""
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from sql_stats import QueryStats, query_budget
+
+db.create_all()
+
+
+class SQLStatsTestCase(TestCase):
+    """Test query counting, headers and budgets."""
+
+    def setUp(self):
+        """Create a user with a few messages"""
+
+        User.query.delete()
+        Message.query.delete()
+
+        db.session.add(User(id=1212, email="test@test.com", username="testuser", password="HASHED_PASSWORD"))
+        db.session.commit()
+
+        db.session.add_all([Message(text=f"message {i}", user_id=1212) for i in range(3)])
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        app.config.pop('SQL_STATS_BUFFER_STREAMS', None)
+
+    def test_headers(self):
+        """Responses report how many queries they ran"""
+
+        with self.client as c:
+            resp = c.get('/users/1212')
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertGreater(int(resp.headers['X-SQL-Queries']), 0)
+            self.assertIn('X-SQL-Time-ms', resp.headers)
+
+    def test_streamed_headers(self):
+        """Streamed pages can be buffered so their rendering is counted"""
+
+        app.config['SQL_STATS_BUFFER_STREAMS'] = True
+
+        with query_budget(50) as stats:
+            resp = self.client.get('/users')
+
+        self.assertIn(b'testuser', resp.data)
+        self.assertEqual(int(resp.headers['X-SQL-Queries']), stats.count)
+
+    def test_budget(self):
+        """A view over its query budget fails the test"""
+
+        with query_budget(50) as stats:
+            self.client.get('/users/1212')
+        self.assertGreater(stats.count, 0)
+
+        with self.assertRaises(AssertionError):
+            with query_budget(0):
+                self.client.get('/users/1212')
+
+    def test_duplicates(self):
+        """Statements that run repeatedly are reported"""
+
+        stats = QueryStats()
+        for _ in range(3):
+            stats.record("SELECT * FROM users WHERE id = %(id)s", 0.001)
+        stats.record("SELECT * FROM messages", 0.001)
+
+        self.assertEqual(stats.count, 4)
+        self.assertEqual(stats.duplicates(), [("SELECT * FROM users WHERE id = %(id)s", 3)])
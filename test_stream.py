@@ -0,0 +1,129 @@
+"""Live timeline stream tests."""
+
+import json
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import stream
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class MemoryBrokerTestCase(TestCase):
+    """Test in-process publish/subscribe."""
+
+    def test_publish(self):
+        """Subscribers get what's published on their channels only"""
+
+        broker = stream.MemoryBroker()
+        subscription = broker.subscribe(['a', 'b'])
+
+        broker.publish('a', "one")
+        broker.publish('c', "two")
+        broker.publish('b', "three")
+
+        self.assertEqual(subscription.get(0.01), "one")
+        self.assertEqual(subscription.get(0.01), "three")
+        self.assertIsNone(subscription.get(0.01))
+
+    def test_close(self):
+        """Closed subscriptions are forgotten"""
+
+        broker = stream.MemoryBroker()
+        broker.subscribe(['a']).close()
+
+        self.assertEqual(broker.subscribers, {})
+
+
+class StreamViewsTestCase(TestCase):
+    """Test streaming new warbles to followers."""
+
+    def setUp(self):
+        """Create two users, one following the other"""
+
+        app.extensions.pop('stream_broker', None)
+        app.config['STREAM_HEARTBEAT_SECONDS'] = 0.01
+
+        User.query.delete()
+        Message.query.delete()
+
+        db.session.add(User(id=1212, email="user1@test.com", username="user1", password="HASHED_PASSWORD"))
+        db.session.add(User(id=2323, email="user2@test.com", username="user2", password="HASHED_PASSWORD"))
+        db.session.add(User(id=3434, email="user3@test.com", username="user3", password="HASHED_PASSWORD"))
+        db.session.commit()
+
+        db.session.add(Follows(user_being_followed_id=2323, user_following_id=1212))
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1212
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        app.config['STREAM_HEARTBEAT_SECONDS'] = stream.DEFAULT_HEARTBEAT
+
+    def post_as(self, user_id, text):
+        """Posts a message through the view as `user_id`"""
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        client.post("/messages/new", data={"text": text})
+        return Message.query.filter(Message.text == text).one()
+
+    def test_stream(self):
+        """New warbles by followed users are sent as events"""
+
+        resp = self.client.get('/stream/timeline', buffered=False)
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+
+        events = (chunk.decode() for chunk in resp.response)
+        self.assertTrue(next(events).startswith("retry: "))
+
+        self.post_as(3434, "not followed")
+        msg = self.post_as(2323, "followed")
+
+        event = next(events)
+        self.assertTrue(event.startswith(f"id: {msg.id}\nevent: warble\ndata: "))
+        data = json.loads(event.split("data: ", 1)[1])
+        self.assertEqual(data['messages'][0]['text'], "followed")
+        self.assertEqual(data['users']['2323']['username'], "user2")
+
+        # nothing else was sent, so the stream is kept alive
+        self.assertEqual(next(events), ":\n\n")
+
+        resp.close()
+        self.assertEqual(app.extensions['stream_broker'].subscribers, {})
+
+    def test_replay(self):
+        """Warbles missed since the last event are sent first"""
+
+        seen = self.post_as(2323, "seen")
+        missed = self.post_as(2323, "missed")
+
+        resp = self.client.get('/stream/timeline', buffered=False,
+                               headers={'Last-Event-ID': str(seen.id)})
+        events = (chunk.decode() for chunk in resp.response)
+        next(events)
+
+        self.assertTrue(next(events).startswith(f"id: {missed.id}\n"))
+        resp.close()
+
+    def test_unauthorized(self):
+        """The stream needs a logged-in user"""
+
+        with self.client.session_transaction() as sess:
+            del sess[CURR_USER_KEY]
+
+        self.assertEqual(self.client.get('/stream/timeline').status_code, 401)
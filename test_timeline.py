@@ -0,0 +1,201 @@
+"""Materialized timeline tests."""
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import counters
+import timeline
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TimelineTestCase(TestCase):
+    """Test fan-out, cleanup and reads of home timelines."""
+
+    def setUp(self):
+        """Create test client and sample users"""
+
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        self.u1 = User.signup(username="user1", email="user1@test.com", password="password", image_url=None)
+        self.u1.id = 1212
+
+        self.u2 = User.signup(username="user2", email="user2@test.com", password="password", image_url=None)
+        self.u2.id = 2323
+        db.session.commit()
+
+        # user1 follows user2
+        db.session.add(Follows(user_being_followed_id=2323, user_following_id=1212))
+        counters.recount()
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        app.config['TIMELINE_FANOUT_LIMIT'] = timeline.DEFAULT_FANOUT_LIMIT
+        app.config['TIMELINE_MAX_ENTRIES'] = timeline.DEFAULT_MAX_ENTRIES
+
+    def post_as(self, user_id, text):
+        """Posts a message through the view as `user_id`"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            c.post("/messages/new", data={"text": text})
+
+        return Message.query.filter(Message.text == text).one()
+
+    def entry_user_ids(self, message_id):
+        """Ids of users whose timelines contain `message_id`"""
+
+        entries = TimelineEntry.query.filter_by(message_id=message_id).all()
+        return sorted(entry.user_id for entry in entries)
+
+    def test_post_fans_out(self):
+        """Posting adds the warble to the author's and followers' timelines"""
+
+        msg = self.post_as(2323, "hello followers")
+        self.assertEqual(self.entry_user_ids(msg.id), [1212, 2323])
+
+        with app.app_context():
+            self.assertEqual([m.id for m in timeline.home_timeline(1212)], [msg.id])
+
+    def test_celebrity_is_pulled(self):
+        """Authors over the fan-out limit are merged in at read time"""
+
+        app.config['TIMELINE_FANOUT_LIMIT'] = 1
+
+        msg = self.post_as(2323, "too famous to fan out")
+        self.assertEqual(self.entry_user_ids(msg.id), [2323])
+
+        with app.app_context():
+            self.assertEqual(timeline.pulled_author_ids(1212), [2323])
+            self.assertEqual([m.id for m in timeline.home_timeline(1212)], [msg.id])
+            self.assertEqual(timeline.latest_id(1212), msg.id)
+
+    def test_latest_id(self):
+        """The latest id is the newest warble in the timeline"""
+
+        with app.app_context():
+            self.assertIsNone(timeline.latest_id(1212))
+
+        first = self.post_as(2323, "first")
+        second = self.post_as(2323, "second")
+
+        with app.app_context():
+            self.assertEqual(timeline.latest_id(1212), second.id)
+            self.assertGreater(second.id, first.id)
+
+    def test_delete_message(self):
+        """Deleting a warble removes it from every timeline"""
+
+        msg = self.post_as(2323, "short lived")
+
+        with self.client as c:
+            c.post(f"/messages/{msg.id}/delete")
+
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+    def test_follow_and_unfollow(self):
+        """Following backfills recent warbles; unfollowing removes them"""
+
+        msg = self.post_as(1212, "from user1")
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 2323
+
+            c.post("/users/follow/1212")
+            self.assertEqual(self.entry_user_ids(msg.id), [1212, 2323])
+
+            c.post("/users/stop-following/1212")
+            self.assertEqual(self.entry_user_ids(msg.id), [1212])
+
+    def test_rebuild(self):
+        """Rebuilding restores a timeline from follows and messages"""
+
+        msg = Message(id=321, text="user2 message", user_id=2323)
+        db.session.add(msg)
+        db.session.commit()
+
+        with app.app_context():
+            timeline.rebuild(1212)
+            db.session.commit()
+
+        self.assertEqual(self.entry_user_ids(321), [1212])
+
+    def test_rebuild_all(self):
+        """Rebuilding every timeline keeps each user's newest warbles"""
+
+        db.session.add_all([Message(id=i, text=f"message {i}", user_id=2323) for i in range(1, 4)])
+        db.session.commit()
+        app.config['TIMELINE_MAX_ENTRIES'] = 2
+
+        with app.app_context():
+            self.assertEqual(timeline.rebuild_all(), 2)
+
+        self.assertEqual(self.entry_user_ids(3), [1212, 2323])
+        self.assertEqual(self.entry_user_ids(2), [1212, 2323])
+        self.assertEqual(self.entry_user_ids(1), [])
+
+    def test_post_trims_author(self):
+        """Posting keeps the author's own timeline within the limit"""
+
+        app.config['TIMELINE_MAX_ENTRIES'] = 2
+
+        for num in range(3):
+            self.post_as(2323, f"warble {num}")
+
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=2323).count(), 2)
+
+    def test_trim_all(self):
+        """The periodic trim cuts every timeline down to the limit"""
+
+        for num in range(3):
+            self.post_as(2323, f"warble {num}")
+        app.config['TIMELINE_MAX_ENTRIES'] = 1
+
+        with app.app_context():
+            self.assertEqual(timeline.trim_all(batch_size=1), 2)
+
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=1212).count(), 1)
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=2323).count(), 1)
+
+    def test_back_under_fanout_limit(self):
+        """Warbles posted while pulled are pushed once the author is back under the limit"""
+
+        db.session.add(User(id=3434, email="user3@test.com", username="user3", password="HASHED_PASSWORD"))
+        db.session.commit()
+        db.session.add(Follows(user_being_followed_id=2323, user_following_id=3434))
+        db.session.commit()
+        with app.app_context():
+            counters.recount()
+            db.session.commit()
+        app.config['TIMELINE_FANOUT_LIMIT'] = 2
+
+        msg = self.post_as(2323, "posted while pulled")
+        self.assertEqual(self.entry_user_ids(msg.id), [2323])
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 3434
+
+            c.post("/users/stop-following/2323")
+
+        self.assertEqual(self.entry_user_ids(msg.id), [1212, 2323])
+
+        with app.app_context():
+            self.assertEqual(timeline.pulled_author_ids(1212), [])
+            self.assertEqual([m.id for m in timeline.home_timeline(1212)], [msg.id])
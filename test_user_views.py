@@ -1,12 +1,14 @@
 """User View tests"""
 
 import os
+from datetime import datetime
 from unittest import TestCase
 from models import db, connect_db, User, Message, Follows, Like
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 from app import app, CURR_USER_KEY
+from pagination import time_cursor
 
 db.create_all()
 
@@ -60,6 +62,40 @@ class UserViewTestCase(TestCase):
             self.assertIn("@user3", str(resp.data))
             self.assertIn("@abcde", str(resp.data))
 
+    def test_list_users_flash(self):
+        """A flash shown on the streamed users page is shown only once"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess['_flashes'] = [('success', "HELLO-FLASH")]
+
+            pages = [c.get('/users').get_data(as_text=True) for _ in range(3)]
+
+        self.assertEqual([page.count("HELLO-FLASH") for page in pages], [1, 0, 0])
+
+    def test_list_users_pages(self):
+        """Tests paging through the all users page"""
+
+        app.config['USERS_PER_PAGE'] = 3
+
+        try:
+            with self.client as c:
+                resp = c.get('/users')
+
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("@user1", str(resp.data))
+                self.assertIn("@user3", str(resp.data))
+                self.assertNotIn("@abcde", str(resp.data))
+                self.assertIn("/users?after=3434", str(resp.data))
+
+                resp = c.get('/users?after=3434')
+
+                self.assertIn("@abcde", str(resp.data))
+                self.assertNotIn("@user1", str(resp.data))
+                self.assertIn("/users?before=4545", str(resp.data))
+        finally:
+            del app.config['USERS_PER_PAGE']
+
     def test_list_users_search(self):
         """Tests the all users page filtered by a search"""
 
@@ -120,6 +156,33 @@ class UserViewTestCase(TestCase):
             self.assertIn("@user2", str(resp.data))
             self.assertIn("@user3", str(resp.data))
 
+    def test_show_followers_pages(self):
+        """Tests paging through the show followers page"""
+
+        self.setup_followers()
+        app.config['USERS_PER_PAGE'] = 1
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u1_id
+
+                resp = c.get('/users/1212/followers')
+
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("@user2", str(resp.data))
+                self.assertNotIn("@user3", str(resp.data))
+                self.assertIn("/users/1212/followers?after=2323", str(resp.data))
+
+                resp = c.get('/users/1212/followers?after=2323')
+
+                self.assertIn("@user3", str(resp.data))
+                self.assertNotIn("@user2", str(resp.data))
+                self.assertIn("/users/1212/followers?before=3434", str(resp.data))
+                self.assertNotIn("after=", str(resp.data))
+        finally:
+            del app.config['USERS_PER_PAGE']
+
     def test_show_following_unauthorized(self):
         """Tests the show following page when no users are logged in"""
 
@@ -222,6 +285,39 @@ class UserViewTestCase(TestCase):
         self.assertIn("user2 message", str(resp.data))
         self.assertIn("user3 message", str(resp.data))
 
+    def test_show_likes_pages(self):
+        """Tests paging through another user's likes, most recent first"""
+
+        self.setup_messages()
+        db.session.add_all([
+            Like(user_id=self.u1_id, message_id=321, timestamp=datetime(2020, 1, 2)),
+            Like(user_id=self.u1_id, message_id=322, timestamp=datetime(2020, 1, 1)),
+        ])
+        db.session.commit()
+        app.config['MESSAGES_PER_PAGE'] = 1
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u2_id
+
+                resp = c.get('/users/1212/likes')
+
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("@user1", str(resp.data))
+                self.assertIn("user2 message", str(resp.data))
+                self.assertNotIn("user3 message", str(resp.data))
+
+                older = time_cursor(datetime(2020, 1, 2), 321)
+                self.assertIn(f"/users/1212/likes?before={older}", str(resp.data))
+
+                resp = c.get(f'/users/1212/likes?before={older}')
+
+                self.assertIn("user3 message", str(resp.data))
+                self.assertNotIn("user2 message", str(resp.data))
+        finally:
+            del app.config['MESSAGES_PER_PAGE']
+
     def test_show_likes_unauthorized(self):
         """Tests the show all user likes page without logging in"""
 
@@ -258,4 +354,35 @@ class UserViewTestCase(TestCase):
         # message should get unliked
         resp = c.post('/users/add_like/321', follow_redirects=True)
         self.assertEqual(resp.status_code, 200)
-        self.assertEqual(Like.query.count(), 0)
\ No newline at end of file
+        self.assertEqual(Like.query.count(), 0)
+
+    def test_toggle_like_json(self):
+        """Tests the JSON like toggle, including several users liking one message"""
+
+        self.setup_messages()
+        self.setup_likes()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u3_id
+
+            resp = c.post('/messages/321/like')
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json, {"liked": True, "likes": 2})
+
+            resp = c.post('/messages/321/like')
+            self.assertEqual(resp.json, {"liked": False, "likes": 1})
+
+            resp = c.post('/messages/999/like')
+            self.assertEqual(resp.status_code, 404)
+
+    def test_toggle_like_json_unauthorized(self):
+        """Tests the JSON like toggle without logging in"""
+
+        self.setup_messages()
+
+        with self.client as c:
+            resp = c.post('/messages/321/like')
+
+            self.assertEqual(resp.status_code, 401)
+            self.assertEqual(Like.query.count(), 0)
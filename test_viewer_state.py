@@ -0,0 +1,65 @@
+"""Viewer state resolver tests."""
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Like
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from viewer_state import resolve_viewer_state
+
+db.create_all()
+
+
+class ViewerStateTestCase(TestCase):
+    """Test resolving follow/like state for a page of items."""
+
+    def setUp(self):
+        """Create users who follow and like each other's messages"""
+
+        User.query.delete()
+        Message.query.delete()
+
+        self.u1 = User(id=1212, email="user1@test.com", username="user1", password="HASHED_PASSWORD")
+        self.u2 = User(id=2323, email="user2@test.com", username="user2", password="HASHED_PASSWORD")
+        self.u3 = User(id=3434, email="user3@test.com", username="user3", password="HASHED_PASSWORD")
+        db.session.add_all([self.u1, self.u2, self.u3])
+        db.session.commit()
+
+        db.session.add_all([
+            Follows(user_being_followed_id=2323, user_following_id=1212),
+            Follows(user_being_followed_id=1212, user_following_id=3434),
+            Message(id=321, text="user2 message", user_id=2323),
+            Message(id=322, text="user3 message", user_id=3434),
+        ])
+        db.session.commit()
+
+        db.session.add(Like(user_id=1212, message_id=321))
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def test_resolve(self):
+        """Follow, followed-by and like state comes back for the page"""
+
+        viewer = resolve_viewer_state(self.u1, user_ids=[2323, 3434], message_ids=[321, 322])
+
+        self.assertTrue(viewer.is_following(self.u2))
+        self.assertFalse(viewer.is_following(3434))
+        self.assertTrue(viewer.is_followed_by(self.u3))
+        self.assertFalse(viewer.is_followed_by(2323))
+        self.assertTrue(viewer.has_liked(321))
+        self.assertFalse(viewer.has_liked(322))
+
+    def test_anonymous(self):
+        """A logged out viewer follows and likes nothing"""
+
+        viewer = resolve_viewer_state(None, user_ids=[2323], message_ids=[321])
+
+        self.assertFalse(viewer.is_following(2323))
+        self.assertFalse(viewer.has_liked(321))
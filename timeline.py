@@ -0,0 +1,400 @@
+"""Materialized home timelines for Warbler.
+
+Every user's home timeline is stored as rows in `timeline_entries`, written
+when a warble is posted (fan-out on write). Showing the homepage is then one
+indexed range read on the (user_id, message_id) primary key instead of an
+`IN (...)` query over everyone the user follows.
+
+Authors with `TIMELINE_FANOUT_LIMIT` or more followers are not fanned out;
+their warbles are pulled at read time and merged in with the stored entries.
+When one drops back under the limit, their recent warbles are pushed to
+their followers so they don't vanish from homepages (`resume_fan_out`).
+
+Each timeline keeps its newest `TIMELINE_MAX_ENTRIES` entries. Following
+someone trims the follower's timeline straight away, but a post only trims
+its author's: trimming every follower on every post would multiply its
+cost. Run `flask timeline-trim` periodically to trim the rest (`trim_all`).
+"""
+
+from flask import current_app
+from sqlalchemy import func, literal
+
+from loading import with_profile
+from models import db, Follows, Message, TimelineEntry, User
+from pagination import make_page, per_page, seek
+
+DEFAULT_FANOUT_LIMIT = 10000
+DEFAULT_MAX_ENTRIES = 800
+DEFAULT_FOLLOW_BACKFILL = 100
+
+
+def fanout_limit():
+    """Follower count at which an author's warbles stop being pushed."""
+
+    return current_app.config.get('TIMELINE_FANOUT_LIMIT', DEFAULT_FANOUT_LIMIT)
+
+
+def max_entries():
+    """Number of entries kept in each user's materialized timeline."""
+
+    return current_app.config.get('TIMELINE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+
+
+def is_fanned_out(user_id):
+    """Are warbles by `user_id` pushed into their followers' timelines?"""
+
+    (followers,) = (db.session
+                    .query(User.followers_count)
+                    .filter(User.id == user_id)
+                    .one())
+    return followers < fanout_limit()
+
+
+def pulled_author_ids(user_id):
+    """Ids of users followed by `user_id` whose warbles aren't fanned out."""
+
+    rows = (db.session
+            .query(Follows.user_being_followed_id)
+            .join(User, User.id == Follows.user_being_followed_id)
+            .filter(Follows.user_following_id == user_id,
+                    User.followers_count >= fanout_limit())
+            .all())
+    return [author_id for (author_id,) in rows]
+
+
+def touch(user_ids):
+    """Bump the `timeline_version` of `user_ids` (a list or a select of ids).
+
+    Call it in the same transaction as any change to what those users' home
+    timelines show, so `marker` sees the change once it is committed.
+    """
+
+    (User
+     .query
+     .filter(User.id.in_(user_ids))
+     .update({User.timeline_version: User.timeline_version + 1},
+             synchronize_session=False))
+
+
+def touch_readers(author_id):
+    """Bump the timelines that `author_id`'s warbles are pushed to.
+
+    That is the author's own, and their followers' unless the author is
+    pulled at read time (`marker` checks pulled authors itself).
+    """
+
+    readers = [author_id]
+    if is_fanned_out(author_id):
+        readers = db.union(
+            db.select([literal(author_id)]),
+            db.select([Follows.user_following_id])
+            .where(Follows.user_being_followed_id == author_id))
+
+    touch(readers)
+
+
+def fan_out_message(msg):
+    """Add `msg` to its author's timeline and to their followers' timelines.
+
+    `msg` must already be flushed so it has an id. The author always gets
+    the entry; followers only do if the author is under the fan-out limit.
+    """
+
+    db.session.add(TimelineEntry(user_id=msg.user_id,
+                                 message_id=msg.id,
+                                 author_id=msg.user_id))
+
+    if is_fanned_out(msg.user_id):
+        followers = (db.select([Follows.user_following_id,
+                                literal(msg.id, db.BigInteger),
+                                literal(msg.user_id)])
+                     .where(Follows.user_being_followed_id == msg.user_id))
+
+        db.session.execute(TimelineEntry.__table__.insert().from_select(
+            ['user_id', 'message_id', 'author_id'], followers))
+
+    touch_readers(msg.user_id)
+    trim(msg.user_id)
+
+
+def remove_message(message_id):
+    """Remove a deleted warble from every timeline it was pushed to."""
+
+    touch(db.select([TimelineEntry.user_id])
+          .where(TimelineEntry.message_id == message_id))
+
+    (TimelineEntry
+     .query
+     .filter(TimelineEntry.message_id == message_id)
+     .delete(synchronize_session=False))
+
+
+def follow_backfill():
+    """Number of an author's recent warbles pushed to a new reader."""
+
+    return current_app.config.get('TIMELINE_FOLLOW_BACKFILL',
+                                  DEFAULT_FOLLOW_BACKFILL)
+
+
+def add_follow(user_id, followed_id):
+    """Backfill `followed_id`'s recent warbles into `user_id`'s timeline."""
+
+    if is_fanned_out(followed_id):
+        recent = (db.select([literal(user_id), Message.id, Message.user_id])
+                  .where(Message.user_id == followed_id)
+                  .order_by(Message.id.desc())
+                  .limit(follow_backfill()))
+
+        db.session.execute(TimelineEntry.__table__.insert().from_select(
+            ['user_id', 'message_id', 'author_id'], recent))
+
+    touch([user_id])
+    trim(user_id)
+
+
+def remove_follow(user_id, followed_id):
+    """Drop `followed_id`'s warbles from `user_id`'s timeline.
+
+    Call it after decrementing `followed_id`'s followers count, so that
+    losing this follower can bring them back under the fan-out limit.
+    """
+
+    (TimelineEntry
+     .query
+     .filter(TimelineEntry.user_id == user_id,
+             TimelineEntry.author_id == followed_id)
+     .delete(synchronize_session=False))
+    touch([user_id])
+    resume_fan_out([followed_id])
+
+
+def resume_fan_out(author_ids):
+    """Push recent warbles by any of `author_ids` just back under the limit.
+
+    While an author was pulled at read time their warbles weren't pushed,
+    so once they are fanned out again those would disappear from their
+    followers' homepages. Each follower gets the author's newest
+    `TIMELINE_FOLLOW_BACKFILL` warbles they don't have yet, as on a follow.
+
+    Only authors whose followers count is one under the limit (having just
+    lost a follower) are backfilled; after changing `TIMELINE_FANOUT_LIMIT`,
+    run `flask timeline-backfill` instead. `author_ids` is a list or a
+    select of ids.
+    """
+
+    resumed = (db.session
+               .query(User.id)
+               .filter(User.id.in_(author_ids),
+                       User.followers_count == fanout_limit() - 1)
+               .all())
+
+    for (author_id,) in resumed:
+        recent = (db.select([Message.id])
+                  .where(Message.user_id == author_id)
+                  .order_by(Message.id.desc())
+                  .limit(follow_backfill())
+                  .alias('recent'))
+        missing = (db.select([Follows.user_following_id, recent.c.id,
+                              literal(author_id)])
+                   .where(Follows.user_being_followed_id == author_id)
+                   .where(~db.exists().where(db.and_(
+                       TimelineEntry.user_id == Follows.user_following_id,
+                       TimelineEntry.message_id == recent.c.id))))
+
+        db.session.execute(TimelineEntry.__table__.insert().from_select(
+            ['user_id', 'message_id', 'author_id'], missing))
+        touch_readers(author_id)
+
+
+def trim(user_id):
+    """Delete all but the newest `max_entries()` entries for `user_id`."""
+
+    boundary = (db.session
+                .query(TimelineEntry.message_id)
+                .filter(TimelineEntry.user_id == user_id)
+                .order_by(TimelineEntry.message_id.desc())
+                .offset(max_entries())
+                .limit(1)
+                .scalar())
+
+    if boundary is None:
+        return
+
+    (TimelineEntry
+     .query
+     .filter(TimelineEntry.user_id == user_id,
+             TimelineEntry.message_id <= boundary)
+     .delete(synchronize_session=False))
+    touch([user_id])
+
+
+def trim_all(batch_size=1000):
+    """Trim every timeline over `max_entries()`, `batch_size` users at a time.
+
+    Each batch of users is trimmed in its own transaction, so a large site
+    is never locked at once. Returns the number of timelines trimmed.
+    """
+
+    trimmed = 0
+    last_id = None
+
+    while True:
+        users = db.session.query(User.id).order_by(User.id)
+        if last_id is not None:
+            users = users.filter(User.id > last_id)
+        user_ids = [user_id for (user_id,) in users.limit(batch_size)]
+        if not user_ids:
+            return trimmed
+
+        over = (db.session
+                .query(TimelineEntry.user_id)
+                .filter(TimelineEntry.user_id.in_(user_ids))
+                .group_by(TimelineEntry.user_id)
+                .having(func.count() > max_entries())
+                .all())
+        for (user_id,) in over:
+            trim(user_id)
+
+        db.session.commit()
+        trimmed += len(over)
+        last_id = user_ids[-1]
+
+
+def rebuild(user_id):
+    """Recompute `user_id`'s timeline from the follows and messages tables."""
+
+    TimelineEntry.query.filter(TimelineEntry.user_id == user_id).delete(
+        synchronize_session=False)
+
+    followed = (db.select([Follows.user_being_followed_id])
+                .where(Follows.user_following_id == user_id))
+    pulled = pulled_author_ids(user_id)
+
+    authors = db.or_(Message.user_id == user_id,
+                     Message.user_id.in_(followed))
+    if pulled:
+        authors = db.and_(authors, db.or_(Message.user_id == user_id,
+                                          Message.user_id.notin_(pulled)))
+
+    newest = (db.select([literal(user_id), Message.id, Message.user_id])
+              .where(authors)
+              .order_by(Message.id.desc())
+              .limit(max_entries()))
+
+    db.session.execute(TimelineEntry.__table__.insert().from_select(
+        ['user_id', 'message_id', 'author_id'], newest))
+    touch([user_id])
+
+
+def rebuild_all():
+    """Rebuild every user's timeline, committing after each one.
+
+    Returns the number of timelines rebuilt.
+    """
+
+    user_ids = [user_id for (user_id,) in db.session.query(User.id)]
+
+    for user_id in user_ids:
+        rebuild(user_id)
+        db.session.commit()
+
+    return len(user_ids)
+
+
+def home_timeline(user_id, before=None, after=None, size=None, pulled=None,
+                  query=None):
+    """One page of warbles for `user_id`'s homepage.
+
+    Reads the materialized entries and merges in warbles from any followed
+    authors that are too popular to be fanned out (`pulled`, if the caller
+    has looked them up already). `before` and `after` are message id cursors
+    as used by `pagination.seek`.
+
+    The warbles are Message objects loaded as timeline cards, or the rows of
+    `query` if given (a query selecting from messages, with an `id` column).
+    """
+
+    size = size or per_page()
+    if query is None:
+        query = with_profile(Message.query, 'timeline card')
+    entries = (query
+               .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+               .filter(TimelineEntry.user_id == user_id))
+    messages = (seek(entries, TimelineEntry.message_id, before, after)
+                .limit(size + 1)
+                .all())
+
+    if pulled is None:
+        pulled = pulled_author_ids(user_id)
+    if pulled:
+        popular = query.filter(Message.user_id.in_(pulled))
+        messages += (seek(popular, Message.id, before, after)
+                     .limit(size + 1)
+                     .all())
+
+        unique = {msg.id: msg for msg in messages}.values()
+        messages = sorted(unique,
+                          key=lambda msg: msg.id,
+                          reverse=after is None)
+
+    return make_page(messages, size, before, after)
+
+
+def latest_id(user_id, pulled=None):
+    """The newest message id in `user_id`'s home timeline, or None.
+
+    Only the newest entry is read (the last key of the user's range of the
+    primary key), plus the newest warble of each of the `pulled` authors, so
+    it's a cheap check for whether anything was posted since a given id.
+    """
+
+    (newest,) = (db.session
+                 .query(func.max(TimelineEntry.message_id))
+                 .filter(TimelineEntry.user_id == user_id)
+                 .one())
+
+    if pulled is None:
+        pulled = pulled_author_ids(user_id)
+    if pulled:
+        (pulled_newest,) = (db.session
+                            .query(func.max(Message.id))
+                            .filter(Message.user_id.in_(pulled))
+                            .one())
+        newest = max(newest or 0, pulled_newest or 0) or None
+
+    return newest
+
+
+def marker(user_id, pulled=None):
+    """A value that changes whenever `user_id`'s home timeline does.
+
+    It is the user's stored `timeline_version`, which `touch` bumps for
+    anything that changes the materialized entries, the profiles of their
+    authors or which of them the user has liked. Popular followed authors
+    read at request time (`pulled`, as for `home_timeline`) add their newest
+    warble id, warble count and profile versions, so a new warble, a deleted
+    one and a renamed author all change it. No entries are read, so it is a
+    cheap validator for cached copies.
+    """
+
+    (version,) = (db.session
+                  .query(User.timeline_version)
+                  .filter(User.id == user_id)
+                  .one())
+
+    if pulled is None:
+        pulled = pulled_author_ids(user_id)
+    if not pulled:
+        return (version,)
+
+    (newest,) = (db.session
+                 .query(func.max(Message.id))
+                 .filter(Message.user_id.in_(pulled))
+                 .one())
+    count, profiles = (db.session
+                       .query(func.sum(User.messages_count),
+                              func.sum(User.profile_version))
+                       .filter(User.id.in_(pulled))
+                       .one())
+
+    return version, newest, count, profiles
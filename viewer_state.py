@@ -0,0 +1,76 @@
+"""Batched follow/like state of the logged-in user for a page of items.
+
+Rather than asking `g.user.is_following(user)` once per card, views resolve
+the viewer's relationship to every user and message on the page up front,
+in a single UNION query, and hand the result to the template.
+"""
+
+from sqlalchemy import literal_column, select, union_all
+
+from models import db, Follows, Like
+
+
+class ViewerState:
+    """Which of a page's users/messages the viewer follows, is followed by
+    or has liked."""
+
+    def __init__(self, following=(), followed_by=(), liked=()):
+        self.following = set(following)
+        self.followed_by = set(followed_by)
+        self.liked = set(liked)
+
+    def is_following(self, user):
+        """Does the viewer follow `user` (a User or user id)?"""
+
+        return getattr(user, 'id', user) in self.following
+
+    def is_followed_by(self, user):
+        """Does `user` (a User or user id) follow the viewer?"""
+
+        return getattr(user, 'id', user) in self.followed_by
+
+    def has_liked(self, message):
+        """Has the viewer liked `message` (a Message or message id)?"""
+
+        return getattr(message, 'id', message) in self.liked
+
+
+def resolve_viewer_state(viewer, user_ids=(), message_ids=()):
+    """Look up `viewer`'s follow/like state for the given users and messages.
+
+    `viewer` may be None or falsy (logged out, or a `CurrentUser` whose
+    account is gone), in which case nothing is followed or liked and no
+    query is made.
+    """
+
+    user_ids = list(set(user_ids))
+    message_ids = list(set(message_ids))
+
+    if not viewer or not (user_ids or message_ids):
+        return ViewerState()
+
+    lookups = []
+
+    if user_ids:
+        lookups.append(
+            select([literal_column("'following'"),
+                    Follows.user_being_followed_id])
+            .where(Follows.user_following_id == viewer.id)
+            .where(Follows.user_being_followed_id.in_(user_ids)))
+        lookups.append(
+            select([literal_column("'followed_by'"),
+                    Follows.user_following_id])
+            .where(Follows.user_being_followed_id == viewer.id)
+            .where(Follows.user_following_id.in_(user_ids)))
+
+    if message_ids:
+        lookups.append(
+            select([literal_column("'liked'"), Like.message_id])
+            .where(Like.user_id == viewer.id)
+            .where(Like.message_id.in_(message_ids)))
+
+    found = {'following': [], 'followed_by': [], 'liked': []}
+    for kind, item_id in db.session.execute(union_all(*lookups)):
+        found[kind].append(item_id)
+
+    return ViewerState(**found)